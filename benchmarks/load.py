@@ -0,0 +1,388 @@
+"""
+HTTP load benchmarks of the API.
+
+Starts the app with uvicorn on localhost, with a synthetic KPI dataset and a
+temporary copy of the user database, and runs scripted scenarios against it from
+several client threads (one keep-alive connection each). For every scenario it
+reports the throughput and the p50/p95/p99 latencies, and compares them with a
+baseline file if given.
+
+    python benchmarks/load.py                           # Run every scenario
+    python benchmarks/load.py circular list -d 20 -c 16
+    python benchmarks/load.py --save-baseline           # Store the results as baseline
+    python benchmarks/load.py --baseline                # Flag regressions (exit code 1)
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Self
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_BASELINE = Path(__file__).with_name("baseline.json")
+
+# Users of the fake database
+USERNAME = "heman"
+PASSWORD = "password"
+
+# KPIs of every area, in the order of the KPI matrix
+AREA_KPIS = {
+    area: list(content["kpi_weights"])
+    for area, content in json.loads(
+        Path(os.getenv("AREAS_FILE", ROOT / "src/api_sk/data/areas.json")).read_text()
+    ).items()
+}
+
+
+class Server:
+    """
+    The app served by uvicorn in a subprocess, on a free port of localhost.
+
+    Parameters:
+        districts (int): Districts of the synthetic dataset.
+        workers (int): Server processes.
+    """
+
+    def __init__(self, districts: int, workers: int):
+        self.districts = districts
+        self.workers = workers
+        self.directory = tempfile.TemporaryDirectory(prefix="apisk-bench-")
+        self.process = None
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+
+    def __enter__(self) -> Self:
+        directory = Path(self.directory.name)
+        rng = np.random.default_rng(0)
+        columns = sum(map(len, AREA_KPIS.values()))
+        kpis = rng.integers(0, 101, (self.districts, columns)) / 100
+        ids = np.array([f"d{i}" for i in range(self.districts)])
+        np.savez(directory / "kpis.npz", ids=ids, kpis=kpis)
+
+        env = {
+            **os.environ,
+            "SECRET_KEY": secrets.token_hex(32),
+            "KPI_DATA": str(directory / "kpis.npz"),
+            "USERS_DB": str(directory / "users.db"),
+        }
+        if self.workers > 1:
+            env["TASK_DB"] = str(directory / "tasks.db")
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "api_sk:app",
+                "--port",
+                str(self.port),
+                "--workers",
+                str(self.workers),
+                "--log-level",
+                "warning",
+            ],
+            env=env,
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+        )
+
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("The server exited while starting.")
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", self.port, 1)
+                connection.request("GET", "/list?limit=1")
+                connection.getresponse().read()
+                return self
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError("The server did not start in 60 seconds.")
+
+    def __exit__(self, *exc):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+        self.directory.cleanup()
+
+    def connection(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+
+
+def request(
+    connection: http.client.HTTPConnection,
+    method: str,
+    path: str,
+    body: bytes | None = None,
+    headers: dict | None = None,
+) -> tuple[int, bytes]:
+    """
+    Sends a request through a keep-alive connection and reads the whole response.
+    """
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def get_token(connection: http.client.HTTPConnection) -> str:
+    """
+    Logs in as the benchmark user and returns the access token.
+    """
+    form = urllib.parse.urlencode({"username": USERNAME, "password": PASSWORD})
+    status, body = request(
+        connection,
+        "POST",
+        "/token",
+        form.encode(),
+        {"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    if status != 200:
+        raise RuntimeError(f"Login failed with status {status}: {body[:200]!r}")
+    return json.loads(body)["access_token"]
+
+
+def random_split(rng: random.Random, names: list[str]) -> dict[str, float]:
+    """
+    Splits 1 among some names in random hundredths.
+    """
+    cuts = sorted(rng.randint(0, 100) for _ in range(len(names) - 1))
+    parts = [b - a for a, b in zip([0, *cuts], [*cuts, 100])]
+    return {name: part / 100 for name, part in zip(names, parts)}
+
+
+def random_weights(rng: random.Random) -> dict:
+    """
+    Draws random valid CCIWeights.
+    """
+    area_weights = random_split(rng, list(AREA_KPIS))
+    return {
+        area: {
+            "area_weight": area_weights[area],
+            "kpi_weights": random_split(rng, kpis),
+        }
+        for area, kpis in AREA_KPIS.items()
+    }
+
+
+# Scenarios: each one builds, for a client thread, the function sending one request
+# and returning its status. Tokens are shared by the threads of a run.
+
+
+def scenario_token(server: Server, token: str, rng: random.Random):
+    form = urllib.parse.urlencode({"username": USERNAME, "password": PASSWORD})
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    connection = server.connection()
+    return lambda: request(connection, "POST", "/token", form.encode(), headers)[0]
+
+
+def scenario_circular(server: Server, token: str, rng: random.Random):
+    # We draw the weights from a fixed pool, so some requests hit the result cache
+    pool = [json.dumps(random_weights(rng)).encode() for _ in range(50)]
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    connection = server.connection()
+
+    def send():
+        return request(connection, "POST", "/circular", rng.choice(pool), headers)[0]
+
+    return send
+
+
+def scenario_hello(server: Server, token: str, rng: random.Random):
+    headers = {"Authorization": f"Bearer {token}"}
+    connection = server.connection()
+    return lambda: request(connection, "GET", "/hello", headers=headers)[0]
+
+
+def scenario_list(server: Server, token: str, rng: random.Random):
+    # Every request creates a task and then lists the first page, so the number of
+    # tasks grows with the run (latencies include both requests)
+    headers = {"Authorization": f"Bearer {token}"}
+    connection = server.connection()
+
+    def send():
+        request(connection, "GET", "/hello", headers=headers)
+        return request(connection, "GET", "/list?limit=100")[0]
+
+    return send
+
+
+SCENARIOS = {
+    "token": scenario_token,
+    "circular": scenario_circular,
+    "hello": scenario_hello,
+    "list": scenario_list,
+}
+
+
+def run_scenario(
+    server: Server, name: str, token: str, duration: float, concurrency: int
+) -> dict:
+    """
+    Runs a scenario from `concurrency` client threads for `duration` seconds.
+
+    Parameters:
+        server (Server): Running server.
+        name (str): Name of the scenario.
+        token (str): Access token.
+        duration (float): Seconds the scenario runs.
+        concurrency (int): Client threads.
+
+    Returns:
+        dict: Requests, errors, throughput (requests per second) and latency percentiles in milliseconds.
+    """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    start = time.perf_counter()
+    stop = start + duration
+
+    def client(seed: int):
+        send = SCENARIOS[name](server, token, random.Random(seed))
+        local, failed = [], 0
+        while time.perf_counter() < stop:
+            sent = time.perf_counter()
+            try:
+                ok = send() < 400
+            except OSError:
+                ok = False
+            local.append(time.perf_counter() - sent)
+            failed += not ok
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    milliseconds = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99]) if latencies else [0] * 3
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Lists the regressions of some results against a baseline: throughput lower or
+    p95/p99 latency higher than the baseline by more than `tolerance` (a fraction).
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {result['throughput']:.1f}/s, "
+                f"baseline {base['throughput']:.1f}/s"
+            )
+        for key in ("p95_ms", "p99_ms"):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {key} {result[key]:.1f}, baseline {base[key]:.1f}"
+                )
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{name}: {result['errors']} errors")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load benchmarks of the API.")
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        help=f"Scenarios to run, all by default: {', '.join(SCENARIOS)}.",
+    )
+    parser.add_argument("-d", "--duration", type=float, default=10, help="Seconds.")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Clients.")
+    parser.add_argument("--districts", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=1, help="Server processes.")
+    parser.add_argument("-o", "--output", help="File where the results are written.")
+    parser.add_argument(
+        "--baseline",
+        nargs="?",
+        const=DEFAULT_BASELINE,
+        help=f"Baseline to compare with ({DEFAULT_BASELINE.name} by default).",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        nargs="?",
+        const=DEFAULT_BASELINE,
+        help="Store the results as baseline.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative change flagged as a regression. Default 0.2.",
+    )
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}.")
+
+    results = {}
+    with Server(args.districts, args.workers) as server:
+        token = get_token(server.connection())
+        for name in args.scenarios or SCENARIOS:
+            results[name] = run_scenario(
+                server, name, token, args.duration, args.concurrency
+            )
+            r = results[name]
+            print(
+                f"{name:<10} {r['requests']:>7} req {r['errors']:>5} err "
+                f"{r['throughput']:>9.1f} req/s  p50 {r['p50_ms']:8.1f} ms  "
+                f"p95 {r['p95_ms']:8.1f} ms  p99 {r['p99_ms']:8.1f} ms"
+            )
+
+    report = {
+        "settings": {
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "districts": args.districts,
+            "workers": args.workers,
+            "cpus": os.cpu_count(),
+        },
+        "scenarios": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline.get("settings") != report["settings"]:
+            print("Warning: the baseline was run with other settings.")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,35 @@
 # main.py
 
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
 from fastapi import FastAPI
 from api_sk.core.config import settings
+from api_sk.core.executor import model_executor
+from api_sk.core.metrics import MetricsMiddleware, monitor_loop_lag
 from api_sk.core.routers import api_router
+from api_sk.core.tasks import task_manager
+from api_sk.user.superuser_endpoints import flush_kpis
 import argparse
 import uvicorn
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Worker processes for the model live as long as the application, and so does
+    # the watcher of cancellations requested by other server workers
+    model_executor.start()
+    watcher = asyncio.create_task(task_manager.watch())
+    lag_monitor = asyncio.create_task(monitor_loop_lag(settings.METRICS_LOOP_INTERVAL))
+    yield
+    await flush_kpis()  # Updated KPIs are published before the server stops
+    lag_monitor.cancel()
+    watcher.cancel()
+    model_executor.shutdown()
+
+
 # Mounts the API and include all routers onto it
 
 app = FastAPI(
@@ -13,13 +37,33 @@ app = FastAPI(
     version=settings.PROJECT_VERSION,
     description=settings.DESCRIPTION,
     contact=settings.CONTACT,
+    lifespan=lifespan,
 )
 app.include_router(api_router)
+app.add_middleware(MetricsMiddleware)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Input for the port address.")
     parser.add_argument("-P", type=int, default=8000, help="Port address.")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of server processes."
+    )
     args = parser.parse_args()
 
-    uvicorn.run(app, host="0.0.0.0", port=args.P)
+    if args.workers <= 1:
+        uvicorn.run(app, host="0.0.0.0", port=args.P)
+        return
+
+    # The workers import the app again, reading these settings from the
+    # environment. We share the tasks through a database of this run, and split the
+    # cores between the model processes of every worker.
+    if not os.getenv("TASK_DB"):
+        os.environ["TASK_DB"] = str(
+            Path(tempfile.mkdtemp(prefix="apisk-")) / "tasks.db"
+        )
+    if not os.getenv("PROCESS_WORKERS"):
+        cores = os.cpu_count() or 1
+        os.environ["PROCESS_WORKERS"] = str(max(1, cores // args.workers))
+
+    uvicorn.run("api_sk:app", host="0.0.0.0", port=args.P, workers=args.workers)
@@ -1,4 +1,6 @@
 # auth.py
+import asyncio
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
 from fastapi import Depends, HTTPException, APIRouter, status
@@ -8,9 +10,12 @@ from fastapi.security import (
     SecurityScopes,
 )
 from api_sk.auth.hashing import Hasher
+from api_sk.auth.token_cache import token_cache
+from api_sk.data.user_store import user_store
 from api_sk.schemas.user_schema import UserInDB
-from api_sk.schemas.token_schema import Token, TokenData
+from api_sk.schemas.token_schema import Token
 from api_sk.core.config import settings
+from api_sk.core.metrics import token_verification
 import jwt
 
 
@@ -19,6 +24,9 @@ router = APIRouter()
 # Creates a Bearer scheme for authentication with OAuth2
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", scopes=settings.SCOPES)
 
+# Logins whose password is being verified
+login_slots = asyncio.Semaphore(settings.MAX_CONCURRENT_LOGINS)
+
 
 #################################
 # Functions for token management
@@ -76,20 +84,29 @@ def check_token(
         headers={"WWW-Authenticate": authenticate_value},
     )
 
-    # We read the token and check if it is correct
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=settings.ALGORITHM)
-    except:
-        raise credentials_exception
+    # We read the token and check if it is correct, unless it was already verified
+    start = time.perf_counter()
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(
+                token, settings.SECRET_KEY, algorithms=settings.ALGORITHM
+            )
+        except:
+            raise credentials_exception
+        finally:
+            token_verification.labels("miss").observe(time.perf_counter() - start)
+        token_cache.put(token, payload)
+    else:
+        token_verification.labels("hit").observe(time.perf_counter() - start)
 
     # We now check the scopes if any
     if security_scopes.scopes:
         authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'
         token_scopes = payload.get("scopes", [])
-        token_data.scopes = TokenData(scopes=token_scopes)
 
         for scope in security_scopes.scopes:
-            if scope not in token_data.scopes:
+            if scope not in token_scopes:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Not enough permissions.",
@@ -139,7 +156,7 @@ async def token_request(
     """
 
     # We query the username in the DB
-    user_dict = settings.USERS_DB.get(form_data.username)
+    user_dict = await user_store.get_user_async(form_data.username)
     if not user_dict:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -161,8 +178,19 @@ async def token_request(
     # We now create an object user which stores the user data and we hash the password introduced by the user
     user = UserInDB(**user_dict)
 
-    # Checks the password against the one stored in the DB
-    if not Hasher.verify_password(form_data.password, user.hashed_password):
+    # Checks the password against the one stored in the DB, rejecting the login if
+    # too many are already being checked
+    if login_slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many logins in progress, try again later.",
+            headers={"Retry-After": "1"},
+        )
+    async with login_slots:
+        valid = await Hasher.verify_password_async(
+            form_data.password, user.hashed_password
+        )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -1,7 +1,19 @@
 # hashing.py
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 import bcrypt
 
+from api_sk.core.config import settings
+from api_sk.core.metrics import password_verification
+
+# Threads running bcrypt, which releases the GIL while hashing. Bounding them
+# bounds the CPU that logins can take from the rest of the API.
+hashing_pool = ThreadPoolExecutor(
+    max_workers=settings.HASH_WORKERS, thread_name_prefix="bcrypt"
+)
+
 # Class containing methods to hash passwords
 
 
@@ -12,18 +24,19 @@ class Hasher:
     """
 
     @staticmethod
-    def hash_passw(password):
+    def hash_passw(password, rounds=None):
         """
         Hashes the password using the Bcrypt algorithm
 
         Parameters:
             password (str): Plain password in string format
+            rounds (int|None, optional): Default value is None. Bcrypt cost factor. If None, `settings.BCRYPT_ROUNDS` is used.
 
         Returns:
             str: Password hashed
         """
         pwd_bytes = password.encode("utf-8")
-        salt = bcrypt.gensalt()
+        salt = bcrypt.gensalt(rounds=rounds or settings.BCRYPT_ROUNDS)
         hashed_password = bcrypt.hashpw(password=pwd_bytes, salt=salt)
         return hashed_password
 
@@ -43,6 +56,29 @@ class Hasher:
 
         """
         password_byte_enc = plain_password.encode("utf-8")
-        return bcrypt.checkpw(
-            password=password_byte_enc, hashed_password=hashed_password
+        with password_verification.time():
+            return bcrypt.checkpw(
+                password=password_byte_enc, hashed_password=hashed_password
+            )
+
+    @staticmethod
+    async def hash_passw_async(password, rounds=None):
+        """
+        Same as `hash_passw`, run in the hashing pool so that the event loop is
+        not blocked.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            hashing_pool, Hasher.hash_passw, password, rounds
+        )
+
+    @staticmethod
+    async def verify_password_async(plain_password, hashed_password):
+        """
+        Same as `verify_password`, run in the hashing pool so that the event loop
+        is not blocked.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            hashing_pool, Hasher.verify_password, plain_password, hashed_password
         )
@@ -0,0 +1,130 @@
+# token_cache.py
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from api_sk.core.config import settings
+
+
+class TokenCache:
+    """
+    LRU cache of verified token payloads, so that a token sent repeatedly is only
+    decoded and verified once.
+
+    Entries are keyed by the digest of the token and expire at the `exp` claim of
+    the token. They are tied to the secret key they were verified with, so the
+    whole cache is dropped when the key changes.
+
+    Tokens are checked by sync dependencies, which FastAPI runs in its thread pool,
+    so every method holds a lock.
+
+    Parameters:
+        max_entries (int): Maximum number of cached tokens.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.secret_key = settings.SECRET_KEY
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # token digest -> (expiry time, payload)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def _check_secret(self):
+        # Called with the lock held
+        if settings.SECRET_KEY != self.secret_key:
+            self._entries.clear()
+            self.secret_key = settings.SECRET_KEY
+
+    def get(self, token: str) -> dict | None:
+        """
+        Returns the payload of a verified token, or None if missing or expired.
+
+        Parameters:
+            token (str): Encoded JWT token.
+
+        Returns:
+            dict|None: Decoded payload.
+        """
+        key = self._digest(token)
+        with self._lock:
+            self._check_secret()
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return dict(entry[1])
+
+    def put(self, token: str, payload: dict):
+        """
+        Stores the payload of a verified token, evicting the least recently used
+        entries if needed. Tokens without an `exp` claim are not stored.
+
+        Parameters:
+            token (str): Encoded JWT token.
+            payload (dict): Decoded payload.
+        """
+        if "exp" not in payload or self.max_entries <= 0:
+            return
+
+        key = self._digest(token)
+        entry = (payload["exp"], dict(payload))
+        with self._lock:
+            self._check_secret()
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def drop_user(self, username: str):
+        """
+        Drops the tokens of a user, e.g. after it is deleted.
+
+        Parameters:
+            username (str): Username stored in the `user` claim.
+        """
+        with self._lock:
+            for key in [
+                k for k, (_, p) in self._entries.items() if p.get("user") == username
+            ]:
+                del self._entries[key]
+
+    def clear(self):
+        """
+        Drops every entry. Counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the usage counters of the cache.
+        """
+        with self._lock:
+            entries, hits, misses = len(self._entries), self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE)
@@ -1,9 +1,9 @@
 import os
+from pathlib import Path
 
 from dotenv import load_dotenv
 
 from api_sk.__version__ import __version__
-from api_sk.data.fake_db import users_db
 
 # Setting for the API
 load_dotenv()
@@ -14,7 +14,15 @@ class Settings:
     DESCRIPTION: str = "Circular index API for the vCity project."
     CONTACT: dict[str, str] = {"name": "M. Herrero", "e-mail": "mherrero@bsc.es"}
     PROJECT_VERSION: str = __version__
-    USERS_DB = users_db
+
+    # User database (SQLite file, in the working directory by default so that it is
+    # not written into the installed package, JSON file imported when it is first
+    # created and threads serving it to the endpoints)
+    USERS_DB = os.getenv("USERS_DB", "users.db")
+    USERS_DB_JSON = os.getenv(
+        "USERS_DB_JSON", str(Path(__file__).parents[1] / "data/users_db_fake.json")
+    )
+    USERS_DB_POOL_SIZE = int(os.getenv("USERS_DB_POOL_SIZE", 4))
 
     # Scopes for user authorization
     SCOPES = {
@@ -26,8 +34,96 @@ class Settings:
     ALGORITHM = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES = 15
 
+    # Verified tokens kept to skip decoding them again (0 disables the cache)
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+
+    # Password hashing (bcrypt cost factor for new hashes, threads running bcrypt
+    # and logins being verified at once, further ones are rejected)
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+    HASH_WORKERS = int(os.getenv("HASH_WORKERS", min(4, os.cpu_count() or 1)))
+    MAX_CONCURRENT_LOGINS = int(os.getenv("MAX_CONCURRENT_LOGINS", 16))
+
+    # Areas of the model and their KPIs, with default weights
+    AREAS_FILE = os.getenv(
+        "AREAS_FILE", str(Path(__file__).parents[1] / "data/areas.json")
+    )
+
     # weighted sum tolerance
-    TOLERANCE = os.getenv("TOLERANCE", 0.001)
+    TOLERANCE = float(os.getenv("TOLERANCE", 0.001))
+
+    # District KPI dataset: a dataset directory, memory-mapped and shared by every
+    # process (see api_sk.model.dataset), or a .npz file with `ids` and `kpis` arrays
+    # loaded in memory
+    KPI_DATA = os.getenv("KPI_DATA")
+    # Seconds KPI updates wait before they are published to the dataset directory,
+    # so that the updates made meanwhile are written as a single version
+    KPI_PUBLISH_DELAY = float(os.getenv("KPI_PUBLISH_DELAY", 1))
+
+    # CSV file with the spatial hierarchy of the districts: an `id` column, one
+    # column per coarser level (e.g. borough, city) and an optional `weight` column
+    HIERARCHY = os.getenv("HIERARCHY")
+
+    # Directory with the KPIs of the districts over time, appended one period at a
+    # time (see api_sk.model.history)
+    HISTORY = os.getenv("HISTORY")
+
+    # Area KPI columns cached per area, for different KPI weights of the area
+    AREA_CACHE_ENTRIES = int(os.getenv("AREA_CACHE_ENTRIES", 16))
+
+    # KPI ingestion (rows validated at a time and bad rows described in reports)
+    INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", 50000))
+    INGEST_MAX_ERRORS = int(os.getenv("INGEST_MAX_ERRORS", 100))
+
+    # Districts computed and sent at a time in streamed responses
+    STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 10000))
+
+    # Maximum number of weighting scenarios computed in a single request
+    MAX_SCENARIOS = int(os.getenv("MAX_SCENARIOS", 100))
+
+    # Cache of model results (size budget in bytes and time to live in seconds)
+    CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 256 * 1024**2))
+    CACHE_TTL = float(os.getenv("CACHE_TTL", 600))
+
+    # Results of different weights kept sorted for ranking and filter queries
+    QUERY_INDEX_ENTRIES = int(os.getenv("QUERY_INDEX_ENTRIES", 8))
+
+    # Seconds between samples of the event loop lag in the metrics
+    METRICS_LOOP_INTERVAL = float(os.getenv("METRICS_LOOP_INTERVAL", 0.5))
+
+    # On-demand profiling of requests (seconds between samples and profiles kept)
+    PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.001))
+    MAX_PROFILES = int(os.getenv("MAX_PROFILES", 20))
+
+    # Background tasks (running at once, finished tasks kept and seconds they are kept)
+    MAX_RUNNING_TASKS = int(os.getenv("MAX_RUNNING_TASKS", 4))
+    MAX_FINISHED_TASKS = int(os.getenv("MAX_FINISHED_TASKS", 1000))
+    TASK_RESULT_TTL = float(os.getenv("TASK_RESULT_TTL", 3600))
+
+    # SQLite file where the tasks are registered, shared by the server workers. If
+    # not set, tasks are only kept in memory and seen by the process running them.
+    TASK_DB = os.getenv("TASK_DB")
+    # Threads reading the task database, so that the endpoints do not block on it
+    TASK_DB_POOL_SIZE = int(os.getenv("TASK_DB_POOL_SIZE", 4))
+    # Seconds without a heartbeat after which a worker is taken as stopped, and its
+    # queued and running tasks as failed
+    TASK_OWNER_TIMEOUT = float(os.getenv("TASK_OWNER_TIMEOUT", 30))
+
+    # Worker processes for the model computations (0 runs them in threads)
+    PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", os.cpu_count() or 1))
+
+    # Task event stream: events kept per client, seconds between progress checks
+    # of a running computation and seconds between keep-alive comments
+    EVENT_BUFFER = int(os.getenv("EVENT_BUFFER", 64))
+    PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 0.25))
+    EVENT_HEARTBEAT = float(os.getenv("EVENT_HEARTBEAT", 15))
+
+    # Sensitivity analysis (maximum samples per run, district x sample values
+    # evaluated per chunk and samples kept to estimate percentiles)
+    MAX_SENSITIVITY_SAMPLES = int(os.getenv("MAX_SENSITIVITY_SAMPLES", 1_000_000))
+    SENSITIVITY_CHUNK_SIZE = int(os.getenv("SENSITIVITY_CHUNK_SIZE", 4_000_000))
+    SENSITIVITY_PERCENTILE_SAMPLES = int(
+        os.getenv("SENSITIVITY_PERCENTILE_SAMPLES", 1000)
+    )
 
 
 settings = Settings()
@@ -1,24 +1,56 @@
 # endpoints.py
 import asyncio
-import datetime
 import logging
 import uuid
-from typing import Annotated
+from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
 from api_sk.auth.auth import check_token
+from api_sk.core.config import settings
+from api_sk.core.events import FINAL_STATUSES, task_events
+from api_sk.core.executor import model_executor
+from api_sk.core.metrics import model_computation, render
+from api_sk.core.tasks import task_manager
+from api_sk.model.cache import result_cache, weights_key
 from api_sk.model.circular import (
     CCIWeights,
-    District,
-    DistrictIndicators,
+    DistrictPage,
     Districts,
+    Rollup,
+    ScenarioDistricts,
+    Trajectories,
 )
-from api_sk.schemas import schemas
+from api_sk.model.engine import (
+    RESULT_COLUMNS,
+    encode_columns,
+    encode_districts,
+    encode_level,
+    encode_scenarios,
+    engine,
+    stream_districts,
+)
+from api_sk.model.history import encode_trajectories, history, history_cache
+from api_sk.model.query import (
+    ResultIndex,
+    decode_cursor,
+    encode_cursor,
+    encode_page,
+    index_cache,
+    parse_ranges,
+)
+from api_sk.model.sensitivity import SensitivityRequest, run_sensitivity
+from api_sk.schemas.schemas import ModelTask
 
 router = APIRouter()
 logger = logging.getLogger("uvicorn.error")  # Logger for logging info
-tasks = {}  # Dictionary to store the queue of tasks running/completed
+
+# Media types of /circular, the first one is the default
+CIRCULAR_MEDIA_TYPES = {
+    "application/json": ("districts:", encode_districts),
+    "application/x-npz": ("columns:", encode_columns),
+}
 
 # Metadata for the tags in the documentation
 tags_metadata = [
@@ -30,6 +62,10 @@ tags_metadata = [
         "name": "Task management",
         "description": "Operations to manage the tasks being executed in the backend.",
     },
+    {
+        "name": "Monitoring",
+        "description": "Operational metrics of the API.",
+    },
     {
         "name": "User management",
         "description": "Operations to manage the tasks being executed in the backend.",
@@ -37,18 +73,6 @@ tags_metadata = [
 ]
 
 
-def after_task_done(task, task_id):
-    """
-    After a task is finished, it changes its status in the queue to completed.
-
-    ### Parameters:
-    - task (asyncio.task): Task being executed.
-    - task_id (str): ID of the task, acting as the key of a dictionary.
-    """
-
-    tasks[task_id].status = "Completed"
-
-
 # Generic example of a GET endpoint
 
 
@@ -72,39 +96,395 @@ async def hello_api(token: Annotated[str, Depends(check_token)]):
             logger.info(f"Run with task ID: {task_id} cancelled")
             raise  # Propagate the cancellation exception
 
-    time = str(datetime.datetime.now())
-
-    task = asyncio.create_task(setup_task(task_id))
-    task_ob = schemas.ModelTask(task=task, start_time=time, type="Example")
-    tasks[task_id] = task_ob
-    task.add_done_callback(lambda t: after_task_done(t, task_id))
+    task_manager.submit(task_id, lambda: setup_task(task_id), "Example")
     return {"task_id": task_id}
 
 
-@router.post("/circular", summary="Generic endpoint.", tags=["Model endpoints"])
+def negotiate(accept: str | None, offered: list[str]) -> str | None:
+    """
+    Picks the offered media type the client prefers, from an Accept header.
+
+    Parameters:
+        accept (str|None): Value of the Accept header. If None, the first offered type is used.
+        offered (list[str]): Media types the endpoint can produce, by server preference.
+
+    Returns:
+        str|None: Chosen media type, or None if none is acceptable.
+    """
+    if not accept:
+        return offered[0]
+
+    best, best_q = None, 0.0
+    for item in accept.split(","):
+        media_type, *params = (p.strip() for p in item.split(";"))
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        # We match wildcards with the first offered type they cover, and on equal
+        # q values the first item of the header wins
+        for candidate in offered:
+            main = candidate.split("/")[0]
+            if media_type in (candidate, f"{main}/*", "*/*"):
+                if q > best_q:
+                    best, best_q = candidate, q
+                break
+    return best
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Checks whether an If-None-Match header lists an entity tag, with the weak
+    comparison the header uses.
+
+    Parameters:
+        if_none_match (str|None): Value of the If-None-Match header.
+        etag (str): Entity tag of the current representation, quoted.
+
+    Returns:
+        bool: True if the client already has the representation.
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def not_modified(etag: str, headers: dict | None = None) -> Response:
+    """
+    Builds the 304 response of a representation the client already has.
+    """
+    return Response(status_code=304, headers={"ETag": etag, **(headers or {})})
+
+
+@router.post(
+    "/circular",
+    summary="Circularity index of every district.",
+    tags=["Model endpoints"],
+    responses={
+        200: {
+            "content": {
+                "application/x-npz": {"schema": {"type": "string", "format": "binary"}}
+            }
+        },
+        304: {"description": "The districts match the ETag in If-None-Match."},
+        406: {"description": "None of the accepted media types is available."},
+    },
+)
 async def circular_api(
-    cci_weights: CCIWeights, token: Annotated[str, Depends(check_token)]
+    cci_weights: CCIWeights,
+    token: Annotated[str, Depends(check_token)],
+    accept: Annotated[str | None, Header()] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
 ) -> Districts:
     """
     Return weighted value. User must be authenticated.
 
+    The area KPIs and the cci of all districts are computed at once by the engine,
+    and the response is encoded directly from its results. Encoded responses are
+    cached by weights, media type and dataset version.
+
+    Responses carry an ETag derived from the same key. The request only reads
+    data, so if the If-None-Match header lists the ETag a 304 response is sent
+    without any body, as for a GET.
+
+    The media type is negotiated from the Accept header:
+    - `application/json` (default): Districts object.
+    - `application/x-npz`: NumPy `.npz` archive with one array per column (`id`, `D`, `ECR`, `M`, `W` and `cci`), e.g. loaded with `pandas.DataFrame(dict(numpy.load(file)))`.
+
+    ### Parameters:
+    - cci_weights (CCIWeights): Weights for areas and KPIs.
     """
-    return Districts(
-        districts=[
-            District(id="1", indicators=DistrictIndicators()),
-            District(id="2", indicators=DistrictIndicators()),
-            District(id="3", indicators=DistrictIndicators()),
-            District(id="4", indicators=DistrictIndicators()),
-            District(id="5", indicators=DistrictIndicators()),
-            District(id="6", indicators=DistrictIndicators()),
-            District(id="7", indicators=DistrictIndicators()),
-            District(id="8", indicators=DistrictIndicators()),
-            District(id="9", indicators=DistrictIndicators()),
-            District(id="10", indicators=DistrictIndicators()),
-        ]
+    media_type = negotiate(accept, list(CIRCULAR_MEDIA_TYPES))
+    if media_type is None:
+        raise HTTPException(
+            status_code=406,
+            detail=f"Available media types: {', '.join(CIRCULAR_MEDIA_TYPES)}.",
+        )
+    prefix, encode = CIRCULAR_MEDIA_TYPES[media_type]
+
+    key = prefix + weights_key(cci_weights)
+    # We read the version once: an update may change it while computing, and the
+    # body is then cached under the version before
+    version = engine.version
+    etag = f'"{key.replace(":", "-")}-{version}"'
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, {"Vary": "Accept"})
+    body = result_cache.get(key, version)
+
+    if body is None:
+        try:
+            with model_computation.labels("circular").time():
+                results = engine.compute(cci_weights)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        body = encode(engine, results)
+        result_cache.put(key, version, body)
+
+    return Response(
+        content=body, media_type=media_type, headers={"ETag": etag, "Vary": "Accept"}
     )
 
 
+@router.post(
+    "/circular/stream",
+    summary="Circularity index of every district, streamed.",
+    tags=["Model endpoints"],
+)
+async def circular_stream_api(
+    cci_weights: CCIWeights,
+    token: Annotated[str, Depends(check_token)],
+    output_format: Annotated[
+        Literal["ndjson", "json"], Query(alias="format")
+    ] = "ndjson",
+) -> StreamingResponse:
+    """
+    Return weighted value, streaming the districts as they are computed. User must
+    be authenticated.
+
+    ### Parameters:
+    - cci_weights (CCIWeights): Weights for areas and KPIs.
+    - format (str): `ndjson` writes one District per line. `json` writes the same body as /circular, sent in chunks.
+    """
+    ndjson = output_format == "ndjson"
+    return StreamingResponse(
+        stream_districts(engine, cci_weights, ndjson=ndjson),
+        media_type="application/x-ndjson" if ndjson else "application/json",
+    )
+
+
+@router.post(
+    "/circular/scenarios",
+    summary="Circularity index of every district for several weighting scenarios.",
+    tags=["Model endpoints"],
+)
+async def circular_scenarios_api(
+    scenarios: list[CCIWeights], token: Annotated[str, Depends(check_token)]
+) -> ScenarioDistricts:
+    """
+    Return the cci of every district for each scenario, in the order they were
+    given. User must be authenticated.
+
+    Every scenario is validated as in /circular, and all of them are computed in a
+    single pass.
+
+    ### Parameters:
+    - scenarios (list[CCIWeights]): Weights of each scenario.
+    """
+    if not scenarios:
+        raise HTTPException(status_code=422, detail="No scenarios given.")
+    if len(scenarios) > settings.MAX_SCENARIOS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {settings.MAX_SCENARIOS} scenarios are allowed.",
+        )
+
+    key = "scenarios:" + weights_key(scenarios)
+    version = engine.version
+    body = result_cache.get(key, version)
+
+    if body is None:
+        try:
+            with model_computation.labels("scenarios").time():
+                results = engine.compute_scenarios(scenarios)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        body = encode_scenarios(engine, results)
+        result_cache.put(key, version, body)
+
+    return Response(content=body, media_type="application/json")
+
+
+@router.post(
+    "/circular/query",
+    summary="Ranking and filtering of the districts by their indicators.",
+    tags=["Model endpoints"],
+)
+async def circular_query_api(
+    cci_weights: CCIWeights,
+    token: Annotated[str, Depends(check_token)],
+    sort_by: Literal[RESULT_COLUMNS] = "cci",
+    order: Literal["asc", "desc"] = "desc",
+    limit: Annotated[int, Query(ge=1, le=1000)] = 20,
+    filters: Annotated[list[str] | None, Query(alias="filter")] = None,
+    cursor: str | None = None,
+) -> DistrictPage:
+    """
+    Return a page of districts sorted by an indicator, optionally within ranges of
+    indicators. User must be authenticated.
+
+    E.g. the 20 districts with the lowest W are `?sort_by=W&order=asc&limit=20`, and
+    the districts with a cci between 0.4 and 0.6 are `?filter=cci:0.4:0.6`. The
+    results of the weights are kept sorted, so further pages are found without
+    computing or sorting again. Ties are sorted by position in the dataset.
+
+    ### Parameters:
+    - cci_weights (CCIWeights): Weights for areas and KPIs.
+    - sort_by (str): Indicator to sort by, `D`, `ECR`, `M`, `W` or `cci`.
+    - order (str): `asc` or `desc`.
+    - limit (int): Maximum number of districts returned.
+    - filter (list[str]): Ranges written as `indicator:min:max`, both inclusive and optional (e.g. `W::0.3`). Several filters must all hold.
+    - cursor (str): `next_cursor` of the previous page, to get the next one with the same weights and query.
+    """
+    try:
+        filters = filters or []
+        ranges = parse_ranges(filters)
+        key = weights_key(cci_weights)
+        version = engine.version
+        index = index_cache.get(key, version)
+        if index is None:
+            with model_computation.labels("query").time():
+                index = ResultIndex(engine, engine.compute(cci_weights))
+            index_cache.put(key, version, index)
+
+        query = key[:16] + f":{version}:{sort_by}:{order}"
+        query += ":" + ",".join(sorted(filters))
+        after = decode_cursor(cursor, query) if cursor else None
+        rows, last = index.query(sort_by, order == "desc", limit, ranges, after)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    next_cursor = encode_cursor(query, last) if last is not None else None
+    return Response(
+        content=encode_page(index, rows, next_cursor), media_type="application/json"
+    )
+
+
+@router.post(
+    "/circular/rollup",
+    summary="Circularity index of the units of a level of the spatial hierarchy.",
+    tags=["Model endpoints"],
+)
+async def circular_rollup_api(
+    cci_weights: CCIWeights, level: str, token: Annotated[str, Depends(check_token)]
+) -> Rollup:
+    """
+    Return the area KPIs and the cci of every unit of a level of the hierarchy
+    (e.g. every borough), as weighted means of their districts. User must be
+    authenticated.
+
+    The hierarchy is configured with the HIERARCHY setting. The KPIs of every unit
+    are kept aggregated, so the response does not depend on the number of districts.
+
+    ### Parameters:
+    - cci_weights (CCIWeights): Weights for areas and KPIs.
+    - level (str): Level of the hierarchy, one of the columns of its file.
+    """
+    key = f"rollup:{level}:" + weights_key(cci_weights)
+    version = engine.version
+    body = result_cache.get(key, version)
+
+    if body is None:
+        try:
+            with model_computation.labels("rollup").time():
+                units, results = engine.compute_level(cci_weights, level)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        body = encode_level(level, units, results)
+        result_cache.put(key, version, body)
+
+    return Response(content=body, media_type="application/json")
+
+
+@router.post(
+    "/circular/history",
+    summary="Indicator of every district over the periods of the KPI history.",
+    tags=["Model endpoints"],
+)
+async def circular_history_api(
+    cci_weights: CCIWeights,
+    token: Annotated[str, Depends(check_token)],
+    indicator: Literal[RESULT_COLUMNS] = "cci",
+    window: Annotated[int, Query(ge=1, le=120)] = 3,
+    start: str | None = None,
+    end: str | None = None,
+) -> Trajectories:
+    """
+    Return the trajectory of an indicator of every district over the periods of the
+    history, with its difference from the previous period and its rolling mean.
+    User must be authenticated.
+
+    The history is configured with the HISTORY setting and grows one period at a
+    time through /superuser/history. Every period is computed at once from the
+    whole history. Missing values (districts without KPIs in a period, the first
+    difference and incomplete windows) are null.
+
+    ### Parameters:
+    - cci_weights (CCIWeights): Weights for areas and KPIs.
+    - indicator (str): Area KPI or cci.
+    - window (int): Periods of the rolling means, ending at each period.
+    - start (str): First period returned. Rolling means still use earlier periods.
+    - end (str): Last period returned.
+    """
+    if history is None:
+        raise HTTPException(status_code=422, detail="No KPI history is configured.")
+    history.refresh()
+    version = history.version
+
+    key = f"history:{indicator}:{window}:{start}:{end}:" + weights_key(cci_weights)
+    body = history_cache.get(key, version)
+
+    if body is None:
+        try:
+            with model_computation.labels("history").time():
+                values = history.compute(cci_weights, indicator)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        body = encode_trajectories(history, values, indicator, window, start, end)
+        history_cache.put(key, version, body)
+
+    return Response(content=body, media_type="application/json")
+
+
+@router.post(
+    "/sensitivity",
+    summary="Sensitivity of the cci rankings to the weights.",
+    tags=["Model endpoints"],
+)
+async def sensitivity_api(
+    request: SensitivityRequest, token: Annotated[str, Depends(check_token)]
+):
+    """
+    Starts a Monte Carlo analysis of how the cci and rank of every district vary
+    when the weights are perturbed around the given ones. User must be authenticated.
+
+    The analysis runs as a background task. Its results are retrieved from
+    /result/{task_id} once completed, and it can be cancelled through /stop/{task_id}.
+
+    ### Parameters:
+    - request (SensitivityRequest): Weights to perturb, number of samples, Dirichlet concentration (larger values perturb less) and random seed.
+    """
+    if not len(engine):
+        raise HTTPException(status_code=422, detail="No districts are loaded.")
+
+    task_id = str(uuid.uuid4())  # Generate a unique ID for the task
+    logger.info(f"Starting sensitivity analysis with task ID: {task_id}")
+
+    async def setup_task(task_id):
+        try:
+            # Runs in a worker process, and stops there if the task is cancelled
+            with model_computation.labels("sensitivity").time():
+                result = await model_executor.run(
+                    await task_manager.get(task_id),
+                    run_sensitivity,
+                    request,
+                    progress=lambda f: task_manager.report_progress(task_id, f),
+                )
+
+            logger.info(f"Run with task ID: {task_id} finished")
+            return result
+        except asyncio.CancelledError:
+            logger.info(f"Run with task ID: {task_id} cancelled")
+            raise  # Propagate the cancellation exception
+
+    task_manager.submit(task_id, lambda: setup_task(task_id), "Sensitivity")
+    return {"task_id": task_id}
+
+
 ####### Task Management endpoints ###########
 #####################
 ###Task management###
@@ -115,12 +495,35 @@ async def circular_api(
     summary="Query running and completed tasks.",
     tags=["Task management"],
 )
-async def check_tasks():
+async def check_tasks(
+    response: Response,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    if_none_match: Annotated[str | None, Header()] = None,
+):
     """
-    Checks which tasks are being executed or finished in the backend.
+    Checks which tasks are queued, being executed or finished in the backend, in
+    submission order.
+
+    The ETag of the response is the version of the task registry, so a poll with
+    it in the If-None-Match header gets a 304 response until a task changes.
+
+    ### Parameters:
+        - offset (int): Number of tasks to skip.
+        - limit (int): Maximum number of tasks returned.
     """
+    version = await task_manager.version()
+    etag = f'"tasks-{version}"'
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
 
-    return tasks
+    response.headers["ETag"] = etag
+    return {
+        "total": await task_manager.total(),
+        "offset": offset,
+        "limit": limit,
+        "tasks": await task_manager.page(offset, limit),
+    }
 
 
 # Endpoint to check the status of a specific task
@@ -129,24 +532,150 @@ async def check_tasks():
     summary="Check the status of a given task.",
     tags=["Task management"],
 )
-async def status(task_id: str):
+async def status(
+    task_id: str,
+    response: Response,
+    if_none_match: Annotated[str | None, Header()] = None,
+):
     """
-    Checks the current status of a task by ID.
+    Checks the current status of a task by ID. As for /list, a poll with the ETag
+    of the previous response gets a 304 response until a task changes.
 
     ### Parameters:
         - Task_id (str): ID of the task to check.
     """
-    try:
-        task_ob = tasks.get(task_id)
-    except:
+    # The ETag names the task, so a match means it was found at this version
+    version = await task_manager.version()
+    etag = f'"status-{task_id}-{version}"'
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    task_status = await task_manager.status(task_id)
+    if task_status is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    response.headers["ETag"] = etag
+    return {"status": task_status}
+
+
+# Endpoint to follow the tasks
+@router.get(
+    "/events",
+    summary="Stream of task status and progress.",
+    tags=["Task management"],
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def task_events_api(task_id: str | None = None):
+    """
+    Streams the changes of status and progress of the tasks as server-sent events,
+    e.g. for an EventSource in a browser, instead of polling /status. Every event
+    is a `task` event whose data is a JSON object with the task_id, type, status
+    and progress (fraction done, or null if the task does not report it).
+
+    With a task ID, the stream starts with the current state of the task and ends
+    once it is finished. Otherwise it follows, from now on, the changes of every
+    task of the server process of the connection, and never ends. A client that reads slowly
+    only gets the last state of each task. Comment lines are sent every
+    `EVENT_HEARTBEAT` seconds to keep idle connections open.
+
+    ### Parameters:
+        - task_id (str, optional): ID of the task to follow. If omitted, every task.
+    """
+    if task_id is not None and await task_manager.status(task_id) is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    task = task_ob.task
+    async def events():
+        subscriber = task_events.subscribe(task_id)
+        try:
+            # We send the state of the task when subscribed, so no change is missed
+            task_ob = None
+            if task_id is not None:
+                task_ob = await task_manager.get(task_id)
+                if task_ob is None:
+                    return
+                yield task_events.encode(task_id, task_ob)
+
+            while task_ob is None or task_ob.status not in FINAL_STATUSES:
+                if task_id is not None and not task_manager.runs(task_id):
+                    changed = await _remote_change(task_id, task_ob)
+                    if changed is None:
+                        # Cancelled, which removes the task, as its process sent
+                        cancelled = task_ob.model_copy(update={"status": "Cancelled"})
+                        yield task_events.encode(task_id, cancelled)
+                        return
+                    chunks = []
+                    if changed is not task_ob:
+                        chunks.append(task_events.encode(task_id, changed))
+                else:
+                    chunks = await subscriber.get(settings.EVENT_HEARTBEAT)
+                yield b"".join(chunks) or b": keep-alive\n\n"
+
+                if task_id is not None:
+                    task_ob = await task_manager.get(task_id)
+                    if task_ob is None:  # Cancelled, which removes the task
+                        return
+        finally:
+            task_events.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
-    if not task:
+async def _remote_change(task_id: str, task_ob: ModelTask) -> ModelTask | None:
+    """
+    Waits up to `settings.EVENT_HEARTBEAT` seconds for a task of another process to
+    change status, polling the version of the registry. The progress of these tasks
+    is not shared between processes.
+
+    Returns:
+        ModelTask|None: Task after the change, `task_ob` if it did not change, or None if it was removed.
+    """
+    version = await task_manager.version()
+    waited = 0.0
+    while waited < settings.EVENT_HEARTBEAT:
+        await asyncio.sleep(settings.PROGRESS_INTERVAL)
+        waited += settings.PROGRESS_INTERVAL
+        current = await task_manager.version()
+        if current != version:
+            version = current
+            # We only read the task, with its result, once its status changed
+            task_status = await task_manager.status(task_id)
+            if task_status is None:
+                return None
+            if task_status != task_ob.status:
+                return await task_manager.get(task_id)
+    return task_ob
+
+
+# Endpoint to retrieve the result of a task
+@router.get(
+    "/result/{task_id}",
+    summary="Get the result of a completed task.",
+    tags=["Task management"],
+)
+async def result(task_id: str):
+    """
+    Returns the result of a completed task by ID.
+
+    ### Parameters:
+        - Task_id (str): ID of the task.
+    """
+    task_ob = await task_manager.get(task_id)
+
+    if task_ob is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    return {"status": task_ob.status}
+    if task_ob.status in ("Queued", "Running"):
+        raise HTTPException(status_code=409, detail="Task not finished")
+
+    if task_ob.status == "Failed":
+        raise HTTPException(status_code=500, detail="Task failed")
+
+    return task_ob.result
 
 
 # Endpoint to stop the task
@@ -157,32 +686,47 @@ async def status(task_id: str):
 )
 async def stop_model(task_id: str):
     """
-    Stops a running task, provided its ID.
+    Stops a queued or running task, provided its ID. A task of another server
+    worker is stopped by that worker, and a 504 response means it did not do so
+    in time.
 
     ### Parameters:
         - Task_id (str): ID of the task to stop.
     """
 
-    try:
-        task_ob = tasks.get(task_id)
-    except:
-        raise HTTPException(status_code=404, detail="Task not found")
-
-    task = task_ob.task
+    task_ob = await task_manager.get(task_id)
 
-    if not task:
+    if task_ob is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    if task.done():
+    if task_ob.status not in ("Queued", "Running"):
         raise HTTPException(status_code=400, detail="Task already completed")
 
-    task.cancel()  # Cancel the running task
-
-    try:
-        await task  # Wait for the task to handle the cancellation
-    except asyncio.CancelledError:
-        logger.info(f"Task {task_id} successfully cancelled")
-    finally:
-        tasks.pop(task_id, None)  # Clean up the task from the dictionary
+    # Cancel the task and remove it
+    if not await task_manager.cancel(task_id):
+        raise HTTPException(
+            status_code=504, detail="Task not cancelled by its worker in time"
+        )
 
     return {"status": "Task cancelled", "task_id": task_id}
+
+
+####### Monitoring endpoints ###########
+
+
+@router.get(
+    "/metrics",
+    summary="Metrics in the Prometheus text format.",
+    tags=["Monitoring"],
+    response_class=PlainTextResponse,
+)
+async def metrics():
+    """
+    Returns the metrics of this process in the Prometheus text exposition format:
+    request latency by route, requests in flight, event loop lag, tasks by status
+    and the time spent verifying passwords and tokens and computing the model.
+
+    With several server workers, each one reports its own metrics.
+    """
+    await task_manager.counts()  # Read for the gauge of the tasks by status
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
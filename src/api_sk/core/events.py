@@ -0,0 +1,144 @@
+# events.py
+import asyncio
+import itertools
+import json
+from collections import OrderedDict
+
+from api_sk.core.config import settings
+from api_sk.core.metrics import Gauge
+from api_sk.schemas.schemas import ModelTask
+
+# Statuses after which a task does not change any more
+FINAL_STATUSES = ("Completed", "Failed", "Cancelled")
+
+
+class Subscriber:
+    """
+    Events waiting to be sent to a client of the event stream.
+
+    Only the last event of each task is kept, so a client that falls behind gets
+    the current state of every task instead of every progress update, and at most
+    `max_events` tasks are kept: the oldest are dropped. A slow client then holds a
+    bounded amount of memory, whatever the rate of events.
+
+    Parameters:
+        task_id (str|None): Task whose events are wanted, or None for every task.
+        max_events (int): Maximum number of events kept.
+    """
+
+    def __init__(self, task_id: str | None, max_events: int):
+        self.task_id = task_id
+        self.max_events = max_events
+        self.dropped = 0
+        self._events = OrderedDict()  # Task ID -> encoded event
+        self._ready = asyncio.Event()
+
+    def put(self, task_id: str, event: bytes):
+        self._events.pop(task_id, None)
+        self._events[task_id] = event
+        while len(self._events) > self.max_events:
+            self._events.popitem(last=False)
+            self.dropped += 1
+        self._ready.set()
+
+    async def get(self, timeout: float) -> list[bytes]:
+        """
+        Waits up to `timeout` seconds for events, and takes every event kept.
+
+        Parameters:
+            timeout (float): Seconds to wait.
+
+        Returns:
+            list[bytes]: Encoded events, oldest first. Empty if none came in time.
+        """
+        if not self._events:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except TimeoutError:
+                return []
+        self._ready.clear()
+        events = list(self._events.values())
+        self._events.clear()
+        return events
+
+
+class TaskEvents:
+    """
+    Broadcasts the state changes of tasks to the clients of the event stream.
+
+    Every event is encoded once, as a server-sent event, and the same bytes are
+    added to the buffer of each subscriber of the task. Events are published from
+    the event loop, so buffers need no locks.
+
+    Parameters:
+        max_events (int): Events kept per subscriber, see Subscriber.
+    """
+
+    def __init__(self, max_events: int):
+        self.max_events = max_events
+        self._subscribers: dict[str | None, set[Subscriber]] = {}
+        self._ids = itertools.count(1)
+
+    def __len__(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def subscribe(self, task_id: str | None = None) -> Subscriber:
+        """
+        Starts buffering the events of a task, or of every task.
+
+        Parameters:
+            task_id (str|None, optional): Default value is None. ID of the task. If None, events of every task are buffered.
+
+        Returns:
+            Subscriber: Buffer of the events. It must be unsubscribed when done.
+        """
+        subscriber = Subscriber(task_id, self.max_events)
+        self._subscribers.setdefault(task_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._subscribers.get(subscriber.task_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.task_id]
+
+    def encode(self, task_id: str, task_ob: ModelTask) -> bytes:
+        """
+        Encodes the state of a task as a server-sent event.
+        """
+        data = {
+            "task_id": task_id,
+            "type": task_ob.type,
+            "status": task_ob.status,
+            "progress": task_ob.progress,
+        }
+        return (
+            f"id: {next(self._ids)}\nevent: task\ndata: {json.dumps(data)}\n\n".encode()
+        )
+
+    def publish(self, task_id: str, task_ob: ModelTask):
+        """
+        Sends the state of a task to its subscribers and those of every task.
+
+        Parameters:
+            task_id (str): ID of the task.
+            task_ob (ModelTask): Task.
+        """
+        everything = self._subscribers.get(None, ())
+        single = self._subscribers.get(task_id, ())
+        if not everything and not single:
+            return
+
+        event = self.encode(task_id, task_ob)
+        for subscriber in itertools.chain(everything, single):
+            subscriber.put(task_id, event)
+
+
+task_events = TaskEvents(settings.EVENT_BUFFER)
+
+event_subscribers = Gauge(
+    "apisk_event_subscribers",
+    "Clients of the task event stream.",
+    function=lambda: {(): len(task_events)},
+)
@@ -0,0 +1,300 @@
+# executor.py
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from api_sk.core.config import settings
+from api_sk.model.engine import engine
+from api_sk.schemas.schemas import ModelTask
+
+logger = logging.getLogger("uvicorn.error")
+
+# Maximum number of computations submitted to the pool at the same time
+MAX_SLOTS = 1024
+# KPI cells changed by the updates passed on to the workers, past which the workers
+# are restarted with the current KPIs instead
+MAX_PATCHED_CELLS = 100_000
+
+# State of the worker processes, set by the pool initializer
+_worker_flags = None
+_worker_progress = None
+
+
+class SharedFlag:
+    """
+    Cancellation flag readable from a worker process, with the same interface as
+    `threading.Event.is_set`.
+    """
+
+    def __init__(self, slot: int):
+        self.slot = slot
+
+    def is_set(self) -> bool:
+        return bool(_worker_flags[self.slot])
+
+
+class SharedProgress:
+    """
+    Progress callback of a computation in a worker process, which writes the
+    fraction done where the process waiting for it reads it.
+    """
+
+    def __init__(self, slot: int):
+        self.slot = slot
+
+    def __call__(self, fraction: float):
+        _worker_progress[self.slot] = fraction
+
+
+def _init_worker(flags, progress, dataset):
+    """
+    Initializes a worker process with the cancellation flags, the progress slots
+    and the district KPIs, so that computations do not need to ship them.
+    """
+    global _worker_flags, _worker_progress
+    _worker_flags = flags
+    _worker_progress = progress
+    _load(dataset)
+
+
+def _load(dataset):
+    """
+    Loads a dataset into the worker copy of the engine: either a version directory,
+    which is memory-mapped (see `CCIEngine.read_file`), or the arguments of
+    `CCIEngine.load`.
+    """
+    if isinstance(dataset, Path):
+        engine.load(*engine.read_file(dataset))
+    else:
+        engine.load(*dataset)
+
+
+def _warm_up() -> str:
+    return engine.version
+
+
+def _sync(path: Path | None, version: str, patches: tuple):
+    """
+    Brings the worker copy of the engine up to date with the updates of the KPIs
+    in `patches`, as (version after, changes), made since the dataset of the
+    workers (of `version`, and mapped from `path` if not None).
+    """
+    versions = [version] + [after for after, _ in patches]
+    # Mapped datasets are swapped by the worker itself when the KPIs are reloaded
+    if engine.version not in versions:
+        _load(path)
+    for _, changes in patches[versions.index(engine.version) :]:
+        engine.update(changes)
+
+
+def _run_in_worker(
+    slot: int, path: Path | None, version: str, patches: tuple, function, *args
+):
+    _sync(path, version, patches)
+    return function(
+        engine, *args, cancel=SharedFlag(slot), progress=SharedProgress(slot)
+    )
+
+
+class ModelExecutor:
+    """
+    Process pool running the CPU-bound model computations, so that they use every
+    core and do not hold the GIL of the process serving the requests.
+
+    Functions run with the worker copy of the engine as first argument, a `cancel`
+    keyword argument, a flag they should check regularly, and a `progress` keyword
+    argument they may call with the fraction done. When the pool is not started (or
+    has no workers) functions run in a thread with a local flag.
+
+    Workers hold the dataset they were started with, or the mapped version the
+    engine was last reloaded from. Updates of the KPIs since then are kept, see
+    `update`, and every computation brings its worker up to date before running.
+
+    Parameters:
+        workers (int): Number of worker processes.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.pool: ProcessPoolExecutor | None = None
+        self._context = multiprocessing.get_context("spawn")
+        self._flags = self._context.RawArray("b", MAX_SLOTS)
+        self._progress = self._context.RawArray("d", MAX_SLOTS)
+        self._free_slots = list(range(MAX_SLOTS))
+        # Dataset of the workers (its path if mapped, and version) and the updates
+        # of the KPIs since, as (version after, changes)
+        self._path: Path | None = None
+        self._version: str | None = None
+        self._patches: list[tuple[str, dict]] = []
+        self._patched_cells = 0
+
+    def start(self):
+        """
+        Starts the worker processes and waits until all of them hold the KPIs.
+        """
+        if self.workers <= 0 or self.pool is not None:
+            return
+
+        self._path, self._version = engine.path, engine.version
+        self._patches, self._patched_cells = [], 0
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=(self._flags, self._progress, self._dataset()),
+        )
+        for future in [self.pool.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        logger.info(f"Started {self.workers} model workers")
+
+    def shutdown(self):
+        """
+        Stops the worker processes, cancelling the computations not yet started.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def _dataset(self):
+        # Mapped KPIs are shared by mapping the same file, instead of pickling them
+        if engine.path is not None:
+            return engine.path
+        return engine.ids, engine.kpis, engine.version
+
+    def reload(self):
+        """
+        Makes the workers use the KPIs currently held by the engine. Workers map a
+        new dataset version on their next computation, without downtime, while
+        in-memory KPIs require restarting them.
+        """
+        if engine.path is None:
+            self.restart()
+        else:
+            self._path, self._version = engine.path, engine.version
+            self._patches, self._patched_cells = [], 0
+
+    def update(self, changes: dict[str, dict[str, float]], version: str):
+        """
+        Passes an update of the KPIs of the engine on to the workers, which apply
+        it before their next computation, instead of being restarted. Once the
+        updates kept change more than `MAX_PATCHED_CELLS` KPIs, the workers are
+        restarted with the current KPIs instead.
+
+        Parameters:
+            changes (dict[str, dict[str, float]]): Changes applied with `engine.update`.
+            version (str): Version of the engine after the update.
+        """
+        if self.pool is None:
+            return
+
+        self._patches.append((version, changes))
+        self._patched_cells += sum(len(kpis) for kpis in changes.values())
+        if self._patched_cells > MAX_PATCHED_CELLS:
+            self.restart()
+
+    def restart(self):
+        """
+        Restarts the worker processes, e.g. after the KPIs have been reloaded.
+        """
+        if self.pool is not None:
+            self.shutdown()
+            self.start()
+
+    async def run(
+        self,
+        task_ob: ModelTask | None,
+        function,
+        *args,
+        progress: Callable[[float], None] | None = None,
+    ):
+        """
+        Runs a model function in a worker process and waits for its result. If the
+        waiting coroutine is cancelled, the computation is cancelled too.
+
+        Parameters:
+            task_ob (ModelTask|None): Task the computation belongs to, which keeps track of its future.
+            function (Callable): Top-level function called as `function(engine, *args, cancel=flag, progress=callback)`.
+            progress (Callable|None, optional): Default value is None. Called from the event loop with the fraction done, every `settings.PROGRESS_INTERVAL` seconds while it changes.
+
+        Returns:
+            Any: Return value of the function.
+        """
+        if self.pool is None or not self._free_slots:
+            return await self._run_in_thread(function, *args, progress=progress)
+
+        slot = self._free_slots.pop()
+        self._flags[slot] = 0
+        self._progress[slot] = 0.0
+        future = self.pool.submit(
+            _run_in_worker,
+            slot,
+            self._path,
+            self._version,
+            tuple(self._patches),
+            function,
+            *args,
+        )
+        future.add_done_callback(lambda f: self._free_slots.append(slot))
+        if task_ob is not None:
+            task_ob.future = future
+
+        try:
+            return await _watch(
+                asyncio.wrap_future(future), lambda: self._progress[slot], progress
+            )
+        except asyncio.CancelledError:
+            if not future.cancel():
+                self._flags[slot] = 1  # Already running, stop at the next check
+            raise
+
+    async def _run_in_thread(self, function, *args, progress=None):
+        cancel = threading.Event()
+        done = [0.0]
+        try:
+            return await _watch(
+                asyncio.to_thread(
+                    functools.partial(
+                        function,
+                        engine,
+                        *args,
+                        cancel=cancel,
+                        progress=lambda fraction: done.__setitem__(0, fraction),
+                    )
+                ),
+                lambda: done[0],
+                progress,
+            )
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+
+
+async def _watch(awaitable, read: Callable[[], float], progress):
+    """
+    Waits for a computation, passing the fraction it reports to `progress` while
+    it changes. The fraction is read, not sent, so computations never wait for it.
+    """
+    if progress is None:
+        return await awaitable
+
+    future = asyncio.ensure_future(awaitable)
+    last = 0.0
+    try:
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=settings.PROGRESS_INTERVAL)
+            if read() != last:
+                last = read()
+                progress(last)
+            if done:
+                return future.result()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+
+
+model_executor = ModelExecutor(settings.PROCESS_WORKERS)
@@ -0,0 +1,295 @@
+# metrics.py
+import asyncio
+import bisect
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+
+# Upper bounds of the latency histograms, in seconds
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Every metric, in the order they are exposed
+REGISTRY = []
+
+
+class _Shards:
+    """
+    Values of a metric split by thread. Each thread only writes to its own list, so
+    updates need no locks, and the lists are only added up when the metric is
+    collected.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._all = []
+
+    def mine(self) -> list[float]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = [0.0] * self.size
+            self._all.append(shard)  # Appending to a list is atomic
+        return shard
+
+    def total(self) -> list[float]:
+        return [sum(values) for values in zip(*self._all)] or [0.0] * self.size
+
+
+class _Metric:
+    """
+    Family of metrics of a type, one per combination of label values.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._child())
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def _labels(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def collect(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for values, child in list(self._children.items()):
+            lines.extend(self._samples(values, child))
+        return lines
+
+    def _samples(self, values: tuple, child) -> list[str]:
+        raise NotImplementedError
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # Count per bucket (the last one is +Inf) and then the sum
+        self.shards = _Shards(len(buckets) + 2)
+
+    def observe(self, value: float):
+        shard = self.shards.mine()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    """
+    Histogram of observed values, e.g. durations in seconds. Use `observe` or the
+    `time` context manager, on the histogram itself or on `labels(...)`.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _samples(self, values, child):
+        totals = child.shards.total()
+        lines, cumulative = [], 0
+        for bound, count in zip((*self.buckets, "+Inf"), totals):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(
+                f"{self.name}_bucket{self._labels(values, le)} {int(cumulative)}"
+            )
+        lines.append(f"{self.name}_sum{self._labels(values)} {totals[-1]}")
+        lines.append(f"{self.name}_count{self._labels(values)} {int(cumulative)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, either set from the event loop (`set`, `inc` and
+    `dec`) or read when collected from `function`, which returns the value of every
+    combination of label values.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        function: Callable[[], dict[tuple, float]] | None = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def collect(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        values = self.function() if self.function else {(): self.value}
+        for labels, value in values.items():
+            lines.append(f"{self.name}{self._labels(labels)} {value}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+    """
+    Writes every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: Metrics.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics of the API
+
+request_duration = Histogram(
+    "apisk_http_request_duration_seconds",
+    "Duration of the HTTP requests, by method, route and status code.",
+    ("method", "route", "status"),
+)
+requests_in_flight = Gauge(
+    "apisk_http_requests_in_flight", "HTTP requests being served."
+)
+loop_lag = Histogram(
+    "apisk_event_loop_lag_seconds",
+    "Delay of the event loop in waking up a task that slept.",
+)
+password_verification = Histogram(
+    "apisk_password_verification_seconds", "Time verifying a password with bcrypt."
+)
+token_verification = Histogram(
+    "apisk_token_verification_seconds",
+    "Time verifying an access token, by whether it was in the token cache.",
+    ("cache",),
+)
+model_computation = Histogram(
+    "apisk_model_computation_seconds",
+    "Time computing model results, by operation.",
+    ("operation",),
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the duration of every HTTP request and the requests
+    in flight. Requests are labelled with the path template of their route (e.g.
+    `/status/{task_id}`), or `unmatched`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None  # Path template of each endpoint
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            requests_in_flight.dec()
+            request_duration.labels(
+                scope["method"], self._route(scope), str(status)
+            ).observe(time.perf_counter() - start)
+
+    def _route(self, scope) -> str:
+        # We map the endpoint the router stored in the scope back to its route
+        if self._routes is None:
+            self._routes = {
+                getattr(route, "endpoint", None): route.path
+                for route in scope["app"].routes
+            }
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+
+async def monitor_loop_lag(interval: float):
+    """
+    Measures how late the event loop wakes up from a sleep of `interval` seconds,
+    forever.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(0.0, loop.time() - start - interval))
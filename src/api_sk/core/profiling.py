@@ -0,0 +1,221 @@
+# profiling.py
+import datetime
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+from fastapi.routing import APIRoute
+
+from api_sk.core.config import settings
+
+
+class Profile:
+    """
+    Sampled call stacks of the next requests of a route.
+
+    Stacks are kept in the collapsed format of flame graph tools (frames from the
+    root, separated by `;`, and the number of samples), e.g. for `flamegraph.pl`,
+    speedscope or inferno.
+
+    Parameters:
+        route (APIRoute): Profiled route.
+        method (str): Profiled HTTP method.
+        requests (int): Number of requests to profile.
+    """
+
+    def __init__(self, route: APIRoute, method: str, requests: int):
+        self.id = str(uuid.uuid4())
+        self.route = route
+        self.method = method
+        self.requests = requests
+        self.original = route.app  # ASGI app of the route, restored when done
+        self.profiled = 0
+        self.seconds = 0.0
+        self.created = str(datetime.datetime.now())
+        self.samples = Counter()
+
+    @property
+    def done(self) -> bool:
+        return self.profiled >= self.requests
+
+    def summary(self) -> dict:
+        return {
+            "profile_id": self.id,
+            "route": self.route.path,
+            "method": self.method,
+            "requests": self.requests,
+            "profiled": self.profiled,
+            "seconds": self.seconds,
+            "samples": sum(dict(self.samples).values()),
+            "created": self.created,
+            "status": "Completed" if self.done else "Armed",
+        }
+
+    def collapsed(self) -> str:
+        """
+        Writes the samples in the collapsed stack format, one stack per line.
+        """
+        # We copy the samples first, as they may still be being added
+        samples = Counter(dict(self.samples))
+        return "".join(f"{stack} {n}\n" for stack, n in samples.most_common())
+
+
+class RequestProfiler:
+    """
+    Profiles the next requests of a route with a sampling profiler, on demand.
+
+    Arming a profile replaces the ASGI app of the route by a wrapper, which is
+    removed once the requests are profiled, so routes that are not being profiled
+    run exactly as usual. While a request is profiled, a thread samples the stack
+    of the event loop thread every `interval` seconds. Requests served at the same
+    time by the event loop also appear in the samples. Only one request is
+    profiled at a time: others of the route run normally.
+
+    Parameters:
+        interval (float): Seconds between samples.
+        max_profiles (int): Profiles kept, the oldest ones are dropped.
+    """
+
+    def __init__(self, interval: float, max_profiles: int):
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self.profiles: OrderedDict[str, Profile] = OrderedDict()
+        self._armed = {}  # (path, method) -> profile of the route, while armed
+        self._busy = False
+
+    def arm(self, routes: list, path: str, method: str, requests: int) -> Profile:
+        """
+        Profiles the next requests of a route.
+
+        Parameters:
+            routes (list): Routes of the application.
+            path (str): Path template of the route, e.g. `/circular`.
+            method (str): HTTP method of the route.
+            requests (int): Number of requests to profile.
+
+        Returns:
+            Profile: Profile that will hold the samples.
+        """
+        method = method.upper()
+        route = next(
+            (
+                r
+                for r in routes
+                if isinstance(r, APIRoute) and r.path == path and method in r.methods
+            ),
+            None,
+        )
+        if route is None:
+            raise ValueError(f"No route {method} {path}.")
+        if (path, method) in self._armed:
+            raise ValueError(f"Route {method} {path} is already being profiled.")
+
+        profile = Profile(route, method, requests)
+        original = profile.original
+        self._armed[path, method] = profile
+
+        async def profiled_app(scope, receive, send):
+            if self._busy or profile.done or scope["method"] != method:
+                return await original(scope, receive, send)
+
+            self._busy = True
+            sampler = _Sampler(threading.get_ident(), self.interval, profile.samples)
+            sampler.start()
+            try:
+                await original(scope, receive, send)
+            finally:
+                profile.seconds += sampler.stop()
+                profile.profiled += 1
+                self._busy = False
+                if profile.done:
+                    self._restore(profile)
+
+        route.app = profiled_app
+        self.profiles[profile.id] = profile
+        while len(self.profiles) > self.max_profiles:
+            self.remove(next(iter(self.profiles)))
+        return profile
+
+    def get(self, profile_id: str) -> Profile | None:
+        return self.profiles.get(profile_id)
+
+    def remove(self, profile_id: str) -> bool:
+        """
+        Drops a profile, restoring its route if still armed.
+
+        Parameters:
+            profile_id (str): ID of the profile.
+
+        Returns:
+            bool: False if the profile does not exist.
+        """
+        profile = self.profiles.pop(profile_id, None)
+        if profile is None:
+            return False
+        if not profile.done:
+            self._restore(profile)
+        return True
+
+    def _restore(self, profile: Profile):
+        if self._armed.get((profile.route.path, profile.method)) is profile:
+            del self._armed[profile.route.path, profile.method]
+            profile.route.app = profile.original
+
+
+class _Sampler(threading.Thread):
+    """
+    Thread adding the collapsed stack of another thread to a counter periodically.
+    """
+
+    def __init__(self, thread_id: int, interval: float, samples: Counter):
+        super().__init__(daemon=True, name="profiler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = samples
+        self._done = threading.Event()
+        self._start_time = 0.0
+        self._switch_interval = 0.0
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_collapse(frame)] += 1
+
+    def start(self):
+        # We let the sampler take the GIL as often as it samples, otherwise it only
+        # gets it every switch interval (5 ms by default)
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.interval, self._switch_interval))
+        self._start_time = time.perf_counter()
+        super().start()
+
+    def stop(self) -> float:
+        """
+        Stops sampling and returns the seconds sampled.
+        """
+        self._done.set()
+        self.join()
+        sys.setswitchinterval(self._switch_interval)
+        return time.perf_counter() - self._start_time
+
+
+def _collapse(frame) -> str:
+    """
+    Writes the stack of a frame from the root, one `function (file:line)` per frame,
+    with the line where the function starts so that samples of a call add up.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+request_profiler = RequestProfiler(settings.PROFILE_INTERVAL, settings.MAX_PROFILES)
@@ -1,6 +1,6 @@
 # routers.py
 
-from fastapi import APIRouter, Security
+from fastapi import APIRouter, Depends, Security
 from api_sk.auth import auth
 from api_sk.core import endpoints
 from api_sk.user import superuser_endpoints
@@ -9,9 +9,17 @@ from api_sk.auth.auth import check_superuser
 # We define a router that collects everything together
 api_router = APIRouter()
 api_router.include_router(auth.router, prefix="")  # Security
-api_router.include_router(endpoints.router, prefix="")  # Generic endpoint
+# Endpoints using the KPIs first pick up those published by other server workers
+api_router.include_router(
+    endpoints.router,
+    prefix="",
+    dependencies=[Depends(superuser_endpoints.refresh_kpis)],
+)  # Generic endpoint
 api_router.include_router(
     superuser_endpoints.router,
     prefix="/superuser",
-    dependencies=[Security(check_superuser, scopes=["superuser"])],
+    dependencies=[
+        Security(check_superuser, scopes=["superuser"]),
+        Depends(superuser_endpoints.refresh_kpis),
+    ],
 )  # User management endpoints
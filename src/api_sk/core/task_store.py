@@ -0,0 +1,473 @@
+# task_store.py
+import datetime
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+
+from api_sk.schemas.schemas import ModelTask
+
+
+class MemoryTaskStore:
+    """
+    Registry of the tasks of a single process, holding the task objects themselves.
+
+    Finished tasks keep their result until they expire, and only the most recently
+    used ones are kept. Every change to the tasks increases the version of the
+    registry.
+
+    Parameters:
+        max_finished (int): Maximum number of finished tasks kept.
+        ttl (float): Seconds a finished task and its result are kept.
+    """
+
+    # Tasks are only visible to the process that runs them
+    shared = False
+
+    def __init__(self, max_finished: int, ttl: float):
+        self.max_finished = max_finished
+        self.ttl = ttl
+
+        self._tasks: dict[str, ModelTask] = {}  # All tasks, by submission order
+        self._finished = OrderedDict()  # Finished task IDs, least recently used first
+        self._expiries = deque()  # (expiry time, task ID), by finishing order
+        # We tell this registry apart from those of other processes and restarts
+        self._id = uuid.uuid4().hex[:8]
+        self._version = 0
+
+    def __len__(self) -> int:
+        self.purge()
+        return len(self._tasks)
+
+    def add(self, task_id: str, task_ob: ModelTask, owner: str):
+        """
+        Registers a new task.
+
+        Parameters:
+            task_id (str): ID of the task.
+            task_ob (ModelTask): Task.
+            owner (str): ID of the process running the task.
+        """
+        self._tasks[task_id] = task_ob
+        self._version += 1
+
+    def update(self, task_id: str, task_ob: ModelTask):
+        """
+        Stores the new status of an active task.
+
+        Parameters:
+            task_id (str): ID of the task.
+            task_ob (ModelTask): Task.
+        """
+        self._version += 1
+
+    def finish(self, task_id: str, task_ob: ModelTask):
+        """
+        Stores a finished task with its result, evicting the least recently used
+        finished tasks if needed.
+
+        Parameters:
+            task_id (str): ID of the task.
+            task_ob (ModelTask): Task.
+        """
+        if task_id not in self._tasks:
+            return
+
+        self._finished[task_id] = None
+        self._version += 1
+        self._expiries.append((time.monotonic() + self.ttl, task_id))
+        while len(self._finished) > self.max_finished:
+            self.remove(next(iter(self._finished)))
+
+    def get(self, task_id: str) -> ModelTask | None:
+        """
+        Returns a task by ID, or None if it does not exist or has expired.
+
+        Parameters:
+            task_id (str): ID of the task.
+
+        Returns:
+            ModelTask|None: Task.
+        """
+        self.purge()
+        if task_id in self._finished:
+            self._finished.move_to_end(task_id)
+        return self._tasks.get(task_id)
+
+    def status(self, task_id: str) -> str | None:
+        """
+        Returns the status of a task by ID, or None if it does not exist or has
+        expired, without reading its result.
+
+        Parameters:
+            task_id (str): ID of the task.
+
+        Returns:
+            str|None: Status.
+        """
+        task_ob = self.get(task_id)
+        return task_ob.status if task_ob is not None else None
+
+    def page(self, offset: int, limit: int) -> dict[str, ModelTask]:
+        """
+        Returns a page of the tasks, in submission order.
+
+        Parameters:
+            offset (int): Number of tasks to skip.
+            limit (int): Maximum number of tasks returned.
+
+        Returns:
+            dict[str, ModelTask]: Tasks by ID.
+        """
+        self.purge()
+        return dict(itertools.islice(self._tasks.items(), offset, offset + limit))
+
+    def counts(self) -> dict[str, int]:
+        """
+        Counts the tasks by status.
+
+        Returns:
+            dict[str, int]: Number of tasks of each status.
+        """
+        self.purge()
+        return dict(Counter(task_ob.status for task_ob in self._tasks.values()))
+
+    def version(self) -> str:
+        """
+        Returns the version of the registry, which changes whenever a task is
+        added, changes its status or is removed (e.g. when it expires).
+
+        Returns:
+            str: Version.
+        """
+        self.purge()
+        return f"{self._id}-{self._version}"
+
+    def remove(self, task_id: str):
+        """
+        Removes a task.
+
+        Parameters:
+            task_id (str): ID of the task.
+        """
+        if self._tasks.pop(task_id, None) is not None:
+            self._version += 1
+        self._finished.pop(task_id, None)
+
+    def request_cancel(self, task_id: str):
+        """
+        Asks the process running a task to cancel it. Not needed when tasks are not
+        shared, as the process receiving the request is the one running the task.
+        """
+
+    def cancel_requests(self, owner: str) -> list[str]:
+        """
+        Returns the IDs of the tasks of a process whose cancellation was requested.
+        """
+        return []
+
+    def heartbeat(self, owner: str):
+        """
+        Records that the process running some tasks is alive. Not needed when tasks
+        are not shared, as they are lost with their process.
+        """
+
+    def drop_owner(self, owner: str):
+        """
+        Records that a process stopped, so that its tasks are reaped at once.
+        """
+
+    def reap(self, timeout: float) -> int:
+        """
+        Marks as failed the queued and running tasks of the processes without a
+        heartbeat in the last `timeout` seconds, and returns how many there were.
+        """
+        return 0
+
+    def purge(self):
+        """
+        Removes the expired tasks.
+        """
+        now = time.monotonic()
+        while self._expiries and self._expiries[0][0] < now:
+            _, task_id = self._expiries.popleft()
+            if task_id in self._finished:
+                self.remove(task_id)
+
+
+class SQLiteTaskStore:
+    """
+    Registry of the tasks shared by several processes (e.g. the workers of the
+    server) through a SQLite database in WAL mode.
+
+    Every process registers the tasks it runs, and any of them can read their
+    status and result. Cancellations are requested through the database and
+    carried out by the process running the task, see `cancel_requests`. Processes
+    record a heartbeat, and the tasks of those that stopped are marked as failed
+    by the others, see `reap`. The version of the registry is a counter in the database, increased by triggers
+    on every change to the tasks, so it covers the changes of every process.
+
+    Reads do not write to the database: they skip the expired tasks, which are
+    deleted by `purge` when a task finishes and periodically from
+    `TaskManager.watch`. The last use of the finished tasks read is kept in memory
+    until then.
+
+    It has the same methods as MemoryTaskStore. Results are stored as JSON, and
+    the tasks returned are copies without the asyncio task or future.
+
+    Parameters:
+        path (str): Path to the SQLite file.
+        max_finished (int): Maximum number of finished tasks kept.
+        ttl (float): Seconds a finished task and its result are kept.
+    """
+
+    # Tasks are visible to every process using the same file
+    shared = True
+
+    def __init__(self, path: str, max_finished: int, ttl: float):
+        self.path = path
+        self.max_finished = max_finished
+        self.ttl = ttl
+        self._local = threading.local()
+        self._used: dict[str, float] = {}  # Last use of finished tasks, by ID
+        self._used_lock = threading.Lock()
+
+        connection = self._connection()
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                owner TEXT NOT NULL,
+                type TEXT NOT NULL,
+                status TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                start_time TEXT NOT NULL,
+                end_time TEXT,
+                expires REAL,
+                used REAL,
+                cancel INTEGER NOT NULL DEFAULT 0,
+                result TEXT
+            );
+            CREATE INDEX IF NOT EXISTS tasks_expires ON tasks (expires);
+            CREATE INDEX IF NOT EXISTS tasks_cancel ON tasks (owner, cancel);
+            CREATE TABLE IF NOT EXISTS owners (
+                owner TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS registry (
+                key INTEGER PRIMARY KEY CHECK (key = 0),
+                id TEXT NOT NULL,
+                version INTEGER NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS tasks_added AFTER INSERT ON tasks
+            BEGIN UPDATE registry SET version = version + 1; END;
+            CREATE TRIGGER IF NOT EXISTS tasks_changed
+            AFTER UPDATE OF status, end_time, result ON tasks
+            BEGIN UPDATE registry SET version = version + 1; END;
+            CREATE TRIGGER IF NOT EXISTS tasks_removed AFTER DELETE ON tasks
+            BEGIN UPDATE registry SET version = version + 1; END;
+            """
+        )
+        connection.execute(
+            "INSERT OR IGNORE INTO registry (key, id, version) VALUES (0, ?, 0)",
+            (uuid.uuid4().hex[:8],),
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def __len__(self) -> int:
+        (count,) = (
+            self._connection()
+            .execute(f"SELECT COUNT(*) FROM tasks WHERE {_LIVE}", (time.time(),))
+            .fetchone()
+        )
+        return count
+
+    def add(self, task_id: str, task_ob: ModelTask, owner: str):
+        # The owner is alive, and must be known before its tasks are reaped
+        self.heartbeat(owner)
+        self._connection().execute(
+            "INSERT INTO tasks (id, owner, type, status, priority, start_time)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                task_id,
+                owner,
+                task_ob.type,
+                task_ob.status,
+                task_ob.priority,
+                task_ob.start_time,
+            ),
+        )
+
+    def update(self, task_id: str, task_ob: ModelTask):
+        self._connection().execute(
+            "UPDATE tasks SET status = ? WHERE id = ?", (task_ob.status, task_id)
+        )
+
+    def finish(self, task_id: str, task_ob: ModelTask):
+        # We evict by the last use, so the uses read since the last purge count
+        self.purge()
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "UPDATE tasks SET status = ?, end_time = ?, expires = ?, used = ?,"
+            " result = ? WHERE id = ?",
+            (
+                task_ob.status,
+                task_ob.end_time,
+                now + self.ttl,
+                now,
+                json.dumps(task_ob.result, default=str),
+                task_id,
+            ),
+        )
+        connection.execute(
+            "DELETE FROM tasks WHERE id IN (SELECT id FROM tasks"
+            " WHERE expires IS NOT NULL ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (self.max_finished,),
+        )
+
+    def get(self, task_id: str) -> ModelTask | None:
+        now = time.time()
+        row = (
+            self._connection()
+            .execute(
+                "SELECT type, status, priority, start_time, end_time, result"
+                f" FROM tasks WHERE id = ? AND {_LIVE}",
+                (task_id, now),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+
+        if row[4] is not None:
+            with self._used_lock:
+                self._used[task_id] = now
+        return _task(*row)
+
+    def status(self, task_id: str) -> str | None:
+        now = time.time()
+        row = (
+            self._connection()
+            .execute(
+                f"SELECT status, end_time FROM tasks WHERE id = ? AND {_LIVE}",
+                (task_id, now),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+
+        if row[1] is not None:
+            with self._used_lock:
+                self._used[task_id] = now
+        return row[0]
+
+    def page(self, offset: int, limit: int) -> dict[str, ModelTask]:
+        rows = self._connection().execute(
+            "SELECT id, type, status, priority, start_time, end_time"
+            f" FROM tasks WHERE {_LIVE} ORDER BY seq LIMIT ? OFFSET ?",
+            (time.time(), limit, offset),
+        )
+        return {row[0]: _task(*row[1:]) for row in rows}
+
+    def counts(self) -> dict[str, int]:
+        rows = self._connection().execute(
+            f"SELECT status, COUNT(*) FROM tasks WHERE {_LIVE} GROUP BY status",
+            (time.time(),),
+        )
+        return dict(rows.fetchall())
+
+    def version(self) -> str:
+        # Tasks expire before they are purged, so we count those already expired
+        row = self._connection().execute(
+            "SELECT id, version, (SELECT COUNT(*) FROM tasks WHERE expires < ?)"
+            " FROM registry",
+            (time.time(),),
+        )
+        return "{}-{}-{}".format(*row.fetchone())
+
+    def remove(self, task_id: str):
+        self._connection().execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+
+    def request_cancel(self, task_id: str):
+        self._connection().execute(
+            "UPDATE tasks SET cancel = 1 WHERE id = ?", (task_id,)
+        )
+
+    def cancel_requests(self, owner: str) -> list[str]:
+        rows = self._connection().execute(
+            "SELECT id FROM tasks WHERE owner = ? AND cancel = 1", (owner,)
+        )
+        return [row[0] for row in rows]
+
+    def heartbeat(self, owner: str):
+        self._connection().execute(
+            "INSERT INTO owners (owner, heartbeat) VALUES (?, ?)"
+            " ON CONFLICT (owner) DO UPDATE SET heartbeat = excluded.heartbeat",
+            (owner, time.time()),
+        )
+
+    def drop_owner(self, owner: str):
+        self._connection().execute("DELETE FROM owners WHERE owner = ?", (owner,))
+
+    def reap(self, timeout: float) -> int:
+        now = time.time()
+        connection = self._connection()
+        # Tasks whose owner is not known are reaped too, e.g. after a restart
+        reaped = connection.execute(
+            "UPDATE tasks SET status = 'Failed', end_time = ?, expires = ?, used = ?"
+            " WHERE status IN ('Queued', 'Running') AND owner NOT IN"
+            " (SELECT owner FROM owners WHERE heartbeat >= ?)",
+            (str(datetime.datetime.now()), now + self.ttl, now, now - timeout),
+        ).rowcount
+        connection.execute("DELETE FROM owners WHERE heartbeat < ?", (now - timeout,))
+        return reaped
+
+    def purge(self):
+        with self._used_lock:
+            used, self._used = self._used, {}
+        connection = self._connection()
+        if used:
+            connection.executemany(
+                "UPDATE tasks SET used = ? WHERE id = ?",
+                [(last_use, task_id) for task_id, last_use in used.items()],
+            )
+        connection.execute("DELETE FROM tasks WHERE expires < ?", (time.time(),))
+
+
+# Condition of the tasks not expired yet, given the current time
+_LIVE = "(expires IS NULL OR expires >= ?)"
+
+
+def _task(
+    task_type: str,
+    status: str,
+    priority: int,
+    start_time: str,
+    end_time: str | None,
+    result: str | None = None,
+) -> ModelTask:
+    """
+    Builds a task from a row of the tasks table.
+    """
+    return ModelTask(
+        type=task_type,
+        status=status,
+        priority=priority,
+        start_time=start_time,
+        end_time=end_time,
+        result=json.loads(result) if result is not None else None,
+    )
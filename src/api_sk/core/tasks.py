@@ -0,0 +1,387 @@
+# tasks.py
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import os
+import time
+import uuid
+from collections.abc import Callable, Coroutine
+from concurrent.futures import ThreadPoolExecutor
+
+from api_sk.core.config import settings
+from api_sk.core.events import TaskEvents, task_events
+from api_sk.core.metrics import Gauge
+from api_sk.core.task_store import MemoryTaskStore, SQLiteTaskStore
+from api_sk.schemas.schemas import ModelTask
+
+logger = logging.getLogger("uvicorn.error")
+
+# Seconds between checks for cancellations requested by other processes, and
+# maximum seconds waited for another process to cancel a task
+CANCEL_POLL_INTERVAL = 0.2
+CANCEL_TIMEOUT = 10
+
+
+class TaskManager:
+    """
+    Runs the background tasks of this process, with a limit on the tasks running at
+    once, and registers them in a task store.
+
+    Tasks over the limit wait in a queue, ordered by priority (lower values first)
+    and then by submission. Finished tasks are kept by the store, which can be
+    shared with other processes (see SQLiteTaskStore) so that any of them can
+    report on or cancel a task. Every change of status or progress of the tasks of
+    this process is published to `events`.
+
+    A shared store is used from threads, so the event loop is never blocked by the
+    database: reads run in a pool of `pool_size` threads, and writes in a thread of
+    their own, in the order they were made. A task of this process is read from
+    memory until its result is written, and its end is published after that.
+
+    Parameters:
+        max_running (int): Maximum number of tasks running at the same time in this process.
+        store (MemoryTaskStore|SQLiteTaskStore): Registry of the tasks.
+        events (TaskEvents): Broadcaster of the task events.
+        pool_size (int, optional): Default value is 4. Threads reading a shared store.
+    """
+
+    def __init__(
+        self,
+        max_running: int,
+        store: MemoryTaskStore | SQLiteTaskStore,
+        events: TaskEvents,
+        pool_size: int = 4,
+    ):
+        self.max_running = max_running
+        self.store = store
+        self.events = events
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.running = 0
+
+        self._active: dict[
+            str, ModelTask
+        ] = {}  # Queued and running tasks of this process
+        self._queue = []  # Heap of (priority, order, task ID)
+        self._factories: dict[str, Callable[[], Coroutine]] = {}
+        self._order = itertools.count()
+        self._readers = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="task-store"
+        )
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="task-store-writer"
+        )
+        self.last_counts: dict[str, int] = {}  # Counts read last, for the metrics
+
+    async def total(self) -> int:
+        """
+        Counts the registered tasks.
+
+        Returns:
+            int: Number of tasks.
+        """
+        return await self._read(len, self.store)
+
+    def submit(
+        self,
+        task_id: str,
+        factory: Callable[[], Coroutine],
+        task_type: str,
+        priority: int = 0,
+    ) -> ModelTask:
+        """
+        Registers a task, and starts it if there is a free slot.
+
+        Parameters:
+            task_id (str): ID of the task.
+            factory (Callable): Returns the coroutine to run when the task starts. Its return value is stored as the result of the task.
+            task_type (str): Type of the task, shown when listing tasks.
+            priority (int, optional): Default value is 0. Queued tasks with lower values start first.
+
+        Returns:
+            ModelTask: Registered task.
+        """
+        time_str = str(datetime.datetime.now())
+        task_ob = ModelTask(
+            start_time=time_str, type=task_type, status="Queued", priority=priority
+        )
+        self._active[task_id] = task_ob
+        self._write(self.store.add, task_id, task_ob, self.owner)
+        self._factories[task_id] = factory
+        heapq.heappush(self._queue, (priority, next(self._order), task_id))
+        self.events.publish(task_id, task_ob)
+        self._start_next()
+        return task_ob
+
+    async def get(self, task_id: str) -> ModelTask | None:
+        """
+        Returns a task by ID, or None if it does not exist or has expired.
+
+        Parameters:
+            task_id (str): ID of the task.
+
+        Returns:
+            ModelTask|None: Task.
+        """
+        task_ob = self._active.get(task_id)
+        if task_ob is not None:
+            return task_ob
+        return await self._read(self.store.get, task_id)
+
+    async def status(self, task_id: str) -> str | None:
+        """
+        Returns the status of a task by ID, or None if it does not exist or has
+        expired. Unlike `get`, it does not read the result of finished tasks.
+
+        Parameters:
+            task_id (str): ID of the task.
+
+        Returns:
+            str|None: Status.
+        """
+        task_ob = self._active.get(task_id)
+        if task_ob is not None:
+            return task_ob.status
+        return await self._read(self.store.status, task_id)
+
+    def runs(self, task_id: str) -> bool:
+        """
+        Checks whether a task is queued or running in this process.
+        """
+        return task_id in self._active
+
+    def report_progress(self, task_id: str, progress: float):
+        """
+        Publishes the fraction of a running task that is done, if it changed.
+
+        Parameters:
+            task_id (str): ID of the task.
+            progress (float): Fraction done, between 0 and 1.
+        """
+        task_ob = self._active.get(task_id)
+        if task_ob is not None and task_ob.progress != progress:
+            task_ob.progress = progress
+            self.events.publish(task_id, task_ob)
+
+    async def page(self, offset: int = 0, limit: int = 100) -> dict[str, ModelTask]:
+        """
+        Returns a page of the tasks, in submission order.
+
+        Parameters:
+            offset (int, optional): Default value is 0. Number of tasks to skip.
+            limit (int, optional): Default value is 100. Maximum number of tasks returned.
+
+        Returns:
+            dict[str, ModelTask]: Tasks by ID.
+        """
+        return await self._read(self.store.page, offset, limit)
+
+    async def counts(self) -> dict[str, int]:
+        """
+        Counts the registered tasks by status, and keeps the counts as
+        `last_counts`.
+
+        Returns:
+            dict[str, int]: Number of tasks of each status.
+        """
+        self.last_counts = await self._read(self.store.counts)
+        return self.last_counts
+
+    async def version(self) -> str:
+        """
+        Returns the version of the task registry, which changes whenever a task is
+        added, changes its status or is removed.
+
+        Returns:
+            str: Version.
+        """
+        return await self._read(self.store.version)
+
+    async def cancel(self, task_id: str) -> bool:
+        """
+        Cancels a queued or running task and removes it from the registry. Tasks of
+        other processes are cancelled by them, and this waits until they are.
+
+        Parameters:
+            task_id (str): ID of the task.
+
+        Returns:
+            bool: False if the process running the task did not cancel it in `CANCEL_TIMEOUT` seconds.
+        """
+        task_ob = self._active.get(task_id)
+        if task_ob is None:
+            if await self._read(self.store.status, task_id) is not None:
+                return await self._cancel_remote(task_id)
+            return True
+
+        if task_ob.task is None:
+            # Still queued, its heap entry is skipped when it comes up
+            self._factories.pop(task_id, None)
+            task_ob.status = "Cancelled"
+            self.events.publish(task_id, task_ob)
+        else:
+            task_ob.task.cancel()
+            try:
+                await task_ob.task  # Wait for the task to handle the cancellation
+            except asyncio.CancelledError:
+                logger.info(f"Task {task_id} successfully cancelled")
+
+        await self._remove(task_id)
+        return True
+
+    async def _cancel_remote(self, task_id: str) -> bool:
+        await self._write(self.store.request_cancel, task_id)
+        deadline = time.monotonic() + CANCEL_TIMEOUT
+        while time.monotonic() < deadline:
+            status = await self._read(self.store.status, task_id)
+            if status is None:
+                return True
+            if status not in ("Queued", "Running"):
+                # Finished meanwhile, or reaped as its process stopped
+                await self._write(self.store.remove, task_id)
+                return True
+            await asyncio.sleep(CANCEL_POLL_INTERVAL / 4)
+
+        logger.warning(f"Task {task_id} was not cancelled by its process in time")
+        return False
+
+    async def watch(self):
+        """
+        Carries out the cancellations of tasks of this process requested by other
+        processes, records the heartbeat of this process, reaps the tasks of
+        processes that stopped and purges the expired tasks. Runs until cancelled,
+        and returns at once if the store is not shared.
+        """
+        if not self.store.shared:
+            return
+
+        heartbeat = 0.0
+        try:
+            while True:
+                # A few heartbeats fit in the timeout, so a slow one is not fatal
+                if time.monotonic() - heartbeat >= settings.TASK_OWNER_TIMEOUT / 3:
+                    heartbeat = time.monotonic()
+                    await self._write(self.store.heartbeat, self.owner)
+                    reaped = await self._write(
+                        self.store.reap, settings.TASK_OWNER_TIMEOUT
+                    )
+                    if reaped:
+                        logger.warning(f"{reaped} tasks of stopped workers failed")
+                    await self._write(self.store.purge)
+
+                requests = await self._read(self.store.cancel_requests, self.owner)
+                for task_id in requests:
+                    if task_id in self._active:
+                        await self.cancel(task_id)
+                    else:
+                        # Finished in the meantime
+                        await self._write(self.store.remove, task_id)
+                await asyncio.sleep(CANCEL_POLL_INTERVAL)
+        finally:
+            # Our tasks stop with us, so others can reap them at once. The loop is
+            # stopping, so we write it right away.
+            self.store.drop_owner(self.owner)
+
+    def _start_next(self):
+        while self.running < self.max_running and self._queue:
+            _, _, task_id = heapq.heappop(self._queue)
+            factory = self._factories.pop(task_id, None)
+            if factory is None:  # Cancelled while queued
+                continue
+
+            task_ob = self._active[task_id]
+            task_ob.task = asyncio.create_task(factory())
+            task_ob.status = "Running"
+            self._write(self.store.update, task_id, task_ob)
+            self.events.publish(task_id, task_ob)
+            self.running += 1
+            task_ob.task.add_done_callback(lambda t, i=task_id: self._after_done(t, i))
+
+    def _after_done(self, task: asyncio.Task, task_id: str):
+        """
+        After a task is finished, it changes its status, frees its slot and starts
+        the next queued task. The task leaves memory, and its end is published, once
+        it is written to the store.
+        """
+        self.running -= 1
+
+        task_ob = self._active.get(task_id)
+        if task_ob is not None:
+            if task.cancelled():
+                task_ob.status = "Cancelled"
+            elif task.exception() is not None:
+                logger.error(
+                    f"Run with task ID: {task_id} failed: {task.exception()!r}"
+                )
+                task_ob.status = "Failed"
+            else:
+                task_ob.status = "Completed"
+                task_ob.result = task.result()
+                task_ob.progress = 1.0
+            task_ob.end_time = str(datetime.datetime.now())
+            written = self._write(self.store.finish, task_id, task_ob)
+            written.add_done_callback(
+                lambda _, i=task_id, t=task_ob: self._after_finish(i, t)
+            )
+
+        self._start_next()
+
+    def _after_finish(self, task_id: str, task_ob: ModelTask):
+        # A cancelled task was already removed by `cancel`
+        if self._active.get(task_id) is task_ob:
+            del self._active[task_id]
+        self.events.publish(task_id, task_ob)
+
+    def _remove(self, task_id: str) -> asyncio.Future:
+        self._active.pop(task_id, None)
+        self._factories.pop(task_id, None)
+        return self._write(self.store.remove, task_id)
+
+    async def _read(self, function: Callable, *args):
+        """
+        Runs a read of the store, in the pool of readers if the store is shared.
+        """
+        if not self.store.shared:
+            return function(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, function, *args)
+
+    def _write(self, function: Callable, *args) -> asyncio.Future:
+        """
+        Runs a write to the store, in the thread of the writes if the store is
+        shared. It can be awaited, or left to finish on its own, which logs its
+        errors.
+        """
+        loop = asyncio.get_running_loop()
+        if self.store.shared:
+            future = loop.run_in_executor(self._writer, function, *args)
+        else:
+            future = loop.create_future()
+            future.set_result(function(*args))
+        future.add_done_callback(_log_failure)
+        return future
+
+
+def _log_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Write to the task registry failed: {future.exception()!r}")
+
+
+if settings.TASK_DB:
+    task_store = SQLiteTaskStore(
+        settings.TASK_DB, settings.MAX_FINISHED_TASKS, settings.TASK_RESULT_TTL
+    )
+else:
+    task_store = MemoryTaskStore(settings.MAX_FINISHED_TASKS, settings.TASK_RESULT_TTL)
+
+task_manager = TaskManager(
+    settings.MAX_RUNNING_TASKS, task_store, task_events, settings.TASK_DB_POOL_SIZE
+)
+
+task_count = Gauge(
+    "apisk_tasks",
+    "Registered tasks, by status.",
+    ("status",),
+    function=lambda: {(s,): n for s, n in task_manager.last_counts.items()},
+)
@@ -0,0 +1,193 @@
+# user_store.py
+
+import asyncio
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from api_sk.core.config import settings
+
+# Columns of the users table, in the order of the User schemas
+USER_COLUMNS = ("username", "email", "full_name", "is_superuser", "hashed_password")
+
+# Version of the database schema, stored as the SQLite user_version
+SCHEMA_VERSION = 1
+
+
+class UserStore:
+    """
+    User database stored in SQLite, in WAL mode so that reads are not blocked by
+    writes.
+
+    Users are looked up by username, which is the primary key of the table, and
+    every change is written as a single row. Each thread uses its own connection,
+    and the async methods run in a pool of `pool_size` threads, so the event loop
+    is never blocked by the database.
+
+    The first time the database is opened, the users of `json_path` (if given) are
+    imported into it.
+
+    Parameters:
+        path (str|Path): Path to the SQLite file.
+        json_path (str|Path|None, optional): Default value is None. JSON user database imported once.
+        pool_size (int, optional): Default value is 4. Threads (and connections) used by the async methods.
+    """
+
+    def __init__(
+        self, path: str | Path, json_path: str | Path | None = None, pool_size: int = 4
+    ):
+        self.path = str(path)
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="user-store"
+        )
+        self._migrate(json_path)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Returns the connection of the current thread, opening it if needed.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _migrate(self, json_path: str | Path | None):
+        """
+        Creates the users table and imports the JSON user database, only if the
+        database has not been set up yet.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            (version,) = connection.execute("PRAGMA user_version").fetchone()
+            if version < SCHEMA_VERSION:
+                connection.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS users (
+                        username TEXT PRIMARY KEY,
+                        email TEXT,
+                        full_name TEXT,
+                        is_superuser INTEGER NOT NULL DEFAULT 0,
+                        hashed_password BLOB
+                    )
+                    """
+                )
+                if json_path is not None and Path(json_path).exists():
+                    with open(json_path, "r") as file:
+                        users = json.load(file)
+                    connection.executemany(
+                        "INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?)",
+                        [_row(user) for user in users.values()],
+                    )
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def get_user(self, username: str) -> dict | None:
+        """
+        Returns a user by username.
+
+        Parameters:
+            username (str): Username of the user.
+
+        Returns:
+            dict|None: User data, with the fields of UserInDB, or None if it does not exist.
+        """
+        row = (
+            self._connection()
+            .execute(
+                f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE username = ?",
+                (username,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+
+        user = dict(zip(USER_COLUMNS, row))
+        user["is_superuser"] = bool(user["is_superuser"])
+        return user
+
+    def add_user(self, user: dict) -> bool:
+        """
+        Inserts a user.
+
+        Parameters:
+            user (dict): User data, with the fields of UserInDB.
+
+        Returns:
+            bool: True if the user was inserted. False if the username already exists.
+        """
+        try:
+            self._connection().execute(
+                "INSERT INTO users VALUES (?, ?, ?, ?, ?)", _row(user)
+            )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def delete_user(self, username: str) -> bool:
+        """
+        Deletes a user by username.
+
+        Parameters:
+            username (str): Username of the user.
+
+        Returns:
+            bool: True if the user was deleted. False if it did not exist.
+        """
+        cursor = self._connection().execute(
+            "DELETE FROM users WHERE username = ?", (username,)
+        )
+        return cursor.rowcount > 0
+
+    async def get_user_async(self, username: str) -> dict | None:
+        """
+        Same as `get_user`, run in the pool of the store.
+        """
+        return await self._run(self.get_user, username)
+
+    async def add_user_async(self, user: dict) -> bool:
+        """
+        Same as `add_user`, run in the pool of the store.
+        """
+        return await self._run(self.add_user, user)
+
+    async def delete_user_async(self, username: str) -> bool:
+        """
+        Same as `delete_user`, run in the pool of the store.
+        """
+        return await self._run(self.delete_user, username)
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, function, *args)
+
+
+def _row(user: dict) -> tuple:
+    """
+    Converts user data to a row of the users table. Passwords are stored as bytes.
+    """
+    hashed_password = user.get("hashed_password")
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode()
+    return (
+        user["username"],
+        user.get("email"),
+        user.get("full_name"),
+        int(bool(user.get("is_superuser", False))),
+        hashed_password,
+    )
+
+
+user_store = UserStore(
+    settings.USERS_DB, settings.USERS_DB_JSON, settings.USERS_DB_POOL_SIZE
+)
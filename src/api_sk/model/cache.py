@@ -0,0 +1,137 @@
+"""Cache of encoded model results, keyed on the weights and the dataset version."""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+from pydantic import BaseModel
+
+from api_sk.core.config import settings
+
+
+def weights_key(weights: BaseModel | list[BaseModel]) -> str:
+    """
+    Computes a canonical hash of one or several weight trees (e.g. CCIWeights).
+
+    Parameters:
+        weights (BaseModel|list[BaseModel]): Weights to hash.
+
+    Returns:
+        str: Hex digest of the canonical weights.
+    """
+    # Weights are dumped as fixed-point strings, so equal weights written
+    # differently (e.g. 0.3 and 0.30) have the same representation
+    if isinstance(weights, list):
+        tree = [w.model_dump(mode="json") for w in weights]
+    else:
+        tree = weights.model_dump(mode="json")
+
+    canonical = json.dumps(tree, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of encoded responses with a byte budget and a time to live.
+
+    Entries are tied to the version of the dataset they were computed from. When
+    a lookup is done with a different version (i.e. the KPIs were reloaded) the
+    whole cache is dropped.
+
+    Parameters:
+        max_bytes (int): Maximum total size of the cached bodies.
+        ttl (float): Seconds an entry is kept.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expiry time, body)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_version(self, version: str):
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def get(self, key: str, version: str) -> bytes | None:
+        """
+        Returns the cached body for a key, or None if missing or expired.
+
+        Parameters:
+            key (str): Key of the entry.
+            version (str): Current version of the dataset.
+
+        Returns:
+            bytes|None: Cached body.
+        """
+        self._check_version(version)
+
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, version: str, body: bytes):
+        """
+        Stores a body, evicting the least recently used entries if needed.
+        Bodies larger than the whole budget are not stored.
+
+        Parameters:
+            key (str): Key of the entry.
+            version (str): Version of the dataset the body was computed from.
+            body (bytes): Encoded response.
+        """
+        self._check_version(version)
+        if len(body) > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        while self.size + len(body) > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+        self._entries[key] = (time.monotonic() + self.ttl, body)
+        self.size += len(body)
+
+    def _remove(self, key: str):
+        _, body = self._entries.pop(key)
+        self.size -= len(body)
+
+    def clear(self):
+        """
+        Drops every entry. Counters are kept.
+        """
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the usage counters of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "dataset_version": self.version,
+        }
+
+
+result_cache = ResultCache(settings.CACHE_MAX_BYTES, settings.CACHE_TTL)
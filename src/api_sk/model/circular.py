@@ -1,143 +1,225 @@
 """Compute the weighted sum indicator."""
 
-from decimal import Decimal
+import json
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
 
-from pydantic import BaseModel, Field, model_validator
+from pydantic import (
+    BaseModel,
+    BeforeValidator,
+    ConfigDict,
+    Field,
+    PlainSerializer,
+    SerializationInfo,
+    WithJsonSchema,
+    create_model,
+    model_validator,
+)
 from typing_extensions import Annotated, Self
 
 from api_sk.core.config import settings
 
-Weight = Annotated[
-    Decimal, Field(ge=0, le=1, strict=False, allow_inf_nan=False, decimal_places=2)
+# Weights and indicators are fixed-point numbers, stored as integer hundredths
+SCALE = 100
+
+
+def fixed(value: int | float | str | Decimal) -> int:
+    """
+    Converts a decimal value in [0, 1] with at most two decimal places to integer
+    hundredths. The public value 0.3 (or "0.3") is stored as 30.
+
+    Parameters:
+        value (int|float|str|Decimal): Public decimal value.
+
+    Returns:
+        int: Value in hundredths.
+    """
+    if type(value) is int:
+        scaled = value * SCALE
+    elif isinstance(value, (float, str, Decimal)) and not isinstance(value, bool):
+        # We read floats through their shortest repr, so 0.3 is exactly 0.3
+        try:
+            number = Decimal(str(value))
+        except InvalidOperation:
+            raise ValueError("Input should be a valid decimal")
+        if not number.is_finite():
+            raise ValueError("Input should be a finite number")
+        # We check the range first, so huge exponents are not expanded
+        if not 0 <= number <= 1:
+            raise ValueError("Input should be between 0 and 1")
+        # Trailing zeros do not count as decimal places, e.g. "0.300"
+        if number.normalize().as_tuple().exponent < -2:
+            raise ValueError("Decimal input should have no more than 2 decimal places")
+        scaled = int(number * SCALE)
+    else:
+        raise ValueError("Input should be a valid decimal")
+
+    if not 0 <= scaled <= SCALE:
+        raise ValueError("Input should be between 0 and 1")
+    return scaled
+
+
+def _public(value: int, info: SerializationInfo) -> str | Decimal:
+    """
+    Converts integer hundredths back to the public decimal representation.
+    """
+    text = f"{value // SCALE}.{value % SCALE:02d}"
+    return text if info.mode_is_json() else Decimal(text)
+
+
+FixedPoint = Annotated[
+    int,
+    BeforeValidator(fixed),
+    PlainSerializer(_public),
+    WithJsonSchema(
+        {"anyOf": [{"type": "number"}, {"type": "string"}], "minimum": 0, "maximum": 1},
+        mode="validation",
+    ),
+    WithJsonSchema(
+        {"type": "string", "pattern": r"^[01]\.\d{2}$"}, mode="serialization"
+    ),
 ]
-Indicator = Annotated[
-    Decimal, Field(ge=0, le=1, strict=False, allow_inf_nan=False, decimal_places=2)
+# Defaults are written as decimals too, so they also need converting
+Weight = Annotated[FixedPoint, Field(validate_default=True)]
+Indicator = Annotated[FixedPoint, Field(validate_default=True)]
+
+
+def _public_delta(value: int, info: SerializationInfo) -> str | Decimal:
+    """
+    Converts a difference in integer hundredths to the public decimal representation.
+    """
+    text = f"{'-' if value < 0 else ''}{abs(value) // SCALE}.{abs(value) % SCALE:02d}"
+    return text if info.mode_is_json() else Decimal(text)
+
+
+# Differences between indicators, in integer hundredths between -1 and 1
+Delta = Annotated[
+    int,
+    PlainSerializer(_public_delta),
+    WithJsonSchema(
+        {"type": "string", "pattern": r"^-?[01]\.\d{2}$"}, mode="serialization"
+    ),
 ]
 
 
-class kpiWeightsD(BaseModel):
-    D1: Weight = Decimal("1")
+def load_areas(path: str | Path) -> dict[str, tuple[Decimal, dict[str, Decimal]]]:
+    """
+    Reads the areas and KPIs of the model from a JSON file, e.g.
+    `{"D": {"area_weight": "0.1", "kpi_weights": {"D1": "1.0"}}, ...}`.
 
-    @model_validator(mode="after")
-    def sum_kpi_weights_d(self, tolerance=settings.TOLERANCE) -> Self:
-        if abs(self.D1 - Decimal("1")) >= Decimal(tolerance):
-            raise ValueError("The sum of the param weights is not 1.")
-        return self
+    The order of the areas, and of the KPIs of each area, is the order of the
+    columns of the KPI matrix.
 
+    Parameters:
+        path (str|Path): Path to the file.
 
-class kpiWeightsECR(BaseModel):
-    ECR1: Weight = Decimal("0.3")
-    ECR2: Weight = Decimal("0.2")
-    ECR3: Weight = Decimal("0.3")
-    ECR4: Weight = Decimal("0.2")
+    Returns:
+        dict[str, tuple[Decimal, dict[str, Decimal]]]: Default area weight and default KPI weights, by area.
+    """
+    with open(path, "r") as file:
+        spec = json.load(file)
 
-    @model_validator(mode="after")
-    def sum_kpi_weights_ecr(self, tolerance=settings.TOLERANCE) -> Self:
-        if abs(self.ECR1 + self.ECR2 + self.ECR3 + self.ECR4 - Decimal("1")) >= Decimal(
-            tolerance
-        ):
-            raise ValueError("The sum of the param weights is not 1.")
-        return self
+    areas, kpis = {}, set()
+    for area, content in spec.items():
+        kpi_weights = {k: Decimal(str(w)) for k, w in content["kpi_weights"].items()}
+        for name in (area, *kpi_weights):
+            if not name.isidentifier() or name in kpis or name == "cci":
+                raise ValueError(f"Invalid or repeated area or KPI name {name}.")
+        kpis.update(kpi_weights)
+        areas[area] = (Decimal(str(content["area_weight"])), kpi_weights)
+    if not areas:
+        raise ValueError("No areas declared.")
+    return areas
 
 
-class kpiWeightsM(BaseModel):
-    M1: Weight = Decimal("0.2")
-    M2: Weight = Decimal("0.2")
-    M3: Weight = Decimal("0.2")
-    M4: Weight = Decimal("0.2")
-    M5: Weight = Decimal("0.2")
+def _check_sum(weights, tolerance: float = settings.TOLERANCE):
+    """
+    Checks that some weights, in hundredths, add up to 1.
+    """
+    if abs(sum(weights) - SCALE) >= tolerance * SCALE:
+        raise ValueError("The sum of the param weights is not 1.")
 
-    @model_validator(mode="after")
-    def sum_kpi_weights_m(self, tolerance=settings.TOLERANCE) -> Self:
-        if abs(
-            self.M1 + self.M2 + self.M3 + self.M4 + self.M5 - Decimal("1")
-        ) >= Decimal(tolerance):
-            raise ValueError("The sum of the param weights is not 1.")
-        return self
 
+class KPIWeights(BaseModel):
+    """
+    Base of the KPI weights of every area, one field per KPI of the area. KPIs of
+    other areas are rejected rather than ignored.
+    """
 
-class kpiWeightsW(BaseModel):
-    W1: Weight = Decimal("0.4")
-    W2: Weight = Decimal("0.4")
-    W3: Weight = Decimal("0.2")
+    model_config = ConfigDict(extra="forbid")
 
     @model_validator(mode="after")
-    def sum_kpi_weights_w(self, tolerance=settings.TOLERANCE) -> Self:
-        if abs(self.W1 + self.W2 + self.W3 - Decimal("1")) >= Decimal(tolerance):
-            raise ValueError("The sum of the param weights is not 1.")
+    def sum_kpi_weights(self) -> Self:
+        _check_sum(self.__dict__.values())
         return self
 
 
 class AreaWeight(BaseModel):
+    """
+    Base of the weights of every area, with the KPI weights of the area.
+    """
+
     area_weight: Weight = Decimal("1.0")
-    kpi_weights: kpiWeightsD | kpiWeightsECR | kpiWeightsM | kpiWeightsW
 
 
-class CCIWeights(BaseModel):
-    D: AreaWeight = AreaWeight(
-        area_weight=Decimal("0.1"), kpi_weights=kpiWeightsD(D1=Decimal("1.0"))
-    )
-    ECR: AreaWeight = AreaWeight(
-        area_weight=Decimal("0.3"),
-        kpi_weights=kpiWeightsECR(
-            ECR1=Decimal("0.3"),
-            ECR2=Decimal("0.2"),
-            ECR3=Decimal("0.3"),
-            ECR4=Decimal("0.2"),
-        ),
-    )
-    M: AreaWeight = AreaWeight(
-        area_weight=Decimal("0.3"),
-        kpi_weights=kpiWeightsM(
-            M1=Decimal("0.2"),
-            M2=Decimal("0.2"),
-            M3=Decimal("0.2"),
-            M4=Decimal("0.2"),
-            M5=Decimal("0.2"),
-        ),
-    )
-    W: AreaWeight = AreaWeight(
-        area_weight=Decimal("0.3"),
-        kpi_weights=kpiWeightsW(
-            W1=Decimal("0.4"), W2=Decimal("0.4"), W3=Decimal("0.2")
-        ),
-    )
+class WeightsBase(BaseModel):
+    """
+    Base of CCIWeights, one field per area.
+    """
 
     @model_validator(mode="after")
-    def sum_area_weights(self, tolerance=settings.TOLERANCE) -> Self:
-        if abs(
-            self.D.area_weight
-            + self.ECR.area_weight
-            + self.M.area_weight
-            + self.W.area_weight
-            - Decimal("1")
-        ) >= Decimal(tolerance):
-            raise ValueError("The sum of the param weights is not 1.")
+    def sum_area_weights(self) -> Self:
+        _check_sum(area.area_weight for area in self.__dict__.values())
         return self
 
 
-class AreaKPIs(BaseModel):
-    D: Indicator = Decimal("0.0")
-    ECR: Indicator = Decimal("0.0")
-    M: Indicator = Decimal("0.0")
-    W: Indicator = Decimal("0.0")
+# We compile the declared areas once into one model per area, so that every area
+# key is validated against its own KPIs
+AREA_SPEC = load_areas(settings.AREAS_FILE)
+# KPIs of every area, in the order of the KPI matrix
+AREA_KPIS = {area: tuple(kpis) for area, (_, kpis) in AREA_SPEC.items()}
+
+KPI_WEIGHT_MODELS = {
+    area: create_model(
+        f"kpiWeights{area}",
+        __base__=KPIWeights,
+        **{kpi: (Weight, weight) for kpi, weight in kpis.items()},
+    )
+    for area, (_, kpis) in AREA_SPEC.items()
+}
+AREA_WEIGHT_MODELS = {
+    area: create_model(
+        f"AreaWeight{area}",
+        __base__=AreaWeight,
+        area_weight=(Weight, area_weight),
+        kpi_weights=(KPI_WEIGHT_MODELS[area], KPI_WEIGHT_MODELS[area]()),
+    )
+    for area, (area_weight, _) in AREA_SPEC.items()
+}
+CCIWeights = create_model(
+    "CCIWeights",
+    __base__=WeightsBase,
+    **{area: (model, model()) for area, model in AREA_WEIGHT_MODELS.items()},
+)
+AreaKPIs = create_model(
+    "AreaKPIs", **{area: (Indicator, Decimal("0.0")) for area in AREA_SPEC}
+)
+
+# We expose the generated models as attributes of the module, like the classes
+# defined in it, so that pickle finds them (e.g. requests sent to the workers)
+for _model in (*KPI_WEIGHT_MODELS.values(), *AREA_WEIGHT_MODELS.values()):
+    globals()[_model.__name__] = _model
+del _model
 
 
 class DistrictIndicators(BaseModel):
-    area_kpis: AreaKPIs = AreaKPIs(
-        D=Decimal("0.0"), ECR=Decimal("0.0"), M=Decimal("0.0"), W=Decimal("0.0")
-    )
+    area_kpis: AreaKPIs = AreaKPIs()
     cci: Indicator = Decimal("0.0")
 
 
 class District(BaseModel):
     id: str
-    indicators: DistrictIndicators = DistrictIndicators(
-        area_kpis=AreaKPIs(
-            D=Decimal("0.0"), ECR=Decimal("0.0"), M=Decimal("0.0"), W=Decimal("0.0")
-        ),
-        cci=Decimal("0.0"),
-    )
+    indicators: DistrictIndicators = DistrictIndicators()
 
 
 class Districts(BaseModel):
@@ -148,3 +230,37 @@ class Districts(BaseModel):
         if len(set(district.id for district in self.districts)) != len(self.districts):
             raise ValueError("IDs are not different.")
         return self
+
+
+class DistrictPage(BaseModel):
+    districts: list[District]
+    next_cursor: str | None = None
+
+
+class Rollup(BaseModel):
+    level: str
+    units: list[District]
+
+
+class ScenarioDistrict(BaseModel):
+    id: str
+    cci: list[FixedPoint]
+
+
+class ScenarioDistricts(BaseModel):
+    scenarios: int
+    districts: list[ScenarioDistrict]
+
+
+class Trajectory(BaseModel):
+    id: str
+    values: list[FixedPoint | None]
+    deltas: list[Delta | None]
+    rolling: list[FixedPoint | None]
+
+
+class Trajectories(BaseModel):
+    indicator: str
+    window: int
+    periods: list[str]
+    districts: list[Trajectory]
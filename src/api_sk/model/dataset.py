@@ -0,0 +1,182 @@
+"""On-disk layout of the district KPI dataset, mapped read-only by every process."""
+
+import hashlib
+import os
+import shutil
+import uuid
+from pathlib import Path
+from stat import S_ISDIR
+
+import numpy as np
+
+# File of a dataset directory holding the name of its current version
+CURRENT = "CURRENT"
+# Files of a version directory: the KPI matrix (int64 hundredths, one row per
+# district) and the district IDs, both as .npy arrays. Versions published as
+# float64 values are still read.
+KPIS_FILE = "kpis.npy"
+IDS_FILE = "ids.npy"
+
+
+def dataset_version(ids: list[str], kpis: np.ndarray) -> str:
+    """
+    Computes the content-derived version of a dataset.
+
+    Parameters:
+        ids (list[str]): Identifiers of the districts.
+        kpis (np.ndarray): C-contiguous KPI matrix.
+
+    Returns:
+        str: Version, 16 hex characters.
+    """
+    digest = hashlib.sha256("\0".join(ids).encode())
+    if kpis.size:  # Empty views cannot be cast
+        digest.update(
+            memoryview(kpis).cast("B")
+        )  # We hash the buffer without copying it
+    return digest.hexdigest()[:16]
+
+
+def update_version(
+    version: str, rows: np.ndarray, columns: np.ndarray, values: np.ndarray
+) -> str:
+    """
+    Derives the version of a dataset after some of its KPIs changed, from the
+    previous version and the changed cells, without hashing the whole matrix.
+
+    Parameters:
+        version (str): Previous version.
+        rows (np.ndarray): Rows of the changed cells, int64.
+        columns (np.ndarray): Columns of the changed cells, int64.
+        values (np.ndarray): New values of the cells, int64 hundredths.
+
+    Returns:
+        str: Version, 16 hex characters.
+    """
+    digest = hashlib.sha256(version.encode())
+    for array in (rows, columns, values):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def dataset_stamp(path: str | Path | None) -> tuple | None:
+    """
+    Returns a stamp that changes whenever the dataset at a path changes, from a
+    `stat` or two: that of the CURRENT file of a dataset directory, which every
+    publication replaces, or that of the KPI file itself.
+
+    Parameters:
+        path (str|Path|None): Dataset directory or KPI file.
+
+    Returns:
+        tuple|None: Inode, modification time and size, or None if there is nothing at the path.
+    """
+    if path is None:
+        return None
+    try:
+        info = os.stat(path)
+        if S_ISDIR(info.st_mode):
+            info = os.stat(os.path.join(path, CURRENT))
+    except OSError:  # Nothing there, or nothing published yet
+        return None
+    return info.st_ino, info.st_mtime_ns, info.st_size
+
+
+def is_dataset(path: str | Path) -> bool:
+    """
+    Checks whether a path is a dataset directory or one of its version directories.
+    """
+    path = Path(path)
+    return (path / CURRENT).is_file() or (path / KPIS_FILE).is_file()
+
+
+def is_empty_dataset(path: str | Path) -> bool:
+    """
+    Checks whether a path is meant as a dataset directory with no version published
+    yet: an empty directory, or a missing path without a file extension.
+    """
+    path = Path(path)
+    if path.is_dir():
+        return not any(path.iterdir())
+    return not path.exists() and not path.suffix
+
+
+def read_dataset(path: str | Path) -> tuple[list[str], np.ndarray, str, Path]:
+    """
+    Maps the current version of a dataset directory, or a given version directory.
+
+    The KPI matrix is memory-mapped read-only, so processes mapping the same
+    version share its pages, and nothing is copied until rows are used.
+
+    Parameters:
+        path (str|Path): Dataset directory or version directory.
+
+    Returns:
+        tuple[list[str], np.ndarray, str, Path]: IDs, mapped KPI matrix, version and version directory.
+    """
+    path = Path(path)
+    if (path / CURRENT).is_file():
+        path = path / (path / CURRENT).read_text().strip()
+
+    ids = np.load(path / IDS_FILE).tolist()
+    kpis = np.load(path / KPIS_FILE, mmap_mode="r")
+    return ids, kpis, path.name, path
+
+
+def publish_dataset(
+    directory: str | Path,
+    ids: list[str],
+    kpis: np.ndarray,
+    version: str | None = None,
+) -> str:
+    """
+    Writes a new version of a dataset and makes it the current one.
+
+    The version is written to a temporary directory, renamed to its final name and
+    then the CURRENT file is atomically replaced, so readers always see either the
+    previous version or the new one complete. Versions other than the new one and
+    the previous one are removed (processes still mapping them keep their pages).
+
+    Parameters:
+        directory (str|Path): Dataset directory, created if needed.
+        ids (list[str]): Identifiers of the districts, already validated.
+        kpis (np.ndarray): Integer KPI matrix in hundredths, already validated.
+        version (str|None, optional): Default value is None. Version of the KPIs, e.g. from `update_version`. If None, it is derived from their content.
+
+    Returns:
+        str: Version published.
+    """
+    # Casting KPIs between 0 and 1 to integers would zero them
+    if np.asarray(kpis).dtype.kind not in "iu":
+        raise ValueError("KPIs must be published as integer hundredths.")
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    kpis = np.ascontiguousarray(kpis, dtype=np.int64)
+    if version is None:
+        version = dataset_version(ids, kpis)
+
+    target = directory / version
+    if not target.exists():
+        staging = directory / f".{version}-{uuid.uuid4().hex[:8]}"
+        staging.mkdir()
+        np.save(staging / KPIS_FILE, kpis)
+        np.save(staging / IDS_FILE, np.array(ids, dtype=str))
+        os.replace(staging, target)
+
+    previous = None
+    if (directory / CURRENT).is_file():
+        previous = (directory / CURRENT).read_text().strip()
+
+    pointer = directory / f".{CURRENT}-{uuid.uuid4().hex[:8]}"
+    with open(pointer, "w") as file:
+        file.write(version)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(pointer, directory / CURRENT)
+
+    for entry in directory.iterdir():
+        if entry.is_dir() and entry.name not in (version, previous):
+            if not entry.name.startswith("."):
+                shutil.rmtree(entry, ignore_errors=True)
+
+    return version
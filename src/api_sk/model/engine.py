@@ -0,0 +1,643 @@
+"""Vectorized computation of the circularity index for every district."""
+
+import io
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+
+from api_sk.core.config import settings
+from api_sk.model.circular import AREA_KPIS, SCALE, CCIWeights
+from api_sk.model.dataset import (
+    dataset_stamp,
+    dataset_version,
+    is_dataset,
+    is_empty_dataset,
+    read_dataset,
+    update_version,
+)
+from api_sk.model.hierarchy import Hierarchy
+
+# Layout of the KPI matrix. Each area owns a contiguous block of columns, in the
+# order the areas and their KPIs are declared (see `settings.AREAS_FILE`).
+AREAS = tuple(AREA_KPIS)
+KPIS = tuple(kpi for kpis in AREA_KPIS.values() for kpi in kpis)
+AREA_SLICES = {}
+_start = 0
+for _area, _kpis in AREA_KPIS.items():
+    AREA_SLICES[_area] = slice(_start, _start + len(_kpis))
+    _start += len(_kpis)
+# Index of the area each KPI column belongs to
+KPI_AREA = np.array([j for j, kpis in enumerate(AREA_KPIS.values()) for _ in kpis])
+
+# Columns of the result matrix: one per area plus the final index
+RESULT_COLUMNS = AREAS + ("cci",)
+
+
+def weight_matrix(cci_weights: CCIWeights) -> np.ndarray:
+    """
+    Flattens a CCIWeights object into a single weight matrix.
+
+    The first columns hold the KPI weights of each area (a block diagonal matrix),
+    and the last one the KPI weights scaled by the area weights, so that a single
+    product `kpis @ weight_matrix` yields the area KPIs and the cci at once.
+
+    Weights are integer ten-thousandths, so the product with KPIs in hundredths
+    gives the exact indicators in millionths (see `round_hundredths`).
+
+    Parameters:
+        cci_weights (CCIWeights): Validated weights for areas and KPIs.
+
+    Returns:
+        np.ndarray: int64 matrix of shape (len(KPIS), len(RESULT_COLUMNS)).
+    """
+    matrix = np.zeros((len(KPIS), len(RESULT_COLUMNS)), dtype=np.int64)
+    for j, (area, area_weight, kpi_weights) in enumerate(area_weights(cci_weights)):
+        block = np.array(kpi_weights)
+        matrix[AREA_SLICES[area], j] = block * SCALE
+        matrix[AREA_SLICES[area], -1] = area_weight * block
+    return matrix
+
+
+def round_hundredths(millionths: np.ndarray) -> np.ndarray:
+    """
+    Rounds indicators in millionths to the integer hundredths of the Indicator
+    type, halves up. Integers are rounded exactly, floats (e.g. weighted means)
+    to the nearest hundredth.
+
+    Parameters:
+        millionths (np.ndarray): Indicators in millionths.
+
+    Returns:
+        np.ndarray: int64 indicators in hundredths, between 0 and SCALE.
+    """
+    return _round_in_place(np.array(millionths))
+
+
+def _round_in_place(millionths: np.ndarray) -> np.ndarray:
+    # We round in the array itself, as the products of the engine are large
+    if millionths.dtype.kind == "f":
+        # Halves of a hundredth are exact in floating point, as in the history
+        millionths /= SCALE**2
+        millionths += 0.5
+        np.floor(millionths, out=millionths)
+        np.clip(millionths, 0, SCALE, out=millionths)
+        return millionths.astype(np.int64)
+    millionths += SCALE**2 // 2
+    millionths //= SCALE**2
+    return np.clip(millionths, 0, SCALE, out=millionths)
+
+
+def area_weights(cci_weights: CCIWeights) -> list[tuple[str, int, tuple[int, ...]]]:
+    """
+    Lists the weights of each area, in integer hundredths.
+
+    Parameters:
+        cci_weights (CCIWeights): Validated weights for areas and KPIs.
+
+    Returns:
+        list[tuple[str, int, tuple[int, ...]]]: Area, area weight and KPI weights (in the order of the KPI columns of the area), for every area.
+    """
+    weights = []
+    for area in AREAS:
+        area_weight = getattr(cci_weights, area)
+        kpi_weights = area_weight.kpi_weights
+        block = tuple(getattr(kpi_weights, kpi) for kpi in AREA_KPIS[area])
+        weights.append((area, area_weight.area_weight, block))
+    return weights
+
+
+def to_hundredths(values: np.ndarray) -> np.ndarray:
+    """
+    Converts KPI values in [0, 1] with two decimals, already checked (see
+    `check_values`), to integer hundredths.
+
+    Parameters:
+        values (np.ndarray): KPI values.
+
+    Returns:
+        np.ndarray: int64 KPIs in hundredths.
+    """
+    return np.rint(np.multiply(values, SCALE)).astype(np.int64)
+
+
+def check_values(values: np.ndarray) -> np.ndarray:
+    """
+    Checks KPI values against the constraints of Indicator: finite, between 0 and 1
+    and with no more than two decimal places.
+
+    Parameters:
+        values (np.ndarray): KPI values.
+
+    Returns:
+        np.ndarray: Boolean mask of the invalid values.
+    """
+    with np.errstate(invalid="ignore"):
+        scaled = values * SCALE
+        return ~(
+            (values >= 0) & (values <= 1) & (np.abs(scaled - np.rint(scaled)) <= 1e-6)
+        )
+
+
+class AreaCache:
+    """
+    LRU cache of area KPI columns (the area KPIs of every district, in exact
+    millionths), per area and KPI weights of the area.
+
+    A change in the weights of one area then only recomputes the column of that
+    area, and a change in the area weights only blends the cached columns again.
+
+    Parameters:
+        max_entries (int): Maximum number of columns kept per area.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = {area: OrderedDict() for area in AREAS}
+
+    def get(self, area: str, kpi_weights: tuple[int, ...]) -> np.ndarray | None:
+        entries = self._entries[area]
+        column = entries.get(kpi_weights)
+        if column is not None:
+            entries.move_to_end(kpi_weights)
+        return column
+
+    def put(self, area: str, kpi_weights: tuple[int, ...], column: np.ndarray):
+        entries = self._entries[area]
+        entries[kpi_weights] = column
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def items(self, area: str) -> list[tuple[tuple[int, ...], np.ndarray]]:
+        return list(self._entries[area].items())
+
+    def clear(self):
+        for entries in self._entries.values():
+            entries.clear()
+
+
+def validate_kpis(ids: list[str], kpis: np.ndarray):
+    """
+    Checks that a KPI matrix has one row per district, that the IDs are different
+    and that every value is in [0, 1].
+
+    Parameters:
+        ids (list[str]): Identifiers of the districts.
+        kpis (np.ndarray): KPI matrix, in integer hundredths.
+    """
+    if kpis.shape != (len(ids), len(KPIS)):
+        raise ValueError(f"KPI matrix has shape {kpis.shape}, expected one row per ID.")
+    if len(set(ids)) != len(ids):
+        raise ValueError("IDs are not different.")
+    # The reductions need no temporary arrays
+    if len(ids) and not (kpis.min() >= 0 and kpis.max() <= SCALE):
+        raise ValueError("KPI values must be between 0 and 1.")
+
+
+class CCIEngine:
+    """
+    Holds the KPI values of every district as a matrix and computes the
+    circularity index of all of them at once.
+
+    KPIs are held as integer hundredths, like the Indicator type, and weights as
+    integer hundredths too, so the indicators are exact integers until they are
+    rounded to hundredths, halves up, as the KPI history does.
+
+    Parameters:
+        ids (list[str]): Unique identifiers of the districts.
+        kpis (np.ndarray): Matrix of shape (len(ids), len(KPIS)), see `load`.
+    """
+
+    def __init__(
+        self,
+        ids: list[str],
+        kpis: np.ndarray,
+        version: str | None = None,
+        path: Path | None = None,
+    ):
+        self.hierarchy = None
+        # Stamp of the dataset file the KPIs were read from, see `dataset_stamp`
+        self.stamp = None
+        self._update_lock = threading.Lock()
+        self.load(ids, kpis, version, path)
+
+    def load(
+        self,
+        ids: list[str],
+        kpis: np.ndarray,
+        version: str | None = None,
+        path: Path | None = None,
+    ):
+        """
+        Replaces the districts held by the engine and updates the dataset version.
+
+        Parameters:
+            ids (list[str]): Unique identifiers of the districts.
+            kpis (np.ndarray): Matrix of shape (len(ids), len(KPIS)), in integer hundredths. It may be memory-mapped, in which case it is not copied. A float matrix holds the values in [0, 1] instead (e.g. from a `.npz` file), which must have at most 2 decimals.
+            version (str|None, optional): Default value is None. Version of the dataset, if already known. The KPI values are then assumed to have been validated when the dataset was published.
+            path (Path|None, optional): Default value is None. Version directory the KPIs are mapped from.
+        """
+        if np.asarray(kpis).dtype.kind == "f":
+            if check_values(kpis).any():
+                raise ValueError(
+                    "KPI values must be between 0 and 1 with at most 2 decimals."
+                )
+            kpis = to_hundredths(kpis)
+        kpis = np.ascontiguousarray(kpis, dtype=np.int64)
+        if version is None:
+            validate_kpis(ids, kpis)
+            version = dataset_version(list(ids), kpis)
+        elif kpis.shape != (len(ids), len(KPIS)):
+            raise ValueError(
+                f"KPI matrix has shape {kpis.shape}, expected one row per ID."
+            )
+
+        ids = list(ids)
+        ids_json = [json.dumps(i) for i in ids]
+        ids_array = np.array(ids, dtype=str)
+        # We swap the districts under the update lock, so that an update running
+        # meanwhile does not write into the previous ones
+        with self._update_lock:
+            self.ids = ids
+            self.kpis = kpis
+            self.path = path
+            self.area_cache = AreaCache(settings.AREA_CACHE_ENTRIES)
+            self._rows = None  # Row of each ID, built on the first update
+            # JSON-encoded ids, computed once so that responses are just joined
+            self.ids_json = ids_json
+            # Same for the id column of columnar responses
+            self.ids_array = ids_array
+            # Content-derived version of the dataset, used to key cached results
+            self.version = version
+            if self.hierarchy is not None:
+                self.hierarchy.align(ids, kpis)
+
+    @staticmethod
+    def read_file(
+        path: str | Path | None,
+    ) -> tuple[list[str], np.ndarray, str | None, Path | None]:
+        """
+        Reads the district KPIs, either from a dataset directory (see
+        `api_sk.model.dataset`), which is memory-mapped, or from a `.npz` file with
+        arrays `ids` and `kpis`, which is loaded in memory.
+
+        Parameters:
+            path (str|Path|None): Path to the dataset. If None, or a dataset directory with nothing published yet, ten districts with all KPIs set to zero are used.
+
+        Returns:
+            tuple: IDs, KPI matrix, version and version directory of the districts (the last two are None unless mapped). These are the arguments of `load`.
+        """
+        if path is None or is_empty_dataset(path):
+            kpis = np.zeros((10, len(KPIS)), dtype=np.int64)
+            return [str(i) for i in range(1, 11)], kpis, None, None
+
+        if is_dataset(path):
+            return read_dataset(path)
+
+        with np.load(path) as data:
+            return [str(i) for i in data["ids"]], data["kpis"], None, None
+
+    @classmethod
+    def from_file(cls, path: str | Path | None) -> "CCIEngine":
+        """
+        Creates an engine from a KPI file. See `read_file`.
+
+        Parameters:
+            path (str|Path|None): Path to the file.
+
+        Returns:
+            CCIEngine: Engine holding the loaded districts.
+        """
+        return cls(*cls.read_file(path))
+
+    def reload(self, path: str | Path | None):
+        """
+        Reloads the districts from a KPI file. See `read_file`.
+
+        Parameters:
+            path (str|Path|None): Path to the file.
+        """
+        self.load(*self.read_file(path))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def update(self, changes: dict[str, dict[str, float]]) -> np.ndarray:
+        """
+        Changes some KPIs of some districts, updating the dataset version.
+
+        A mapped KPI matrix is read-only, so it is copied on the first update, and
+        later updates only write the changed cells. Computations running in this
+        process at the same time may then see some of the new values, as they
+        already did in the cached area columns. The new version is derived from
+        the previous one and the changed cells, see `update_version`. Cached area
+        columns are kept: only the rows of the changed districts are recomputed,
+        and only in the areas of the changed KPIs. Updates may run in threads: they
+        hold a lock, which `load` and the caching of new area columns hold too.
+
+        Parameters:
+            changes (dict[str, dict[str, float]]): New KPI values by district ID and KPI name.
+
+        Returns:
+            np.ndarray: Rows of the changed districts.
+        """
+        # The rows are looked up under the lock too, so that they belong to the
+        # districts being updated even if others are loaded meanwhile
+        with self._update_lock:
+            if self._rows is None:
+                self._rows = {district_id: i for i, district_id in enumerate(self.ids)}
+
+            rows, columns, values = [], [], []
+            for district_id, kpis in changes.items():
+                if district_id not in self._rows:
+                    raise ValueError(f"Unknown district {district_id}.")
+                for kpi, value in kpis.items():
+                    if kpi not in KPIS:
+                        raise ValueError(f"Unknown KPI {kpi}.")
+                    rows.append(self._rows[district_id])
+                    columns.append(KPIS.index(kpi))
+                    values.append(value)
+
+            rows, columns = (
+                np.array(rows, dtype=np.int64),
+                np.array(columns, dtype=np.int64),
+            )
+            values = np.array(values, dtype=np.float64)
+            if check_values(values).any():
+                raise ValueError(
+                    "KPI values must be between 0 and 1 with at most 2 decimals."
+                )
+            values = to_hundredths(values)
+
+            kpis = self.kpis
+            if not kpis.flags.writeable:
+                kpis = kpis.copy()
+            changed = np.unique(rows)
+            before = kpis[changed]  # Copied by the indexing
+            kpis[rows, columns] = values
+            if self.hierarchy is not None:
+                self.hierarchy.update(changed, before, kpis[changed])
+            self.kpis = kpis
+            self.path = None  # No longer the mapped version
+            self.version = update_version(self.version, rows, columns, values)
+
+            # We recompute the dirty rows of every cached column of the dirty areas
+            for j, area in enumerate(AREAS):
+                dirty = np.unique(rows[KPI_AREA[columns] == j])
+                if not len(dirty):
+                    continue
+                block = kpis[dirty, AREA_SLICES[area]]
+                for kpi_weights, column in self.area_cache.items(area):
+                    column[dirty] = block @ (np.array(kpi_weights) * SCALE)
+            return changed
+
+    def compute(self, cci_weights: CCIWeights) -> np.ndarray:
+        """
+        Computes the area KPIs and the cci of every district.
+
+        Area KPI columns are taken from the area cache when the KPI weights of the
+        area were already used, and the cci is blended from them. A column is only
+        cached if no update changed the KPIs while it was computed, as the update
+        could not patch it.
+
+        Parameters:
+            cci_weights (CCIWeights): Weights for areas and KPIs.
+
+        Returns:
+            np.ndarray: int64 matrix of shape (len(self), len(RESULT_COLUMNS)), in hundredths.
+        """
+        results = np.empty((len(self), len(RESULT_COLUMNS)), dtype=np.int64)
+        blend = np.empty(len(AREAS), dtype=np.int64)
+        for j, (area, area_weight, kpi_weights) in enumerate(area_weights(cci_weights)):
+            column = self.area_cache.get(area, kpi_weights)
+            if column is None:
+                version = self.version
+                weights = np.array(kpi_weights) * SCALE
+                column = self.kpis[:, AREA_SLICES[area]] @ weights
+                with self._update_lock:
+                    if self.version == version:
+                        self.area_cache.put(area, kpi_weights, column)
+            results[:, j] = column
+            blend[j] = area_weight
+
+        # Area KPIs are in millionths, so their blend is in hundredths of those
+        results[:, -1] = results[:, : len(AREAS)] @ blend // SCALE
+        return _round_in_place(results)
+
+    def set_hierarchy(self, hierarchy: Hierarchy | None):
+        """
+        Sets the spatial hierarchy of the districts, used by `compute_level`.
+
+        Parameters:
+            hierarchy (Hierarchy|None): Hierarchy, or None to remove it.
+        """
+        if hierarchy is not None:
+            hierarchy.align(self.ids, self.kpis)
+        self.hierarchy = hierarchy
+
+    def compute_level(
+        self, cci_weights: CCIWeights, level: str
+    ) -> tuple[list[str], np.ndarray]:
+        """
+        Computes the area KPIs and the cci of the units of a level of the hierarchy,
+        as weighted means over their districts.
+
+        Parameters:
+            cci_weights (CCIWeights): Weights for areas and KPIs.
+            level (str): Level of the hierarchy.
+
+        Returns:
+            tuple[list[str], np.ndarray]: Units, and their int64 matrix of shape (len(units), len(RESULT_COLUMNS)), in hundredths.
+        """
+        if self.hierarchy is None:
+            raise ValueError("No hierarchy of the districts is configured.")
+        units, kpis = self.hierarchy.kpis(level)
+        return units, _round_in_place(kpis @ weight_matrix(cci_weights))
+
+    def compute_scenarios(self, scenarios: list[CCIWeights]) -> np.ndarray:
+        """
+        Computes the cci of every district for several weighting scenarios.
+
+        The cci columns of the weight matrices of all scenarios are stacked, so
+        that every scenario is evaluated in a single matrix product. It runs in
+        float32, which is exact for these integers (millionths are below 2**24)
+        and much faster than integer products for many scenarios.
+
+        Parameters:
+            scenarios (list[CCIWeights]): Weights for areas and KPIs of each scenario.
+
+        Returns:
+            np.ndarray: int64 matrix of shape (len(self), len(scenarios)), in hundredths.
+        """
+        weights = np.stack([weight_matrix(w)[:, -1] for w in scenarios], axis=1)
+        millionths = self.kpis.astype(np.float32) @ weights.astype(np.float32)
+        return _round_in_place(millionths)
+
+
+# Public two-decimal representation of every value in [0, 1], indexed by hundredths
+HUNDREDTHS = [f"{i // SCALE}.{i % SCALE:02d}" for i in range(SCALE + 1)]
+
+
+def encode_districts(engine: CCIEngine, results: np.ndarray) -> bytes:
+    """
+    Encodes the results of the engine as the JSON body of a Districts object.
+
+    Values are written as the same fixed-point strings the serializer of the
+    Indicator type produces.
+
+    Parameters:
+        engine (CCIEngine): Engine that produced the results.
+        results (np.ndarray): Output of `engine.compute`.
+
+    Returns:
+        bytes: JSON document.
+    """
+    body = ",".join(district_objects(engine.ids_json, results))
+    return f'{{"districts":[{body}]}}'.encode()
+
+
+# JSON fragment of each column of the results (the area KPIs and then the cci) for
+# every value in hundredths. Area names are identifiers (see `load_areas`), so they
+# need no escaping.
+_FRAGMENTS = [
+    np.array([f'{name}:"{text}"' for text in HUNDREDTHS], dtype=object)
+    for name in (
+        f'"area_kpis":{{"{AREAS[0]}"',
+        *(f',"{area}"' for area in AREAS[1:]),
+        '},"cci"',
+    )
+]
+
+
+def district_objects(ids_json: list[str], results: np.ndarray) -> list[str]:
+    """
+    Writes the JSON object of each District from rows of results in hundredths.
+
+    The objects are built a column at a time: adding object arrays concatenates
+    their strings in a numpy loop, so the fragment of a column is appended to every
+    object at once.
+
+    Parameters:
+        ids_json (list[str]): District IDs, already JSON-encoded.
+        results (np.ndarray): Rows of the output of `engine.compute`, one per ID.
+
+    Returns:
+        list[str]: JSON object of each district.
+    """
+    objects = np.array(
+        [f'{{"id":{id_json},"indicators":{{' for id_json in ids_json], dtype=object
+    )
+    for j, fragments in enumerate(_FRAGMENTS):
+        objects += fragments[results[:, j]]
+    objects += "}}"
+    return objects.tolist()
+
+
+def stream_districts(
+    engine: CCIEngine, cci_weights: CCIWeights, ndjson: bool = True
+) -> Iterator[bytes]:
+    """
+    Computes and encodes the districts in chunks of `settings.STREAM_CHUNK_SIZE`
+    rows, so that the first ones can be sent before the rest are computed.
+
+    The districts are a snapshot of the engine when the stream starts, so a reload
+    in the middle does not mix datasets. Their IDs were checked to be different
+    when loaded, so the stream keeps the guarantee of Districts without holding
+    every object at once.
+
+    Parameters:
+        engine (CCIEngine): Engine holding the districts.
+        cci_weights (CCIWeights): Weights for areas and KPIs.
+        ndjson (bool, optional): Default value is True. If True, one District object is written per line. Otherwise, the chunks form the JSON body of a Districts object.
+
+    Returns:
+        Iterator[bytes]: Encoded chunks.
+    """
+    weights = weight_matrix(cci_weights)
+    kpis, ids_json = engine.kpis, engine.ids_json
+    size = settings.STREAM_CHUNK_SIZE
+
+    if not ndjson:
+        yield b'{"districts":['
+    for start in range(0, len(ids_json), size):
+        results = _round_in_place(kpis[start : start + size] @ weights)
+        objects = district_objects(ids_json[start : start + size], results)
+        if ndjson:
+            yield "".join(f"{o}\n" for o in objects).encode()
+        else:
+            yield (("," if start else "") + ",".join(objects)).encode()
+    if not ndjson:
+        yield b"]}"
+
+
+def encode_columns(engine: CCIEngine, results: np.ndarray) -> bytes:
+    """
+    Encodes the results of the engine as an uncompressed `.npz` archive with one
+    array per column: `id` and then RESULT_COLUMNS (D, ECR, M, W and cci).
+
+    Values have two decimals as in the JSON responses. The results are
+    transposed once, so every column is a contiguous row written without copies.
+
+    Parameters:
+        engine (CCIEngine): Engine that produced the results.
+        results (np.ndarray): Output of `engine.compute`.
+
+    Returns:
+        bytes: `.npz` archive.
+    """
+    columns = np.divide(results.T, SCALE, order="C")
+    buffer = io.BytesIO()
+    np.savez(
+        buffer,
+        id=engine.ids_array,
+        **{name: columns[j] for j, name in enumerate(RESULT_COLUMNS)},
+    )
+    return buffer.getvalue()
+
+
+def encode_level(level: str, units: list[str], results: np.ndarray) -> bytes:
+    """
+    Encodes the results of the units of a level as the JSON body of a Rollup
+    object.
+
+    Parameters:
+        level (str): Level of the hierarchy.
+        units (list[str]): Units of the level.
+        results (np.ndarray): Results of the units, from `engine.compute_level`.
+
+    Returns:
+        bytes: JSON document.
+    """
+    body = ",".join(district_objects([json.dumps(u) for u in units], results))
+    return f'{{"level":{json.dumps(level)},"units":[{body}]}}'.encode()
+
+
+def encode_scenarios(engine: CCIEngine, results: np.ndarray) -> bytes:
+    """
+    Encodes the results of several scenarios as the JSON body of a
+    ScenarioDistricts object.
+
+    Parameters:
+        engine (CCIEngine): Engine that produced the results.
+        results (np.ndarray): Output of `engine.compute_scenarios`.
+
+    Returns:
+        bytes: JSON document.
+    """
+    rows = (",".join(f'"{HUNDREDTHS[v]}"' for v in row) for row in results.tolist())
+    body = ",".join(
+        f'{{"id":{id_json},"cci":[{row}]}}'
+        for id_json, row in zip(engine.ids_json, rows)
+    )
+    return f'{{"scenarios":{results.shape[1]},"districts":[{body}]}}'.encode()
+
+
+# We take the stamp before reading, so a change while reading is not missed
+_stamp = dataset_stamp(settings.KPI_DATA)
+engine = CCIEngine.from_file(settings.KPI_DATA)
+engine.stamp = _stamp
+if settings.HIERARCHY:
+    engine.set_hierarchy(Hierarchy.from_file(settings.HIERARCHY))
@@ -0,0 +1,142 @@
+"""Spatial hierarchy of the districts, for aggregated indicators at coarser levels."""
+
+import csv
+from pathlib import Path
+
+import numpy as np
+
+# Columns of a hierarchy file that are not levels
+ID_COLUMN = "id"
+WEIGHT_COLUMN = "weight"
+
+
+class Hierarchy:
+    """
+    Parents of every district at coarser levels (e.g. district -> borough -> city)
+    and the weight of every district (e.g. its population or area).
+
+    Aggregated values are weighted means of the districts of each unit. As the area
+    KPIs and the cci are linear in the KPIs, the hierarchy keeps the weighted sum of
+    the KPIs of every unit, and the indicators of the units for any weights are then
+    computed from them without going through the districts.
+
+    The sums are computed with segment reductions over the districts sorted by unit,
+    once per dataset (`align`), and patched when single districts change (`update`).
+
+    Parameters:
+        ids (list[str]): Identifiers of the districts.
+        parents (dict[str, list[str]]): Unit of every district, by level, from the finest to the coarsest. Empty strings are districts outside every unit of the level.
+        weights (np.ndarray|None, optional): Default value is None. Weight of every district. If None, every district weighs the same.
+    """
+
+    def __init__(
+        self,
+        ids: list[str],
+        parents: dict[str, list[str]],
+        weights: np.ndarray | None = None,
+    ):
+        self.ids = list(ids)
+        self.parents = parents
+        self.weights = np.ones(len(ids)) if weights is None else np.asarray(weights)
+        if len(set(self.ids)) != len(self.ids):
+            raise ValueError("District IDs of the hierarchy are not different.")
+        if (self.weights < 0).any() or not np.isfinite(self.weights).all():
+            raise ValueError("Weights of the hierarchy must be non-negative numbers.")
+        self._levels = {}
+
+    @property
+    def levels(self) -> list[str]:
+        return list(self.parents)
+
+    @classmethod
+    def from_file(cls, path: str | Path) -> "Hierarchy":
+        """
+        Reads a hierarchy from a CSV file with an `id` column, one column per level
+        from the finest to the coarsest and an optional `weight` column.
+
+        Parameters:
+            path (str|Path): Path to the file.
+
+        Returns:
+            Hierarchy: Hierarchy of the file.
+        """
+        with open(path, newline="", encoding="utf-8-sig") as file:
+            reader = csv.DictReader(file)
+            rows = list(reader)
+            header = [name.strip() for name in reader.fieldnames or []]
+        if ID_COLUMN not in header:
+            raise ValueError(f"The hierarchy file needs an {ID_COLUMN} column.")
+
+        levels = [name for name in header if name not in (ID_COLUMN, WEIGHT_COLUMN)]
+        weights = None
+        if WEIGHT_COLUMN in header:
+            weights = np.array([float(row[WEIGHT_COLUMN]) for row in rows])
+        return cls(
+            [row[ID_COLUMN] for row in rows],
+            {level: [row[level] or "" for row in rows] for level in levels},
+            weights,
+        )
+
+    def align(self, ids: list[str], kpis: np.ndarray):
+        """
+        Maps the hierarchy onto the districts of a dataset and computes the weighted
+        KPI sums of every unit. Districts missing from the hierarchy are left out.
+
+        Parameters:
+            ids (list[str]): Identifiers of the districts of the dataset.
+            kpis (np.ndarray): KPI matrix of the dataset.
+        """
+        position = {district_id: i for i, district_id in enumerate(self.ids)}
+        found = np.array([position.get(i, -1) for i in ids], dtype=np.int64)
+        weights = np.where(found >= 0, self.weights[found], 0.0)
+
+        self._levels = {}
+        for level, parents in self.parents.items():
+            names = np.array(parents + [""], dtype=str)[found]  # -1 is the ""
+            units, codes = np.unique(names, return_inverse=True)
+            if len(units) and units[0] == "":
+                units, codes = units[1:], codes - 1  # Districts without a unit are -1
+
+            # We sort the districts by unit, so that every unit is a segment
+            order = np.argsort(codes, kind="stable")
+            order = order[codes[order] >= 0]
+            starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+
+            sums = np.zeros((len(units), kpis.shape[1]))
+            totals = np.zeros(len(units))
+            if len(order):
+                sums = np.add.reduceat(kpis[order] * weights[order, None], starts)
+                totals = np.add.reduceat(weights[order], starts)
+            self._levels[level] = (units.tolist(), codes, sums, totals)
+        self._weights = weights
+
+    def update(self, rows: np.ndarray, old: np.ndarray, new: np.ndarray):
+        """
+        Patches the sums of the units of some districts whose KPIs changed.
+
+        Parameters:
+            rows (np.ndarray): Rows of the changed districts, without repetitions.
+            old (np.ndarray): Previous KPIs of the rows.
+            new (np.ndarray): New KPIs of the rows.
+        """
+        delta = (new - old) * self._weights[rows, None]
+        for _, codes, sums, _ in self._levels.values():
+            inside = codes[rows] >= 0
+            np.add.at(sums, codes[rows][inside], delta[inside])
+
+    def kpis(self, level: str) -> tuple[list[str], np.ndarray]:
+        """
+        Returns the weighted mean KPIs of the units of a level.
+
+        Parameters:
+            level (str): Level of the hierarchy.
+
+        Returns:
+            tuple[list[str], np.ndarray]: Units and their KPI matrix.
+        """
+        if level not in self._levels:
+            raise ValueError(f"Unknown level {level}, expected one of {self.levels}.")
+        units, _, sums, totals = self._levels[level]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(totals[:, None] > 0, sums / totals[:, None], 0.0)
+        return units, means
@@ -0,0 +1,254 @@
+"""Append-only history of the district KPIs, for indicators over time."""
+
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+
+import numpy as np
+
+from api_sk.core.config import settings
+from api_sk.model.cache import ResultCache
+from api_sk.model.circular import SCALE, CCIWeights
+from api_sk.model.engine import HUNDREDTHS, KPIS, RESULT_COLUMNS, weight_matrix
+
+# Files of a history directory: the district IDs (.npy array), the KPIs of every
+# period one after the other, as (district, KPI) blocks of uint8 hundredths, and
+# the labels of the periods, one per line. A period exists once its label is
+# written, so a block being appended is not seen by readers.
+IDS_FILE = "ids.npy"
+KPIS_FILE = "kpis.u8"
+PERIODS_FILE = "periods.txt"
+# Hundredths stored for a district without KPIs in a period
+MISSING = 255
+
+# JSON value of every rounded indicator in hundredths, and null for the gaps
+_VALUES = [f'"{text}"' for text in HUNDREDTHS] + ["null"]
+# Same for the differences, indexed by hundredths plus SCALE
+_DELTAS = [f'"-{text}"' for text in reversed(HUNDREDTHS[1:])] + _VALUES
+
+
+class History:
+    """
+    KPIs of the districts over time, as a tensor of shape (periods, districts,
+    KPIS) mapped read-only from a history directory.
+
+    KPIs have two decimals, so they are stored as one byte each. A new period is
+    appended at the end of the files, without rewriting the previous ones, and
+    is picked up by the other processes on their next `refresh`. The districts are
+    those of the first period: later periods may lack some of them, which are gaps
+    in their indicators, but not add new ones.
+
+    Parameters:
+        path (str|Path): History directory, created on the first append.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.ids = []
+        self.periods = []
+        self.kpis = np.empty((0, 0, len(KPIS)), dtype=np.uint8)
+        self._size = None  # Size of the periods file when last read
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def version(self) -> str:
+        """
+        Version of the history, which only changes when periods are appended.
+        """
+        return f"{len(self.periods)}:{self.periods[-1] if self.periods else ''}"
+
+    def refresh(self):
+        """
+        Maps the periods appended since the last call, by this or other processes.
+        """
+        try:
+            size = (self.path / PERIODS_FILE).stat().st_size
+        except FileNotFoundError:
+            size = 0
+        if size == self._size:
+            return
+
+        periods = []
+        if size:
+            text = (self.path / PERIODS_FILE).read_text()
+            periods = text.split("\n")[:-1]  # We skip a label being written
+        if periods:
+            ids = np.load(self.path / IDS_FILE).tolist()
+            shape = (len(periods), len(ids), len(KPIS))
+            kpis = np.memmap(self.path / KPIS_FILE, np.uint8, "r", shape=shape)
+        else:
+            ids, kpis = [], np.empty((0, 0, len(KPIS)), dtype=np.uint8)
+        self.ids, self.periods, self.kpis = ids, periods, kpis
+        self._size = size
+
+    def append(self, period: str, ids: list[str], kpis: np.ndarray) -> int:
+        """
+        Appends the KPIs of a new period, e.g. from `api_sk.model.ingest.ingest`.
+
+        Parameters:
+            period (str): Label of the period, after every previous one in sort order, e.g. `2025-01`.
+            ids (list[str]): Identifiers of the districts, already validated.
+            kpis (np.ndarray): KPI matrix in hundredths, already validated.
+
+        Returns:
+            int: Districts of the history missing from the period.
+        """
+        with self._lock:
+            self.refresh()
+            if not period or period != period.strip() or "\n" in period:
+                raise ValueError("Period labels must be non-empty and without spaces.")
+            if self.periods and period <= self.periods[-1]:
+                raise ValueError(
+                    f"Period {period} is not after the last one, {self.periods[-1]}."
+                )
+
+            self.path.mkdir(parents=True, exist_ok=True)
+            if not self.periods:
+                staging = self.path / f".{IDS_FILE}"
+                with open(staging, "wb") as file:
+                    np.save(file, np.array(ids, dtype=str))
+                os.replace(staging, self.path / IDS_FILE)
+                self.ids = list(ids)
+
+            position = {district_id: i for i, district_id in enumerate(self.ids)}
+            rows = np.array([position.get(i, -1) for i in ids], dtype=np.int64)
+            if (rows < 0).any():
+                unknown = ids[int(np.flatnonzero(rows < 0)[0])]
+                raise ValueError(
+                    f"{int((rows < 0).sum())} districts are not in the history, "
+                    f"e.g. {unknown}."
+                )
+
+            block = np.full((len(self.ids), len(KPIS)), MISSING, dtype=np.uint8)
+            block[rows] = kpis
+
+            # We drop what is left of an append that did not finish
+            with open(self.path / KPIS_FILE, "ab") as file:
+                file.truncate(len(self.periods) * block.nbytes)
+                file.write(block.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            with open(self.path / PERIODS_FILE, "a") as file:
+                file.write(period + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+
+            self.refresh()
+            return len(self.ids) - len(ids)
+
+    def compute(self, cci_weights: CCIWeights, indicator: str) -> np.ndarray:
+        """
+        Computes an indicator of every district in every period, in millionths.
+
+        The whole history is contracted with the weights of the indicator in a
+        single pass over the tensor, reading the stored bytes without converting
+        them first. KPIs in hundredths times weights in ten-thousandths are exact
+        integers, so rounding them does not depend on the order of the sums.
+
+        Parameters:
+            cci_weights (CCIWeights): Weights for areas and KPIs.
+            indicator (str): One of RESULT_COLUMNS.
+
+        Returns:
+            np.ndarray: Matrix of shape (len(self.periods), len(self.ids)), NaN where a district is missing.
+        """
+        weights = weight_matrix(cci_weights)[:, RESULT_COLUMNS.index(indicator)]
+        values = np.einsum("pdk,k->pd", self.kpis, weights).astype(np.float64)
+        # Missing districts have every KPI missing
+        values[self.kpis[:, :, 0] == MISSING] = np.nan
+        return values
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Computes the mean of every window of periods, from cumulative sums over the
+    periods of every district at once. Sums of integers are exact.
+
+    Parameters:
+        values (np.ndarray): Matrix of shape (periods, districts), NaN for gaps.
+        window (int): Periods per window, ending at each period.
+
+    Returns:
+        np.ndarray: Means, NaN for the first `window - 1` periods and for windows with gaps.
+    """
+    present = ~np.isnan(values)
+    sums = np.zeros((len(values) + 1, values.shape[1]))
+    counts = np.zeros((len(values) + 1, values.shape[1]), dtype=np.int64)
+    np.cumsum(np.where(present, values, 0.0), axis=0, out=sums[1:])
+    np.cumsum(present, axis=0, out=counts[1:])
+
+    means = np.full(values.shape, np.nan)
+    full = counts[window:] - counts[:-window] == window
+    means[window - 1 :] = np.where(
+        full, (sums[window:] - sums[:-window]) / window, np.nan
+    )
+    return means
+
+
+def encode_trajectories(
+    history: History,
+    values: np.ndarray,
+    indicator: str,
+    window: int,
+    start: str | None = None,
+    end: str | None = None,
+) -> bytes:
+    """
+    Encodes an indicator over time as the JSON body of a Trajectories object, with
+    the differences from the previous period and the rolling means.
+
+    Values are rounded to hundredths, halves up. Differences are taken between the
+    rounded values, so they match the values returned. Rolling means of the first
+    periods returned use earlier periods of the history too.
+
+    Parameters:
+        history (History): History that produced the values.
+        values (np.ndarray): Output of `history.compute`, in millionths.
+        indicator (str): Indicator of the values.
+        window (int): Periods of the rolling means.
+        start (str|None, optional): Default value is None. First period returned. If None, the first one of the history.
+        end (str|None, optional): Default value is None. Last period returned. If None, the last one of the history.
+
+    Returns:
+        bytes: JSON document.
+    """
+    periods = history.periods
+    first = bisect_left(periods, start) if start is not None else 0
+    stop = bisect_right(periods, end) if end is not None else len(periods)
+
+    # Halves of a hundredth are exact in floating point, so they round the same
+    # way every time
+    hundredths = np.floor(values / SCALE**2 + 0.5)
+    deltas = np.full(values.shape, np.nan)
+    deltas[1:] = hundredths[1:] - hundredths[:-1]
+    rolling = np.floor(rolling_mean(values, window) / SCALE**2 + 0.5)
+
+    # We index the JSON tables, with the gaps at their last entry, one district
+    # per row
+    series = []
+    for table, offset, matrix in (
+        (_VALUES, 0, hundredths),
+        (_DELTAS, SCALE, deltas),
+        (_VALUES, 0, rolling),
+    ):
+        matrix = matrix[first:stop].T + offset
+        np.nan_to_num(matrix, copy=False, nan=len(table) - 1)
+        rows = matrix.astype(np.int64).tolist()
+        series.append([",".join([table[v] for v in row]) for row in rows])
+
+    body = ",".join(
+        f'{{"id":{json.dumps(i)},"values":[{v}],"deltas":[{d}],"rolling":[{r}]}}'
+        for i, v, d, r in zip(history.ids, *series)
+    )
+    return (
+        f'{{"indicator":"{indicator}","window":{window},'
+        f'"periods":{json.dumps(periods[first:stop])},"districts":[{body}]}}'
+    ).encode()
+
+
+history = History(settings.HISTORY) if settings.HISTORY else None
+# Encoded trajectories, keyed on the version of the history
+history_cache = ResultCache(settings.CACHE_MAX_BYTES, settings.CACHE_TTL)
@@ -0,0 +1,263 @@
+"""Bulk ingestion of district KPIs from CSV or Parquet files."""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+from collections.abc import Iterator
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+
+from api_sk.core.config import settings
+from api_sk.model.dataset import is_dataset, is_empty_dataset, publish_dataset
+from api_sk.model.engine import KPIS, check_values, to_hundredths
+
+# Name of the column holding the district IDs
+ID_COLUMN = "id"
+FORMATS = ("csv", "parquet")
+
+
+class IngestError(ValueError):
+    """
+    Raised when a file cannot be ingested at all (e.g. missing columns), as opposed
+    to bad rows, which are reported.
+    """
+
+
+def _parse_column(column: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converts a column of strings to floats. Values that are not numbers are
+    returned as NaN and flagged.
+    """
+    try:
+        values = np.fromiter(map(float, column), np.float64, len(column))
+        return values, np.zeros(len(column), dtype=bool)
+    except ValueError:
+        pass
+
+    # Only chunks with some malformed value are converted one by one
+    values = np.empty(len(column))
+    malformed = np.zeros(len(column), dtype=bool)
+    for i, item in enumerate(column):
+        try:
+            values[i] = float(item)
+        except ValueError:
+            values[i] = np.nan
+            malformed[i] = True
+    return values, malformed
+
+
+def read_csv(file: BinaryIO, chunk_rows: int) -> Iterator[tuple[list[str], dict]]:
+    """
+    Reads a CSV file with a header row in chunks of rows.
+
+    Parameters:
+        file (BinaryIO): File opened in binary mode, encoded in UTF-8.
+        chunk_rows (int): Rows per chunk.
+
+    Returns:
+        Iterator[tuple[list[str], dict]]: Column names, and then chunks mapping each column position to its list of strings (and None to the rows with a wrong number of fields).
+    """
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        raise IngestError("The file is empty.")
+    header = [name.strip() for name in header]
+
+    while rows := list(itertools.islice(reader, chunk_rows)):
+        yield header, _split_rows(rows, len(header))
+    text.detach()  # The caller keeps the file open
+
+
+def _split_rows(rows: list[list[str]], width: int) -> dict:
+    """
+    Transposes rows of fields into columns. Rows with a wrong number of fields are
+    blanked and listed under the None key.
+    """
+    wrong = [i for i, row in enumerate(rows) if len(row) != width]
+    for i in wrong:
+        rows[i] = [""] * width
+    return {None: wrong, **dict(enumerate(map(list, zip(*rows))))}
+
+
+def read_parquet(file: BinaryIO, chunk_rows: int) -> Iterator[tuple[list[str], dict]]:
+    """
+    Reads a Parquet file in batches of rows. Requires `pyarrow`.
+
+    Parameters:
+        file (BinaryIO): Seekable file opened in binary mode.
+        chunk_rows (int): Rows per chunk.
+
+    Returns:
+        Iterator[tuple[list[str], dict]]: Column names, and then chunks mapping each column position to its values (a list of strings for the IDs, a float array otherwise).
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise IngestError("Reading Parquet files requires the pyarrow package.")
+
+    parquet = pq.ParquetFile(file)
+    header = parquet.schema_arrow.names
+    for batch in parquet.iter_batches(batch_size=chunk_rows):
+        chunk = {None: []}
+        for j, column in enumerate(batch.columns):
+            if header[j] == ID_COLUMN:
+                chunk[j] = column.cast("string").to_pylist()
+            else:
+                chunk[j] = column.cast("double").to_numpy(zero_copy_only=False)
+        yield header, chunk
+
+
+def ingest(
+    file: BinaryIO,
+    file_format: str,
+    skip_invalid: bool = False,
+    chunk_rows: int | None = None,
+    max_errors: int | None = None,
+) -> tuple[list[str], np.ndarray | None, dict]:
+    """
+    Reads and validates district KPIs, chunk by chunk.
+
+    The file needs an `id` column and one column per KPI, named as in KPIS, in
+    any order. Every KPI column is validated at once per chunk (see
+    `check_values`). Rows with invalid values, a wrong number of fields or a
+    repeated ID are bad rows.
+
+    Parameters:
+        file (BinaryIO): File opened in binary mode.
+        file_format (str): `csv` or `parquet`.
+        skip_invalid (bool, optional): Default value is False. If True, bad rows are left out. Otherwise, no KPIs are returned when there are bad rows.
+        chunk_rows (int|None, optional): Default value is None. Rows per chunk. If None, `settings.INGEST_CHUNK_ROWS` is used.
+        max_errors (int|None, optional): Default value is None. Bad rows described in the report. If None, `settings.INGEST_MAX_ERRORS` is used.
+
+    Returns:
+        tuple[list[str], np.ndarray|None, dict]: IDs and KPI matrix of the good rows, in integer hundredths (None if rejected, or if there are none), and a report with the row counts and the first errors (rows are numbered from 1, after the header).
+    """
+    chunk_rows = chunk_rows or settings.INGEST_CHUNK_ROWS
+    max_errors = settings.INGEST_MAX_ERRORS if max_errors is None else max_errors
+    if file_format not in FORMATS:
+        raise IngestError(f"Unknown format {file_format}, expected one of {FORMATS}.")
+    chunks = (read_csv if file_format == "csv" else read_parquet)(file, chunk_rows)
+
+    ids, blocks, errors = [], [], []
+    seen = set()
+    rows = bad = 0
+    for header, chunk in chunks:
+        positions = _positions(header)
+        size = len(chunk[positions[ID_COLUMN]])
+
+        invalid = np.zeros(size, dtype=bool)
+        reasons = {}  # row in the chunk -> first error found
+        for i in chunk[None]:
+            invalid[i] = True
+            reasons[i] = f"Expected {len(header)} fields."
+
+        block = np.empty((size, len(KPIS)))
+        for k, kpi in enumerate(KPIS):
+            column = chunk[positions[kpi]]
+            if isinstance(column, list):
+                values, malformed = _parse_column(column)
+            else:
+                values, malformed = column.astype(np.float64), np.zeros(size, bool)
+            block[:, k] = values
+            wrong = check_values(values) & ~invalid
+            for i in np.flatnonzero(wrong)[:max_errors].tolist():
+                reasons[i] = (
+                    f"{kpi} is not a number."
+                    if malformed[i]
+                    else f"{kpi} should be between 0 and 1 with at most 2 decimals."
+                )
+            invalid |= wrong
+
+        chunk_ids = chunk[positions[ID_COLUMN]]
+        for i, district_id in enumerate(chunk_ids):
+            if invalid[i]:
+                continue
+            if not district_id or district_id in seen:
+                invalid[i] = True
+                reasons[i] = "Empty ID." if not district_id else "Repeated ID."
+            else:
+                seen.add(district_id)
+
+        for i in np.flatnonzero(invalid).tolist():
+            if len(errors) >= max_errors:
+                break
+            errors.append(
+                {"row": rows + i + 1, "id": chunk_ids[i], "error": reasons[i]}
+            )
+
+        keep = ~invalid
+        ids.extend(d for d, k in zip(chunk_ids, keep.tolist()) if k)
+        blocks.append(to_hundredths(block[keep]))
+        rows += size
+        bad += int(invalid.sum())
+
+    kpis = (
+        np.concatenate(blocks) if blocks else np.empty((0, len(KPIS)), dtype=np.int64)
+    )
+    report = {"rows": rows, "valid": rows - bad, "invalid": bad, "errors": errors}
+    if (bad and not skip_invalid) or not ids:
+        return ids, None, report
+    return ids, kpis, report
+
+
+def _positions(header: list[str]) -> dict[str, int]:
+    """
+    Finds the position of the ID and KPI columns in a header.
+    """
+    missing = [name for name in (ID_COLUMN, *KPIS) if name not in header]
+    if missing:
+        raise IngestError(f"Missing columns: {', '.join(missing)}.")
+    return {name: header.index(name) for name in (ID_COLUMN, *KPIS)}
+
+
+def file_format_of(filename: str | None) -> str:
+    """
+    Infers the format of a file from its extension, CSV by default.
+    """
+    if filename and Path(filename).suffix.lower() in (".parquet", ".pq"):
+        return "parquet"
+    return "csv"
+
+
+def can_publish(path: str | Path | None) -> bool:
+    """
+    Checks whether ingested KPIs can be published to a path, i.e. whether it is a
+    dataset directory, possibly with nothing published yet.
+    """
+    return path is not None and (is_dataset(path) or is_empty_dataset(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ingest district KPIs from a CSV or Parquet file into a dataset."
+    )
+    parser.add_argument("source", help="CSV or Parquet file.")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=settings.KPI_DATA,
+        help="Dataset directory. Defaults to the KPI_DATA setting.",
+    )
+    parser.add_argument("--format", choices=FORMATS, help="Format of the file.")
+    parser.add_argument(
+        "--skip-invalid", action="store_true", help="Leave bad rows out."
+    )
+    args = parser.parse_args()
+
+    if not can_publish(args.output):
+        parser.error("The output must be a dataset directory (see --output).")
+
+    with open(args.source, "rb") as file:
+        ids, kpis, report = ingest(
+            file, args.format or file_format_of(args.source), args.skip_invalid
+        )
+    if kpis is not None:
+        report["version"] = publish_dataset(args.output, ids, kpis)
+    print(json.dumps(report, indent=2))
+    if kpis is None:
+        raise SystemExit(1)
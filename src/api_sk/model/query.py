@@ -0,0 +1,270 @@
+"""Top-k, range filter and cursor pagination queries over the results of the engine."""
+
+import base64
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+from api_sk.core.config import settings
+from api_sk.model.circular import SCALE, fixed
+from api_sk.model.engine import RESULT_COLUMNS, CCIEngine, district_objects
+
+
+class QueryError(ValueError):
+    """
+    Raised when a query is not valid, e.g. a malformed filter or cursor.
+    """
+
+
+class ResultIndex:
+    """
+    Results of the engine for one set of weights, with sorted indexes built on
+    demand for the queries.
+
+    Rows are ordered by the composite key `value * n + row`, where the value is in
+    integer hundredths (reversed for descending orders). Keys are unique, so ties
+    are broken by the row, and the key of the last row returned is the cursor of
+    the next page.
+
+    Parameters:
+        engine (CCIEngine): Engine that produced the results.
+        results (np.ndarray): Output of `engine.compute`, in hundredths.
+    """
+
+    def __init__(self, engine: CCIEngine, results: np.ndarray):
+        self.ids_json = engine.ids_json
+        self.hundredths = results
+        self._orders = {}  # (column, descending) -> (rows, sorted keys)
+
+    def __len__(self) -> int:
+        return len(self.hundredths)
+
+    def keys(self, column: int, descending: bool) -> np.ndarray:
+        """
+        Computes the composite key of every row for a sort column and order.
+        """
+        return self.keys_of(np.arange(len(self)), column, descending)
+
+    def order(self, column: int, descending: bool) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows sorted by a column and their sorted keys, sorting them the
+        first time.
+        """
+        if (column, descending) not in self._orders:
+            keys = self.keys(column, descending)
+            rows = np.argsort(keys)
+            self._orders[column, descending] = (rows, keys[rows])
+        return self._orders[column, descending]
+
+    def has_order(self, column: int, descending: bool) -> bool:
+        return (column, descending) in self._orders
+
+    def query(
+        self,
+        sort_by: str,
+        descending: bool,
+        limit: int,
+        ranges: dict[str, tuple[int, int]],
+        after: int | None = None,
+    ) -> tuple[np.ndarray, int | None]:
+        """
+        Selects the first rows in an order among the rows within the ranges.
+
+        The first page of a query is selected with a partial sort (O(n)), and the
+        following pages with the sorted index of the sort column, built once. A
+        range on the sort column is then found by binary search, and only the rows
+        within it are scanned for the other ranges.
+
+        Parameters:
+            sort_by (str): Sort column, one of RESULT_COLUMNS.
+            descending (bool): If True, the largest values come first.
+            limit (int): Maximum number of rows returned.
+            ranges (dict[str, tuple[int, int]]): Inclusive ranges of values, in hundredths, by column.
+            after (int|None, optional): Default value is None. Key of the last row of the previous page.
+
+        Returns:
+            tuple[np.ndarray, int|None]: Rows of the page, and the key of its last row if there are more.
+        """
+        column = RESULT_COLUMNS.index(sort_by)
+        n = len(self)
+
+        # We turn a range on the sort column into a range of keys
+        low, high = ranges.get(sort_by, (0, SCALE))
+        if descending:
+            low, high = SCALE - high, SCALE - low
+        first_key, end_key = low * n, (high + 1) * n
+        if after is not None:
+            first_key = max(first_key, after + 1)
+        others = [
+            (RESULT_COLUMNS.index(name), bounds)
+            for name, bounds in ranges.items()
+            if name != sort_by
+        ]
+
+        if after is None and not self.has_order(column, descending):
+            keys = self.keys(column, descending)
+            mask = (keys >= first_key) & (keys < end_key)
+            for j, (low, high) in others:
+                values = self.hundredths[:, j]
+                mask &= (values >= low) & (values <= high)
+            rows = np.flatnonzero(mask)
+            if len(rows) > limit:
+                rows = rows[np.argpartition(keys[rows], limit)[: limit + 1]]
+            rows = rows[np.argsort(keys[rows])]
+        else:
+            sorted_rows, sorted_keys = self.order(column, descending)
+            start = np.searchsorted(sorted_keys, first_key)
+            stop = np.searchsorted(sorted_keys, end_key)
+            rows = self._scan(sorted_rows, start, stop, others, limit + 1)
+
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, int(self.keys_of(rows[-1:], column, descending)[0])
+        return rows, None
+
+    def keys_of(self, rows: np.ndarray, column: int, descending: bool) -> np.ndarray:
+        """
+        Computes the composite key of some rows for a sort column and order.
+        """
+        values = self.hundredths[rows, column]
+        if descending:
+            values = SCALE - values
+        return values * len(self) + rows
+
+    def _scan(
+        self,
+        sorted_rows: np.ndarray,
+        start: int,
+        stop: int,
+        others: list[tuple[int, tuple[int, int]]],
+        count: int,
+    ) -> np.ndarray:
+        """
+        Takes the first `count` rows of a slice of a sorted index within the other
+        ranges, checking them in growing chunks.
+        """
+        if not others:
+            return sorted_rows[start : min(stop, start + count)]
+
+        found, size = [], max(count, 1024)
+        while start < stop and sum(map(len, found)) < count:
+            rows = sorted_rows[start : min(stop, start + size)]
+            mask = np.ones(len(rows), dtype=bool)
+            for j, (low, high) in others:
+                values = self.hundredths[rows, j]
+                mask &= (values >= low) & (values <= high)
+            found.append(rows[mask])
+            start += size
+            size *= 2
+        rows = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+        return rows[:count]
+
+
+class IndexCache:
+    """
+    LRU cache of result indexes, keyed on the weights. Like the result cache, it is
+    dropped when the dataset version changes.
+
+    Parameters:
+        max_entries (int): Maximum number of indexes kept.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.version = None
+        self._entries = OrderedDict()
+
+    def get(self, key: str, version: str) -> ResultIndex | None:
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+        index = self._entries.get(key)
+        if index is not None:
+            self._entries.move_to_end(key)
+        return index
+
+    def put(self, key: str, version: str, index: ResultIndex):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+        self._entries[key] = index
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def encode_page(index: ResultIndex, rows: np.ndarray, cursor: str | None) -> bytes:
+    """
+    Encodes rows of a result index as the JSON body of a DistrictPage object.
+
+    Parameters:
+        index (ResultIndex): Index holding the results.
+        rows (np.ndarray): Rows of the page, in order.
+        cursor (str|None): Cursor of the next page.
+
+    Returns:
+        bytes: JSON document.
+    """
+    ids_json = [index.ids_json[i] for i in rows.tolist()]
+    body = ",".join(district_objects(ids_json, index.hundredths[rows]))
+    return f'{{"districts":[{body}],"next_cursor":{json.dumps(cursor)}}}'.encode()
+
+
+def parse_ranges(filters: list[str]) -> dict[str, tuple[int, int]]:
+    """
+    Parses range filters written as `column:min:max`, e.g. `cci:0.4:0.6` or
+    `W::0.3`. A missing bound is open. Several filters on a column are intersected.
+
+    Parameters:
+        filters (list[str]): Filters.
+
+    Returns:
+        dict[str, tuple[int, int]]: Inclusive ranges in hundredths, by column.
+    """
+    ranges = {}
+    for item in filters:
+        name, *bounds = item.split(":")
+        if name not in RESULT_COLUMNS or len(bounds) != 2:
+            raise QueryError(
+                f"Filters are column:min:max, with a column in {RESULT_COLUMNS}."
+            )
+        try:
+            low = fixed(bounds[0]) if bounds[0] else 0
+            high = fixed(bounds[1]) if bounds[1] else SCALE
+        except ValueError as e:
+            raise QueryError(f"Filter {item}: {e}.")
+        previous = ranges.get(name, (0, SCALE))
+        ranges[name] = (max(low, previous[0]), min(high, previous[1]))
+    return ranges
+
+
+def encode_cursor(query: str, key: int) -> str:
+    """
+    Encodes the cursor of the next page of a query.
+    """
+    text = json.dumps({"q": query, "k": key})
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def decode_cursor(cursor: str, query: str) -> int:
+    """
+    Decodes a cursor, checking it belongs to the same query and dataset version.
+
+    Parameters:
+        cursor (str): Cursor from a previous page.
+        query (str): Identifier of the query (weights, order and dataset version).
+
+    Returns:
+        int: Key of the last row of the previous page.
+    """
+    try:
+        content = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        key = int(content["k"])
+    except (ValueError, KeyError, TypeError):
+        raise QueryError("Malformed cursor.")
+    if content.get("q") != query:
+        raise QueryError("The cursor belongs to another query or dataset version.")
+    return key
+
+
+index_cache = IndexCache(settings.QUERY_INDEX_ENTRIES)
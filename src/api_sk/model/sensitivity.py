@@ -0,0 +1,183 @@
+"""Monte Carlo analysis of the sensitivity of the cci rankings to the weights."""
+
+import threading
+from collections.abc import Callable
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from api_sk.core.config import settings
+from api_sk.model.circular import SCALE, CCIWeights
+from api_sk.model.engine import (
+    AREA_SLICES,
+    AREAS,
+    KPI_AREA,
+    CCIEngine,
+    round_hundredths,
+    weight_matrix,
+)
+
+# Resolution of the cci histograms used for ranks
+BINS = 1000
+# Samples per chunk are capped, which bounds the histograms of a chunk
+MAX_CHUNK = 4096
+PERCENTILES = (5, 50, 95)
+
+
+class SensitivityRequest(BaseModel):
+    weights: CCIWeights = CCIWeights()
+    samples: int = Field(default=10000, ge=1, le=settings.MAX_SENSITIVITY_SAMPLES)
+    concentration: float = Field(default=100.0, ge=1, allow_inf_nan=False)
+    seed: int | None = None
+
+
+def sample_weights(
+    rng: np.random.Generator, cci_weights: CCIWeights, concentration: float, size: int
+) -> np.ndarray:
+    """
+    Samples cci weight vectors around the given weights.
+
+    Area weights and the KPI weights of each area are drawn from Dirichlet
+    distributions centred on the given values, so every sample satisfies the same
+    sum-to-1 constraints as CCIWeights. Weights that are zero stay zero.
+
+    Parameters:
+        rng (np.random.Generator): Random generator.
+        cci_weights (CCIWeights): Weights the samples are centred on.
+        concentration (float): Dirichlet concentration. Larger values give samples closer to the given weights.
+        size (int): Number of samples.
+
+    Returns:
+        np.ndarray: Matrix of shape (size, len(KPIS)) with the cci weight of each KPI.
+    """
+    base = weight_matrix(cci_weights) / SCALE**2
+    kpi_weights = base[:, : len(AREAS)].sum(axis=1)
+    area_weights = (
+        np.array([getattr(cci_weights, a).area_weight for a in AREAS]) / SCALE
+    )
+
+    # Dirichlet samples as normalized gamma samples, which allows for zero weights
+    area = rng.standard_gamma(concentration * area_weights, size=(size, len(AREAS)))
+    area /= area.sum(axis=1, keepdims=True)
+
+    kpi = rng.standard_gamma(concentration * kpi_weights, size=(size, len(KPI_AREA)))
+    starts = [AREA_SLICES[a].start for a in AREAS]
+    sums = np.add.reduceat(kpi, starts, axis=1)
+    kpi /= np.where(sums > 0, sums, 1)[:, KPI_AREA]
+
+    return kpi * area[:, KPI_AREA]
+
+
+def run_sensitivity(
+    engine: CCIEngine,
+    request: SensitivityRequest,
+    cancel: threading.Event | None = None,
+    progress: Callable[[float], None] | None = None,
+) -> dict | None:
+    """
+    Runs the sensitivity analysis, processing the samples in chunks.
+
+    For every district it reports its cci and rank under the given weights, the
+    mean and standard deviation of its rank over the samples, the fraction of
+    samples in which it stays in the same rank decile (rank stability) and
+    percentiles of its cci.
+
+    Ranks are computed from a histogram of the cci of each sample, with a
+    resolution of 1/BINS, so districts closer than that share their rank.
+    Percentiles are estimated from the first samples, up to
+    `settings.SENSITIVITY_PERCENTILE_SAMPLES` of them (the samples are independent,
+    so these are a random subset).
+
+    Parameters:
+        engine (CCIEngine): Engine holding the districts.
+        request (SensitivityRequest): Weights and sampling parameters.
+        cancel (threading.Event|None, optional): When set, the run stops after the current chunk. Any object with an `is_set` method can be used.
+        progress (Callable|None, optional): Called with the fraction of samples done after every chunk.
+
+    Returns:
+        dict|None: Results of the analysis, or None if it was cancelled.
+    """
+    n = len(engine)
+    if not n:
+        raise ValueError("No districts are loaded.")
+
+    rng = np.random.default_rng(request.seed)
+    kpis_t = np.ascontiguousarray(engine.kpis.T, dtype=np.float32)
+    kpis_t /= SCALE
+    chunk = min(MAX_CHUNK, max(1, settings.SENSITIVITY_CHUNK_SIZE // n))
+    slots = BINS + 1  # a cci of exactly 1 gets its own bin
+    offsets = (np.arange(chunk, dtype=np.int32) * slots)[:, None]
+
+    # The cci under the given weights is exact, in millionths
+    base_cci = engine.kpis @ weight_matrix(request.weights)[:, -1]
+    base_bins = base_cci * BINS // SCALE**3
+    base_counts = np.bincount(base_bins, minlength=slots)
+    base_rank = 1 + (np.cumsum(base_counts[::-1])[::-1] - base_counts)[base_bins]
+    # Ranks within the same decile as the base rank, as [low, high) bounds
+    base_decile = (base_rank - 1) * 10 // n
+    decile_low = (1 + np.ceil(base_decile * n / 10)).astype(np.float32)
+    decile_high = (1 + np.ceil((base_decile + 1) * n / 10)).astype(np.float32)
+
+    rank_sum = np.zeros(n)
+    rank_sq_sum = np.zeros(n)
+    stable = np.zeros(n, dtype=np.int64)
+    kept = np.empty(
+        (min(request.samples, settings.SENSITIVITY_PERCENTILE_SAMPLES), n),
+        dtype=np.float32,
+    )
+
+    done = 0
+    while done < request.samples:
+        if cancel is not None and cancel.is_set():
+            return None
+
+        size = min(chunk, request.samples - done)
+        weights = sample_weights(rng, request.weights, request.concentration, size)
+        cci = weights.astype(np.float32) @ kpis_t  # (size, n)
+        if done < len(kept):
+            keep = min(size, len(kept) - done)
+            kept[done : done + keep] = cci[:keep]
+
+        # Each sample gets its own range of bins, so that a single bincount gives
+        # the histogram of every sample. We add the offsets to the integer bins, as
+        # float32 cannot hold the fraction of bins millions apart.
+        cci *= BINS
+        flat = cci.astype(np.int32)
+        flat += offsets[:size]
+        counts = np.bincount(flat.ravel(), minlength=size * slots).reshape(size, slots)
+        above = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1] - counts
+
+        ranks = (1 + above).astype(np.float32).ravel()[flat]
+        rank_sum += ranks.sum(axis=0)
+        rank_sq_sum += np.einsum("ij,ij->j", ranks, ranks)
+        stable += np.count_nonzero(
+            (ranks >= decile_low) & (ranks < decile_high), axis=0
+        )
+
+        done += size
+        if progress is not None:
+            progress(done / request.samples)
+
+    base_hundredths = round_hundredths(base_cci).tolist()
+    rank_mean = rank_sum / done
+    rank_std = np.sqrt(np.maximum(rank_sq_sum / done - rank_mean**2, 0))
+    percentiles = np.percentile(kept, PERCENTILES, axis=0)
+
+    return {
+        "samples": done,
+        "districts": [
+            {
+                "id": district_id,
+                "cci": base_hundredths[i] / SCALE,
+                "rank": int(base_rank[i]),
+                "rank_mean": round(float(rank_mean[i]), 2),
+                "rank_std": round(float(rank_std[i]), 2),
+                "rank_stability": round(float(stable[i] / done), 4),
+                **{
+                    f"cci_p{p}": round(float(percentiles[j, i]), 2)
+                    for j, p in enumerate(PERCENTILES)
+                },
+            }
+            for i, district_id in enumerate(engine.ids)
+        ],
+    }
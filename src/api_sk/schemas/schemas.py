@@ -1,12 +1,19 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
+from typing import Any, Optional
 import asyncio
+from concurrent.futures import Future
 
 
 class ModelTask(BaseModel):
     task: Optional[asyncio.Task] = Field(default=None, exclude=True)
+    future: Optional[Future] = Field(default=None, exclude=True)
     start_time: str
     type: str
     status: str = "Running"
+    priority: int = 0
+    end_time: Optional[str] = None
+    # Fraction of the computation done, only sent through the event stream
+    progress: Optional[float] = Field(default=None, exclude=True)
+    result: Optional[Any] = Field(default=None, exclude=True)
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
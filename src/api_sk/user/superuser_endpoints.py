@@ -1,10 +1,32 @@
 # user_endpoints.py
 
-from fastapi import APIRouter, HTTPException, status
+import asyncio
+import logging
+from pathlib import Path
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from api_sk.auth.token_cache import token_cache
 from api_sk.core.config import settings
-from fastapi.responses import JSONResponse
+from api_sk.core.executor import model_executor
+from api_sk.core.profiling import request_profiler
+from api_sk.data.user_store import user_store
+from api_sk.model.cache import result_cache
+from api_sk.model.dataset import dataset_stamp, publish_dataset
+from api_sk.model.engine import engine
+from api_sk.model.history import history
+from api_sk.model.ingest import IngestError, can_publish, file_format_of, ingest
 
 router = APIRouter()
+logger = logging.getLogger("uvicorn.error")  # Logger for logging info
+
+# KPI updates are applied and published one at a time, as they change the matrix
+# in place
+_update_lock = asyncio.Lock()
+# Publication of the updated KPIs to the dataset directory, once scheduled
+_publisher: asyncio.Task | None = None
 
 # Endpoints for user management
 
@@ -22,16 +44,387 @@ async def delete_user(user: str, token: str):
 
     """
 
-    user_exist = settings.USERS_DB.get(user)
+    user_exist = await user_store.delete_user_async(user)
 
     if not user_exist:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Username not in database."
         )
 
-    del settings.USERS_DB[user]
+    token_cache.drop_user(user)  # Its tokens have to be verified again
 
     return JSONResponse(
         content={"message": "User deleted from database.", "status": "ok"},
         status_code=200,
     )
+
+
+@router.get("/token_cache", tags=["User management"])
+async def token_cache_stats():
+    """
+    Returns the usage counters of the verified-token cache.
+
+    Returns:
+        dict: Number of entries, hits, misses and hit rate.
+    """
+    return token_cache.stats()
+
+
+# Endpoints for model data management
+
+
+@router.get("/cache", tags=["Model management"])
+async def cache_stats():
+    """
+    Returns the usage counters of the result cache.
+
+    Returns:
+        dict: Number of entries, size in bytes, hits, misses and hit rate.
+    """
+    return result_cache.stats()
+
+
+@router.post("/reload_kpis", tags=["Model management"])
+async def reload_kpis():
+    """
+    Reloads the district KPIs from the file in the settings. Cached results of
+    the previous dataset are dropped.
+
+    Returns:
+        JSONResponse: Returns the new number of districts and dataset version.
+
+    """
+    try:
+        engine.stamp = dataset_stamp(settings.KPI_DATA)
+        dataset = await asyncio.to_thread(engine.read_file, settings.KPI_DATA)
+        engine.load(*dataset)
+    except (OSError, KeyError, ValueError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
+    await _use_new_kpis()
+
+    return JSONResponse(
+        content={"districts": len(engine), "version": engine.version, "status": "ok"},
+        status_code=200,
+    )
+
+
+@router.post("/ingest_kpis", tags=["Model management"])
+async def ingest_kpis(
+    file: UploadFile,
+    file_format: Literal["csv", "parquet"] | None = None,
+    skip_invalid: bool = False,
+):
+    """
+    Ingests the KPIs of every district from a CSV or Parquet file, publishes them as
+    a new version of the dataset in the settings and loads it.
+
+    The file needs an `id` column and one column per KPI (D1, ECR1-4, M1-5, W1-3).
+    It is validated in chunks, one column at a time, and the bad rows are reported.
+
+    Parameters:
+        file (UploadFile): CSV or Parquet file.
+        file_format (str|None, optional): Default value is None. `csv` or `parquet`. If None, it is inferred from the file name.
+        skip_invalid (bool, optional): Default value is False. If True, bad rows are left out. Otherwise, nothing is loaded when there are bad rows.
+
+    Returns:
+        JSONResponse: Returns the ingestion report, with the new number of districts and dataset version.
+
+    """
+    if not can_publish(settings.KPI_DATA):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="KPI_DATA must be set to a dataset directory.",
+        )
+
+    try:
+        ids, kpis, report = await asyncio.to_thread(
+            ingest,
+            file.file,
+            file_format or file_format_of(file.filename),
+            skip_invalid,
+        )
+    except (IngestError, UnicodeDecodeError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
+    if kpis is None:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=report
+        )
+
+    await asyncio.to_thread(publish_dataset, settings.KPI_DATA, ids, kpis)
+    engine.stamp = dataset_stamp(settings.KPI_DATA)
+    dataset = await asyncio.to_thread(engine.read_file, settings.KPI_DATA)
+    engine.load(*dataset)
+    await _use_new_kpis()
+
+    return JSONResponse(
+        content={
+            **report,
+            "districts": len(engine),
+            "version": engine.version,
+            "status": "ok",
+        },
+        status_code=200,
+    )
+
+
+@router.patch("/kpis", tags=["Model management"])
+async def update_kpis(changes: dict[str, dict[str, float]]):
+    """
+    Changes some KPIs of some districts, e.g. `{"district": {"D1": 0.5}}`.
+
+    Only the area KPIs of the changed districts are recomputed in the cached
+    results of the engine, instead of every district, and the model workers apply
+    the same changes. If the settings point to a dataset directory, the new KPIs
+    are published as a new version of it `KPI_PUBLISH_DELAY` seconds later, so that
+    the updates made meanwhile are published at once.
+
+    Parameters:
+        changes (dict[str, dict[str, float]]): New KPI values by district ID and KPI name.
+
+    Returns:
+        JSONResponse: Returns the number of districts changed and the new dataset version.
+
+    """
+    async with _update_lock:
+        try:
+            rows = await asyncio.to_thread(engine.update, changes)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+            )
+
+        version = engine.version
+        result_cache.clear()
+        await asyncio.to_thread(model_executor.update, changes, version)
+        if can_publish(settings.KPI_DATA):
+            _schedule_publish()
+
+    return JSONResponse(
+        content={"changed": len(rows), "version": version, "status": "ok"},
+        status_code=200,
+    )
+
+
+def _schedule_publish():
+    global _publisher
+    if _publisher is None:
+        _publisher = asyncio.create_task(_publish_kpis())
+
+
+async def _publish_kpis():
+    """
+    Publishes the updated KPIs as a new version of the dataset directory, after
+    waiting for more updates.
+    """
+    global _publisher
+    await asyncio.sleep(settings.KPI_PUBLISH_DELAY)
+    async with _update_lock:
+        _publisher = None  # Updates from now on are published again
+        if engine.path is not None:
+            return  # A dataset version was loaded meanwhile, replacing the updates
+        # The whole matrix is written, as every version directory is mapped on its
+        # own. We keep the updated matrix, and workers map the published copy.
+        try:
+            version = await asyncio.to_thread(
+                publish_dataset,
+                settings.KPI_DATA,
+                engine.ids,
+                engine.kpis,
+                engine.version,
+            )
+        except OSError as e:
+            logger.error(f"Could not publish the updated KPIs: {e!r}")
+            return
+        if engine.version == version:  # Not reloaded meanwhile
+            engine.path = Path(settings.KPI_DATA) / version
+            engine.stamp = dataset_stamp(settings.KPI_DATA)
+            await asyncio.to_thread(model_executor.reload)
+
+
+async def flush_kpis():
+    """
+    Waits until the KPI updates not yet published are, e.g. before the server
+    stops.
+    """
+    if _publisher is not None:
+        await _publisher
+
+
+@router.post("/history", tags=["Model management"])
+async def append_history(
+    period: str,
+    file: UploadFile,
+    file_format: Literal["csv", "parquet"] | None = None,
+    skip_invalid: bool = False,
+):
+    """
+    Appends the KPIs of every district in a new period (e.g. `2025-01`) to the KPI
+    history, from a CSV or Parquet file as in /superuser/ingest_kpis.
+
+    Periods are appended in order, without rewriting the previous ones. The
+    districts of the history are those of its first period: later periods may lack
+    some of them, but not add new ones.
+
+    Parameters:
+        period (str): Label of the period, after the last one in sort order.
+        file (UploadFile): CSV or Parquet file.
+        file_format (str|None, optional): Default value is None. `csv` or `parquet`. If None, it is inferred from the file name.
+        skip_invalid (bool, optional): Default value is False. If True, bad rows are left out. Otherwise, nothing is appended when there are bad rows.
+
+    Returns:
+        JSONResponse: Returns the ingestion report, with the number of periods and the districts missing from the new one.
+
+    """
+    if history is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="HISTORY must be set to a directory.",
+        )
+
+    try:
+        ids, kpis, report = await asyncio.to_thread(
+            ingest,
+            file.file,
+            file_format or file_format_of(file.filename),
+            skip_invalid,
+        )
+    except (IngestError, UnicodeDecodeError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
+    if kpis is None:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=report
+        )
+
+    try:
+        missing = await asyncio.to_thread(history.append, period, ids, kpis)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
+
+    return JSONResponse(
+        content={
+            **report,
+            "periods": len(history.periods),
+            "missing": missing,
+            "status": "ok",
+        },
+        status_code=200,
+    )
+
+
+# Endpoints for profiling
+
+
+@router.post("/profiles", tags=["Profiling"])
+async def start_profile(
+    request: Request,
+    path: str,
+    method: str = "POST",
+    requests: Annotated[int, Query(ge=1, le=1000)] = 1,
+):
+    """
+    Profiles the next requests of a route with a sampling profiler. Other routes,
+    and the route itself once profiled, run without any profiling code.
+
+    Parameters:
+        path (str): Path template of the route, e.g. `/circular` or `/status/{task_id}`.
+        method (str, optional): Default value is POST. HTTP method of the route.
+        requests (int, optional): Default value is 1. Number of requests to profile.
+
+    Returns:
+        JSONResponse: Returns the ID and status of the profile.
+
+    """
+    try:
+        profile = request_profiler.arm(request.app.routes, path, method, requests)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return JSONResponse(content=profile.summary(), status_code=201)
+
+
+@router.get("/profiles", tags=["Profiling"])
+async def list_profiles():
+    """
+    Lists the profiles kept, oldest first.
+
+    Returns:
+        list[dict]: Summary of every profile.
+    """
+    return [profile.summary() for profile in request_profiler.profiles.values()]
+
+
+@router.get("/profiles/{profile_id}", tags=["Profiling"])
+async def get_profile(
+    profile_id: str,
+    output_format: Annotated[
+        Literal["collapsed", "json"], Query(alias="format")
+    ] = "collapsed",
+):
+    """
+    Returns the samples of a profile.
+
+    Parameters:
+        profile_id (str): ID of the profile.
+        format (str, optional): Default value is collapsed. `collapsed` returns the stacks in the collapsed format of flame graph tools (`flamegraph.pl`, speedscope, inferno), `json` returns the summary of the profile with them.
+
+    Returns:
+        PlainTextResponse|dict: Sampled stacks.
+    """
+    profile = request_profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    if output_format == "json":
+        return {**profile.summary(), "stacks": profile.collapsed().splitlines()}
+    return PlainTextResponse(profile.collapsed())
+
+
+@router.delete("/profiles/{profile_id}", tags=["Profiling"])
+async def delete_profile(profile_id: str):
+    """
+    Drops a profile, and stops profiling its route if it was still armed.
+
+    Parameters:
+        profile_id (str): ID of the profile.
+    """
+    if not request_profiler.remove(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return {"status": "Profile deleted", "profile_id": profile_id}
+
+
+async def refresh_kpis():
+    """
+    Loads the KPIs again if they changed since this process read them, e.g. when
+    another server worker published a new dataset version or reloaded the KPI
+    file. Only the stamp of the dataset is checked, with a `stat` or two, so it runs
+    before every request.
+    """
+    stamp = dataset_stamp(settings.KPI_DATA)
+    if stamp == engine.stamp:
+        return
+
+    engine.stamp = stamp
+    try:
+        dataset = await asyncio.to_thread(engine.read_file, settings.KPI_DATA)
+    except (OSError, KeyError, ValueError) as e:
+        logger.error(f"Could not reload the KPIs, keeping the current ones: {e!r}")
+        return
+    # This process may have published the version itself
+    if dataset[3] is None or dataset[3] != engine.path:
+        engine.load(*dataset)
+        await _use_new_kpis()
+        logger.info(f"Reloaded the KPIs, dataset version {engine.version}")
+
+
+async def _use_new_kpis():
+    """
+    Drops the results of the previous dataset and moves the workers to the new one.
+    """
+    result_cache.clear()
+    await asyncio.to_thread(model_executor.reload)
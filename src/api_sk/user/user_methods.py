@@ -1,5 +1,13 @@
 # user_methods.py
 
+import jwt
+from fastapi import HTTPException, status
+
+from api_sk.auth.hashing import Hasher
+from api_sk.core.config import settings
+from api_sk.data.user_store import user_store
+from api_sk.schemas.user_schema import UserInDB, UserRegistration
+
 
 def get_current_user(token: str) -> str:
 
@@ -26,7 +34,7 @@ def create_user(user: UserRegistration):
         JSONResponse: Returns a positive response when the user is created. Raises an exception otherwise.
 
     """
-    user_exist = settings.USERS_DB.get(user.username)
+    user_exist = user_store.get_user(user.username)
 
     if user_exist:
         raise HTTPException(
@@ -41,5 +49,9 @@ def create_user(user: UserRegistration):
         full_name=user.full_name,
         hashed_password=hashed_password,
     )
-    settings.USERS_DB.update({user.username: user_in_db.dict()})
-    save_users_db()
+    # The username may have been registered since it was checked
+    if not user_store.add_user(user_in_db.model_dump()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Username already registered.",
+        )
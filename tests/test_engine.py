@@ -0,0 +1,240 @@
+"""Tests of the computations of the engine."""
+
+import json
+import os
+import tempfile
+import unittest
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+from api_sk.model.circular import AREA_KPIS, SCALE, CCIWeights
+from api_sk.model.engine import (
+    AREA_SLICES,
+    AREAS,
+    KPIS,
+    CCIEngine,
+    area_weights,
+    encode_districts,
+    round_hundredths,
+    stream_districts,
+    weight_matrix,
+)
+from api_sk.model.hierarchy import Hierarchy
+from api_sk.model.history import History
+
+# Weights differing from the defaults in the KPI weights of W only
+OTHER_W = CCIWeights.model_validate(
+    {"W": {"area_weight": 0.3, "kpi_weights": {"W1": 0.2, "W2": 0.2, "W3": 0.6}}}
+)
+
+
+def _dataset(n: int = 50, seed: int = 0) -> tuple[list[str], np.ndarray]:
+    rng = np.random.default_rng(seed)
+    return [f"d{i}" for i in range(n)], rng.integers(0, 101, (n, len(KPIS))) / 100
+
+
+def _random_weights(rng: np.random.Generator) -> CCIWeights:
+    # Hundredths split at random, so that every group adds up to 1 exactly
+    def split(names):
+        parts = rng.multinomial(SCALE, [1 / len(names)] * len(names))
+        return {name: int(part) / SCALE for name, part in zip(names, parts)}
+
+    return CCIWeights.model_validate(
+        {
+            area: {"area_weight": area_weight, "kpi_weights": split(AREA_KPIS[area])}
+            for area, area_weight in split(AREAS).items()
+        }
+    )
+
+
+def _reference(kpis: np.ndarray, cci_weights: CCIWeights) -> list[list[int]]:
+    """
+    Computes the indicators of every district in hundredths with Decimal, halves
+    up, as the public values would be computed by hand.
+    """
+    hundredth = Decimal("0.01")
+    results = []
+    for row in kpis.tolist():
+        values = [Decimal(v) / SCALE for v in row]
+        indicators, cci = [], Decimal(0)
+        for area, area_weight, kpi_weights in area_weights(cci_weights):
+            block = values[AREA_SLICES[area]]
+            value = sum(v * w / SCALE for v, w in zip(block, kpi_weights))
+            indicators.append(value)
+            cci += value * area_weight / SCALE
+        results.append(
+            [
+                int(v.quantize(hundredth, ROUND_HALF_UP) * SCALE)
+                for v in (*indicators, cci)
+            ]
+        )
+    return results
+
+
+class _UpdateOnEnter:
+    """
+    Lock that runs an update of the engine the first time it is entered, as if the
+    update had just got the lock before.
+    """
+
+    def __init__(self, engine: CCIEngine, changes: dict):
+        self.engine = engine
+        self.changes = changes
+        self.lock = engine._update_lock
+
+    def __enter__(self):
+        changes, self.changes = self.changes, None
+        if changes is not None:
+            self.engine.update(changes)
+        self.lock.acquire()
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+class CCIEngineTest(unittest.TestCase):
+    def assert_cold(self, engine: CCIEngine, cci_weights: CCIWeights):
+        # The results of an engine loaded with the same KPIs, without caches
+        cold = CCIEngine(engine.ids, np.array(engine.kpis))
+        np.testing.assert_array_equal(
+            engine.compute(cci_weights), cold.compute(cci_weights)
+        )
+
+    def test_update_patches_cached_columns(self):
+        ids, kpis = _dataset()
+        engine = CCIEngine(ids, kpis)
+        engine.compute(CCIWeights())
+        engine.compute(OTHER_W)
+        version = engine.version
+
+        changed = engine.update({"d3": {"D1": 0.5, "W2": 0.25}, "d7": {"M4": 1.0}})
+        self.assertEqual(changed.tolist(), [3, 7])
+        self.assertNotEqual(engine.version, version)
+        self.assertEqual(engine.kpis[3, KPIS.index("W2")], 25)
+        self.assertEqual(len(engine.area_cache.items("W")), 2)
+        self.assert_cold(engine, CCIWeights())
+        self.assert_cold(engine, OTHER_W)
+
+    def test_update_touches_dirty_rows_and_areas_only(self):
+        ids, kpis = _dataset()
+        engine = CCIEngine(ids, kpis)
+        engine.compute(CCIWeights())
+        before = {area: np.array(engine.area_cache.items(area)[0][1]) for area in AREAS}
+
+        engine.update({"d3": {"ECR1": 1.0, "ECR2": 1.0}, "d8": {"M1": 0.0}})
+        for area in AREAS:
+            column = engine.area_cache.items(area)[0][1]
+            changed = np.flatnonzero(column != before[area]).tolist()
+            self.assertEqual(changed, {"ECR": [3], "M": [8]}.get(area, []), area)
+        self.assert_cold(engine, CCIWeights())
+
+    def test_weight_change_reuses_other_areas(self):
+        ids, kpis = _dataset()
+        engine = CCIEngine(ids, kpis)
+        engine.compute(CCIWeights())
+        columns = {area: engine.area_cache.items(area)[0][1] for area in AREAS}
+
+        engine.compute(OTHER_W)
+        for area in AREAS:
+            cached = engine.area_cache.items(area)
+            self.assertEqual(len(cached), 2 if area == "W" else 1)
+            self.assertIs(cached[0][1], columns[area])
+        self.assert_cold(engine, OTHER_W)
+
+    def test_update_while_computing(self):
+        ids, kpis = _dataset()
+        engine = CCIEngine(ids, kpis)
+        changes = {"d3": dict.fromkeys(KPIS, 0.0)}
+        # The update lands after the columns are computed, before they are cached
+        engine._update_lock = _UpdateOnEnter(engine, changes)
+
+        engine.compute(CCIWeights())
+        self.assertEqual(engine.kpis[3].tolist(), [0] * len(KPIS))
+        self.assertEqual(engine.compute(CCIWeights())[3].tolist(), [0] * 5)
+        self.assert_cold(engine, CCIWeights())
+
+    def test_update_patches_hierarchy(self):
+        ids, kpis = _dataset()
+        parents = {"borough": [f"b{i % 4}" for i in range(len(ids))]}
+        weights = np.arange(1, len(ids) + 1, dtype=np.float64)
+        engine = CCIEngine(ids, kpis)
+        engine.set_hierarchy(Hierarchy(ids, parents, weights))
+
+        engine.update({"d3": {"D1": 0.5}, "d5": {"ECR2": 0.01, "W1": 0.99}})
+        cold = CCIEngine(ids, np.array(engine.kpis))
+        cold.set_hierarchy(Hierarchy(ids, parents, weights))
+        units, results = engine.compute_level(CCIWeights(), "borough")
+        cold_units, cold_results = cold.compute_level(CCIWeights(), "borough")
+        self.assertEqual(units, cold_units)
+        np.testing.assert_array_equal(results, cold_results)
+
+    def test_update_rejects_bad_values(self):
+        ids, kpis = _dataset()
+        engine = CCIEngine(ids, kpis)
+        version = engine.version
+        for changes in (
+            {"nope": {"D1": 0.5}},
+            {"d1": {"X1": 0.5}},
+            {"d1": {"D1": 0.555}},
+            {"d1": {"D1": 1.5}},
+        ):
+            with self.assertRaises(ValueError):
+                engine.update(changes)
+        self.assertEqual(engine.version, version)
+
+
+class RoundingTest(unittest.TestCase):
+    def test_halves_round_up(self):
+        ids, kpis = _dataset(2000, seed=1)
+        engine = CCIEngine(ids, kpis)
+        rng = np.random.default_rng(2)
+        halves = 0
+        for cci_weights in [CCIWeights()] + [_random_weights(rng) for _ in range(5)]:
+            results = engine.compute(cci_weights)
+            self.assertEqual(results.tolist(), _reference(engine.kpis, cci_weights))
+            # Exact halves of a hundredth, which rounding from floats got wrong
+            millionths = engine.kpis @ weight_matrix(cci_weights)
+            halves += int((millionths % SCALE**2 == SCALE**2 // 2).sum())
+        self.assertGreater(halves, 100)
+
+    def test_example_halves(self):
+        # ECR is 0.3 * 0.55 + 0.2 * 0.56 + 0.3 * 0.56 + 0.2 * 0.55 = 0.555
+        kpis = np.zeros((1, len(KPIS)))
+        kpis[0, AREA_SLICES["ECR"]] = [0.55, 0.56, 0.56, 0.55]
+        engine = CCIEngine(["a"], kpis)
+        district = json.loads(encode_districts(engine, engine.compute(CCIWeights())))
+        indicators = district["districts"][0]["indicators"]
+        self.assertEqual(indicators["area_kpis"]["ECR"], "0.56")
+        # The cci is 0.3 * 0.555 = 0.1665
+        self.assertEqual(indicators["cci"], "0.17")
+
+    def test_encodings_agree(self):
+        ids, kpis = _dataset(500, seed=3)
+        engine = CCIEngine(ids, kpis)
+        cci_weights = _random_weights(np.random.default_rng(4))
+        results = engine.compute(cci_weights)
+
+        body = encode_districts(engine, results)
+        self.assertEqual(b"".join(stream_districts(engine, cci_weights, False)), body)
+        scenarios = engine.compute_scenarios([CCIWeights(), cci_weights])
+        self.assertEqual(scenarios[:, 1].tolist(), results[:, -1].tolist())
+
+    def test_matches_history(self):
+        ids, kpis = _dataset(500, seed=5)
+        engine = CCIEngine(ids, kpis)
+        with tempfile.TemporaryDirectory() as directory:
+            history = History(directory)
+            history.append("2025-01", ids, engine.kpis)
+            for indicator in ("ECR", "cci"):
+                values = history.compute(CCIWeights(), indicator)[0]
+                column = engine.compute(CCIWeights())[
+                    :, -1 if indicator == "cci" else 1
+                ]
+                self.assertEqual(round_hundredths(values).tolist(), column.tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
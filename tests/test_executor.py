@@ -0,0 +1,76 @@
+"""Tests of the KPI updates passed on to the model workers."""
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+from api_sk.core import executor
+from api_sk.model.dataset import publish_dataset
+from api_sk.model.engine import KPIS, CCIEngine
+
+CHANGES = [
+    {"d1": {"D1": 0.5}, "d4": {"W2": 0.25}},
+    {"d1": {"D1": 0.75, "M4": 1.0}},
+    {"d9": {"ECR1": 0.0}},
+]
+
+
+def _dataset(n: int = 20) -> tuple[list[str], np.ndarray]:
+    rng = np.random.default_rng(0)
+    return [f"d{i}" for i in range(n)], rng.integers(0, 101, (n, len(KPIS))) / 100
+
+
+class WorkerSyncTest(unittest.TestCase):
+    def setUp(self):
+        ids, kpis = _dataset()
+        self.parent = CCIEngine(ids, kpis)
+        self.base = self.parent.version
+        self.patches = []
+        for changes in CHANGES:
+            self.parent.update(changes)
+            self.patches.append((self.parent.version, changes))
+
+    def sync(self, worker: CCIEngine, path: Path | None, patches: list):
+        with mock.patch.object(executor, "engine", worker):
+            executor._sync(path, self.base, tuple(patches))
+
+    def assert_synced(self, worker: CCIEngine):
+        self.assertEqual(worker.version, self.parent.version)
+        np.testing.assert_array_equal(worker.kpis, self.parent.kpis)
+
+    def test_applies_missing_updates(self):
+        worker = CCIEngine(*_dataset())
+        self.sync(worker, None, self.patches)
+        self.assert_synced(worker)
+
+        # Up to date, or part of the way, only the updates it lacks are applied
+        with mock.patch.object(worker, "update") as update:
+            self.sync(worker, None, self.patches)
+        update.assert_not_called()
+        worker = CCIEngine(*_dataset())
+        worker.update(CHANGES[0])
+        with mock.patch.object(worker, "update", wraps=worker.update) as update:
+            self.sync(worker, None, self.patches)
+        self.assertEqual(update.call_count, len(CHANGES) - 1)
+        self.assert_synced(worker)
+
+    def test_maps_the_dataset_of_the_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            ids, kpis = _dataset()
+            publish_dataset(directory, ids, CCIEngine(ids, kpis).kpis, self.base)
+            path = Path(directory) / self.base
+
+            # A worker holding another dataset maps the one of the workers first
+            worker = CCIEngine(*_dataset(5))
+            self.sync(worker, path, self.patches)
+            self.assert_synced(worker)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Tests of the append-only KPI history and the trajectories computed from it."""
+
+import json
+import os
+import tempfile
+import unittest
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+from api_sk.model.circular import SCALE, CCIWeights
+from api_sk.model.engine import AREA_SLICES, KPIS, RESULT_COLUMNS, weight_matrix
+from api_sk.model.history import MISSING, History, encode_trajectories
+
+
+def _kpis(n: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 101, (n, len(KPIS)))
+
+
+def _round(value: Decimal) -> str:
+    # Two decimals, halves up, as the Indicator type writes them
+    return str(value.quantize(Decimal("0.01"), ROUND_HALF_UP))
+
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.history = History(self.path)
+        self.ids = [f"d{i}" for i in range(6)]
+
+    def trajectories(self, indicator: str, window: int, **period_range) -> dict:
+        values = self.history.compute(CCIWeights(), indicator)
+        body = encode_trajectories(
+            self.history, values, indicator, window, **period_range
+        )
+        return json.loads(body)
+
+    def test_periods_are_appended_in_order(self):
+        self.history.append("2025-01", self.ids, _kpis(6, 0))
+        self.history.append("2025-03", self.ids, _kpis(6, 1))
+        for period in ("2025-03", "2025-02", ""):
+            with self.subTest(period=period), self.assertRaises(ValueError):
+                self.history.append(period, self.ids, _kpis(6, 2))
+        for period in (" 2025-04", "2025\n04"):
+            with self.subTest(period=period), self.assertRaises(ValueError):
+                self.history.append(period, self.ids, _kpis(6, 2))
+        self.assertEqual(self.history.periods, ["2025-01", "2025-03"])
+
+        # Another process sees the periods, and its appends are seen here
+        other = History(self.path)
+        self.assertEqual(other.periods, ["2025-01", "2025-03"])
+        np.testing.assert_array_equal(other.kpis, self.history.kpis)
+        version = self.history.version
+        other.append("2025-04", self.ids, _kpis(6, 3))
+        self.history.refresh()
+        self.assertEqual(self.history.periods[-1], "2025-04")
+        self.assertNotEqual(self.history.version, version)
+
+    def test_missing_districts(self):
+        self.history.append("2025-01", self.ids, _kpis(6, 0))
+        # Later periods may lack districts, in any order, but not add new ones
+        kpis = _kpis(4, 1)
+        missing = self.history.append("2025-02", ["d5", "d0", "d3", "d1"], kpis)
+        self.assertEqual(missing, 2)
+        with self.assertRaises(ValueError):
+            self.history.append("2025-03", ["d0", "x"], _kpis(2, 2))
+        self.assertEqual(len(self.history.periods), 2)
+
+        np.testing.assert_array_equal(self.history.kpis[1, [5, 0, 3, 1]], kpis)
+        values = self.history.compute(CCIWeights(), "cci")
+        self.assertEqual(np.isnan(values[1]).tolist(), [0, 0, 1, 0, 1, 0])
+
+        districts = self.trajectories("cci", 2)["districts"]
+        self.assertEqual([d["id"] for d in districts], self.ids)
+        for district in districts[2], districts[4]:
+            self.assertIsNotNone(district["values"][0])
+            self.assertEqual(district["values"][1:], [None])
+            self.assertEqual(district["deltas"], [None, None])
+            self.assertEqual(district["rolling"], [None, None])
+
+    def test_exact_rounding(self):
+        # ECR is 0.555, then 0.545, then 0.565: halves of a hundredth
+        periods = ["2025-01", "2025-02", "2025-03"]
+        ecr = [[55, 56, 56, 55], [54, 55, 55, 54], [56, 57, 57, 56]]
+        for period, block in zip(periods, ecr):
+            kpis = np.zeros((1, len(KPIS)), dtype=np.int64)
+            kpis[0, AREA_SLICES["ECR"]] = block
+            self.history.append(period, ["a"], kpis)
+
+        (district,) = self.trajectories("ECR", 2)["districts"]
+        self.assertEqual(district["values"], ["0.56", "0.55", "0.57"])
+        # Differences of the rounded values, and means of the exact ones
+        self.assertEqual(district["deltas"], [None, "-0.01", "0.02"])
+        self.assertEqual(district["rolling"], [None, "0.55", "0.56"])
+
+    def test_matches_decimal_reference(self):
+        rng = np.random.default_rng(7)
+        n, periods, window = 300, [f"2025-{m:02d}" for m in range(1, 7)], 3
+        for p, period in enumerate(periods):
+            # The first period defines the districts, later ones lack some
+            ids = [i for i in range(n) if p == 0 or rng.random() > 0.1]
+            self.history.append(period, [f"d{i}" for i in ids], _kpis(len(ids), p))
+
+        for indicator in ("ECR", "cci"):
+            weights = weight_matrix(CCIWeights())[:, RESULT_COLUMNS.index(indicator)]
+            exact = [
+                [
+                    None
+                    if row[0] == MISSING
+                    else Decimal(int(np.dot(row.astype(np.int64), weights))) / SCALE**3
+                    for row in self.history.kpis[p]
+                ]
+                for p in range(len(periods))
+            ]
+            body = self.trajectories(indicator, window, start="2025-02")
+            self.assertEqual(body["periods"], periods[1:])
+            for d, district in enumerate(body["districts"]):
+                series = [exact[p][d] for p in range(len(periods))]
+                values = [None if v is None else _round(v) for v in series]
+                deltas = [None] + [
+                    None if a is None or b is None else _round(Decimal(b) - Decimal(a))
+                    for a, b in zip(values, values[1:])
+                ]
+                rolling = [
+                    None
+                    if p + 1 < window or None in series[p + 1 - window : p + 1]
+                    else _round(sum(series[p + 1 - window : p + 1]) / window)
+                    for p in range(len(periods))
+                ]
+                self.assertEqual(district["values"], values[1:])
+                self.assertEqual(district["deltas"], deltas[1:])
+                self.assertEqual(district["rolling"], rolling[1:])
+            self.assertEqual(len(body["districts"]), n)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+"""Tests of the ingestion of KPI files and of the published dataset versions."""
+
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+from api_sk.model.dataset import (
+    CURRENT,
+    dataset_version,
+    is_dataset,
+    publish_dataset,
+    read_dataset,
+)
+from api_sk.model.engine import KPIS
+from api_sk.model.ingest import IngestError, ingest
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+def _kpis(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 101, (n, len(KPIS)))
+
+
+def _csv(ids: list[str], kpis: np.ndarray, columns: list[str] | None = None) -> bytes:
+    # KPI columns in reverse order, since any order is accepted
+    columns = columns or ["id", *reversed(KPIS)]
+    lines = [",".join(columns)]
+    for district_id, row in zip(ids, kpis.tolist()):
+        values = dict(zip(KPIS, (f"{v / 100:.2f}" for v in row)), id=district_id)
+        lines.append(",".join(values[name] for name in columns))
+    return ("\n".join(lines) + "\n").encode()
+
+
+class IngestCSVTest(unittest.TestCase):
+    def ingest(self, data: bytes, **kwargs):
+        return ingest(io.BytesIO(data), "csv", chunk_rows=4, **kwargs)
+
+    def test_valid_file(self):
+        ids, kpis = [f"d{i}" for i in range(10)], _kpis(10)
+        read_ids, read_kpis, report = self.ingest(_csv(ids, kpis))
+        self.assertEqual(read_ids, ids)
+        self.assertEqual(read_kpis.dtype, np.int64)
+        np.testing.assert_array_equal(read_kpis, kpis)
+        self.assertEqual(report, {"rows": 10, "valid": 10, "invalid": 0, "errors": []})
+
+    def test_bad_rows(self):
+        ids, kpis = [f"d{i}" for i in range(10)], _kpis(10)
+        rows = [line.split(",") for line in _csv(ids, kpis).decode().splitlines()]
+        # Rows are numbered from 1 after the header, over chunks of 4 rows
+        rows[2][1] = "x"
+        rows[4].pop()
+        rows[6][0] = "d0"
+        rows[9][1] = "1.5"
+        data = "".join(",".join(row) + "\n" for row in rows).encode()
+
+        read_ids, read_kpis, report = self.ingest(data)
+        self.assertIsNone(read_kpis)
+        self.assertEqual(
+            (report["rows"], report["valid"], report["invalid"]), (10, 6, 4)
+        )
+        errors = {error["row"]: error["error"] for error in report["errors"]}
+        self.assertEqual(sorted(errors), [2, 4, 6, 9])
+        self.assertIn("is not a number", errors[2])
+        self.assertEqual(errors[4], f"Expected {len(KPIS) + 1} fields.")
+        self.assertEqual(errors[6], "Repeated ID.")
+        self.assertIn("between 0 and 1", errors[9])
+
+        # The good rows are kept when bad ones are skipped
+        read_ids, read_kpis, same = self.ingest(data, skip_invalid=True)
+        self.assertEqual(same, report)
+        good = [0, 2, 4, 6, 7, 9]
+        self.assertEqual(read_ids, [ids[i] for i in good])
+        np.testing.assert_array_equal(read_kpis, kpis[good])
+
+    def test_repeated_ids_keep_the_first(self):
+        ids, kpis = ["a", "b", "a", "", "b"], _kpis(5)
+        read_ids, read_kpis, report = self.ingest(_csv(ids, kpis), skip_invalid=True)
+        self.assertEqual(read_ids, ["a", "b"])
+        np.testing.assert_array_equal(read_kpis, kpis[:2])
+        self.assertEqual(
+            [error["error"] for error in report["errors"]],
+            ["Repeated ID.", "Empty ID.", "Repeated ID."],
+        )
+
+    def test_max_errors(self):
+        kpis = np.full((10, len(KPIS)), 200)
+        _, _, report = self.ingest(
+            _csv([f"d{i}" for i in range(10)], kpis), max_errors=3
+        )
+        self.assertEqual(report["invalid"], 10)
+        self.assertEqual([error["row"] for error in report["errors"]], [1, 2, 3])
+
+    def test_no_valid_rows(self):
+        kpis = np.full((2, len(KPIS)), 200)
+        ids, read_kpis, _ = self.ingest(_csv(["a", "b"], kpis), skip_invalid=True)
+        self.assertEqual((ids, read_kpis), ([], None))
+
+    def test_unreadable_files(self):
+        with self.assertRaises(IngestError):
+            self.ingest(b"")
+        with self.assertRaises(IngestError):
+            self.ingest(_csv(["a"], _kpis(1), ["id", *KPIS[1:]]))
+        with self.assertRaises(IngestError):
+            ingest(io.BytesIO(b"id\n"), "xlsx")
+
+
+@unittest.skipUnless(HAS_PYARROW, "pyarrow is not installed")
+class IngestParquetTest(unittest.TestCase):
+    def parquet(self, ids: list[str], kpis: np.ndarray) -> io.BytesIO:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = {"id": ids} | {kpi: kpis[:, k] / 100 for k, kpi in enumerate(KPIS)}
+        file = io.BytesIO()
+        pq.write_table(pa.table(columns), file)
+        file.seek(0)
+        return file
+
+    def test_bad_rows(self):
+        ids, kpis = ["a", "b", "c", "a"], _kpis(4).astype(np.float64)
+        kpis[1, 0] = 150
+        file = self.parquet(ids, kpis)
+        read_ids, read_kpis, report = ingest(file, "parquet", chunk_rows=2)
+        self.assertIsNone(read_kpis)
+        self.assertEqual([error["row"] for error in report["errors"]], [2, 4])
+
+        file.seek(0)
+        read_ids, read_kpis, _ = ingest(file, "parquet", True, chunk_rows=2)
+        self.assertEqual(read_ids, ["a", "c"])
+        np.testing.assert_array_equal(read_kpis, kpis[[0, 2]])
+
+
+class DatasetTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "kpis"
+        self.ids = [f"d{i}" for i in range(8)]
+
+    def test_publish_and_read(self):
+        kpis = _kpis(8)
+        version = publish_dataset(self.path, self.ids, kpis)
+        self.assertEqual(version, dataset_version(self.ids, kpis))
+        self.assertTrue(is_dataset(self.path))
+
+        ids, mapped, read_version, directory = read_dataset(self.path)
+        self.assertEqual((ids, read_version), (self.ids, version))
+        self.assertEqual(directory, self.path / version)
+        self.assertIsInstance(mapped, np.memmap)
+        self.assertFalse(mapped.flags.writeable)
+        np.testing.assert_array_equal(mapped, kpis)
+
+    def test_current_is_swapped(self):
+        first = publish_dataset(self.path, self.ids, _kpis(8, 0))
+        _, mapped, _, directory = read_dataset(self.path)
+        second = publish_dataset(self.path, self.ids, _kpis(8, 1))
+
+        # Readers see the new version, and the previous one stays readable
+        self.assertEqual((self.path / CURRENT).read_text(), second)
+        self.assertEqual(read_dataset(self.path)[2], second)
+        self.assertEqual(read_dataset(directory)[2], first)
+        np.testing.assert_array_equal(mapped, _kpis(8, 0))
+        # Nothing is left from staging
+        self.assertEqual(
+            sorted(entry.name for entry in self.path.iterdir()),
+            sorted([CURRENT, first, second]),
+        )
+
+    def test_older_versions_are_pruned(self):
+        versions = [publish_dataset(self.path, self.ids, _kpis(8, s)) for s in range(4)]
+        names = {entry.name for entry in self.path.iterdir()}
+        self.assertEqual(names, {CURRENT, *versions[-2:]})
+
+        # Publishing the current version again keeps it
+        self.assertEqual(
+            publish_dataset(self.path, self.ids, _kpis(8, 3)), versions[-1]
+        )
+        self.assertEqual(read_dataset(self.path)[2], versions[-1])
+
+    def test_rejects_float_kpis(self):
+        with self.assertRaises(ValueError):
+            publish_dataset(self.path, self.ids, _kpis(8) / 100)
+        self.assertFalse((self.path / CURRENT).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
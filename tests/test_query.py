@@ -0,0 +1,141 @@
+"""Tests of the top-k, range filter and cursor pagination queries."""
+
+import json
+import os
+import unittest
+
+import numpy as np
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+from api_sk.model.circular import SCALE, CCIWeights
+from api_sk.model.engine import KPIS, RESULT_COLUMNS, CCIEngine
+from api_sk.model.query import (
+    QueryError,
+    ResultIndex,
+    decode_cursor,
+    encode_cursor,
+    encode_page,
+    parse_ranges,
+)
+
+
+def _index(n: int = 2000) -> ResultIndex:
+    rng = np.random.default_rng(0)
+    ids = [f"d{i}" for i in range(n)]
+    engine = CCIEngine(ids, rng.integers(0, 101, (n, len(KPIS))) / 100)
+    return ResultIndex(engine, engine.compute(CCIWeights()))
+
+
+def _reference(index: ResultIndex, sort_by: str, descending: bool, ranges: dict):
+    # Rows within the ranges by value, ties broken by the row in either order
+    results = index.hundredths
+    column = RESULT_COLUMNS.index(sort_by)
+    rows = [
+        row
+        for row in range(len(index))
+        if all(
+            low <= results[row, RESULT_COLUMNS.index(name)] <= high
+            for name, (low, high) in ranges.items()
+        )
+    ]
+    sign = -1 if descending else 1
+    return sorted(rows, key=lambda row: (sign * results[row, column], row))
+
+
+class ResultIndexTest(unittest.TestCase):
+    def pages(
+        self,
+        index: ResultIndex,
+        sort_by: str,
+        descending: bool,
+        ranges: dict,
+        limit: int,
+    ) -> list[int]:
+        rows, after = index.query(sort_by, descending, limit, ranges)
+        pages = [rows.tolist()]
+        while after is not None:
+            rows, after = index.query(sort_by, descending, limit, ranges, after)
+            self.assertLessEqual(len(rows), limit)
+            pages.append(rows.tolist())
+        self.assertTrue(all(len(page) == limit for page in pages[:-1]))
+        return sum(pages, [])
+
+    def test_sorting_and_pagination(self):
+        index = _index()
+        for sort_by in ("cci", "W"):
+            for descending in (True, False):
+                for ranges in (
+                    {},
+                    {"cci": (40, 60)},
+                    {sort_by: (30, 70), "D": (0, 50)},
+                ):
+                    with self.subTest(sort_by=sort_by, desc=descending, ranges=ranges):
+                        expected = _reference(index, sort_by, descending, ranges)
+                        rows = self.pages(index, sort_by, descending, ranges, 97)
+                        self.assertEqual(rows, expected)
+
+    def test_first_page_with_and_without_index(self):
+        # The first page is selected by a partial sort until the order is built
+        index = _index()
+        ranges = {"M": (20, 80)}
+        first, after = index.query("cci", True, 50, ranges)
+        self.assertFalse(index.has_order(RESULT_COLUMNS.index("cci"), True))
+        index.order(RESULT_COLUMNS.index("cci"), True)
+        self.assertEqual(
+            index.query("cci", True, 50, ranges)[0].tolist(), first.tolist()
+        )
+        self.assertEqual(index.query("cci", True, 50, ranges)[1], after)
+
+    def test_ties_keep_every_row_once(self):
+        # Few distinct values, so pages split groups of equal values
+        index = _index(500)
+        rows = self.pages(index, "D", False, {}, 7)
+        self.assertEqual(sorted(rows), list(range(500)))
+        values = index.hundredths[rows, RESULT_COLUMNS.index("D")].tolist()
+        self.assertEqual(values, sorted(values))
+
+    def test_empty_range(self):
+        index = _index(100)
+        rows, after = index.query("cci", True, 10, {"cci": (60, 40)})
+        self.assertEqual((rows.tolist(), after), ([], None))
+
+    def test_encode_page(self):
+        index = _index(10)
+        rows, _ = index.query("cci", True, 3, {})
+        page = json.loads(encode_page(index, rows, "next"))
+        self.assertEqual(page["next_cursor"], "next")
+        self.assertEqual([d["id"] for d in page["districts"]], [f"d{r}" for r in rows])
+        cci = page["districts"][0]["indicators"]["cci"]
+        self.assertEqual(cci, f"{index.hundredths[rows[0], -1] / SCALE:.2f}")
+
+
+class ParseTest(unittest.TestCase):
+    def test_parse_ranges(self):
+        self.assertEqual(parse_ranges([]), {})
+        self.assertEqual(
+            parse_ranges(["cci:0.4:0.6", "W::0.3", "D:0.5:"]),
+            {"cci": (40, 60), "W": (0, 30), "D": (50, SCALE)},
+        )
+        # Filters on the same column are intersected
+        self.assertEqual(
+            parse_ranges(["cci:0.2:0.8", "cci:0.5:", "cci::0.9"]), {"cci": (50, 80)}
+        )
+
+    def test_parse_ranges_errors(self):
+        for item in ("nope:0:1", "cci:0.5", "cci:0:1:2", "cci:abc:1", "cci:0.555:"):
+            with self.subTest(item=item), self.assertRaises(QueryError):
+                parse_ranges([item])
+
+    def test_cursor(self):
+        cursor = encode_cursor("query-v1", 12345)
+        self.assertEqual(decode_cursor(cursor, "query-v1"), 12345)
+        with self.assertRaises(QueryError):
+            decode_cursor(cursor, "query-v2")
+        for malformed in ("", "!!!", encode_cursor("query-v1", 1)[:-4]):
+            with self.subTest(cursor=malformed), self.assertRaises(QueryError):
+                decode_cursor(malformed, "query-v1")
+
+
+if __name__ == "__main__":
+    unittest.main()
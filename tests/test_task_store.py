@@ -0,0 +1,98 @@
+"""Tests of the task registry shared by the workers."""
+
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+from api_sk.core.task_store import SQLiteTaskStore
+from api_sk.schemas.schemas import ModelTask
+
+
+def _task(status: str = "Queued") -> ModelTask:
+    return ModelTask(start_time="2026-01-01 00:00:00", type="circular", status=status)
+
+
+class SQLiteTaskStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "tasks.db")
+        self.store = SQLiteTaskStore(self.path, max_finished=2, ttl=0.5)
+
+    def _finish(self, task_id: str):
+        task_ob = _task("Completed")
+        task_ob.end_time = "2026-01-01 00:00:01"
+        task_ob.result = {"ok": True}
+        self.store.finish(task_id, task_ob)
+
+    def test_reads_do_not_write(self):
+        self.store.add("a", _task(), "owner")
+        self.store.add("b", _task(), "owner")
+        self._finish("b")
+
+        # A separate connection's data_version changes when others commit
+        connection = sqlite3.connect(self.path)
+        self.addCleanup(connection.close)
+        before = connection.execute("PRAGMA data_version").fetchone()[0]
+        version = self.store.version()
+        for _ in range(3):
+            self.assertEqual(self.store.get("b").result, {"ok": True})
+            self.assertEqual(len(self.store.page(0, 10)), 2)
+            self.assertEqual(self.store.counts(), {"Queued": 1, "Completed": 1})
+            self.assertEqual(len(self.store), 2)
+            self.assertEqual(self.store.version(), version)
+        after = connection.execute("PRAGMA data_version").fetchone()[0]
+        self.assertEqual(after, before)
+
+    def test_status(self):
+        self.store.add("a", _task(), "owner")
+        self.assertEqual(self.store.status("a"), "Queued")
+        self._finish("a")
+        self.assertEqual(self.store.status("a"), "Completed")
+        self.assertIsNone(self.store.status("b"))
+
+        # Checking the status is a use of the task, as getting it is
+        self.store.add("b", _task(), "owner")
+        self._finish("b")
+        self.store.status("a")
+        self.store.add("c", _task(), "owner")
+        self._finish("c")
+        self.assertEqual(self.store.status("a"), "Completed")
+        self.assertIsNone(self.store.status("b"))
+
+    def test_expired_tasks_are_hidden_until_purged(self):
+        self.store.add("a", _task(), "owner")
+        self._finish("a")
+        version = self.store.version()
+        time.sleep(0.6)
+
+        self.assertIsNone(self.store.get("a"))
+        self.assertEqual(self.store.page(0, 10), {})
+        self.assertEqual(self.store.counts(), {})
+        self.assertEqual(len(self.store), 0)
+        expired = self.store.version()
+        self.assertNotEqual(expired, version)
+
+        self.store.purge()
+        self.assertNotIn(self.store.version(), (version, expired))
+        (rows,) = self.store._connection().execute("SELECT COUNT(*) FROM tasks")
+        self.assertEqual(rows, (0,))
+
+    def test_eviction_uses_reads(self):
+        for task_id in ("a", "b"):
+            self.store.add(task_id, _task(), "owner")
+            self._finish(task_id)
+        self.store.get("a")  # Now used more recently than b
+
+        self.store.add("c", _task(), "owner")
+        self._finish("c")
+        self.assertIsNotNone(self.store.get("a"))
+        self.assertIsNone(self.store.get("b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
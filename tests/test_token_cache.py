@@ -0,0 +1,85 @@
+"""Tests of the cache of verified tokens."""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+from api_sk.auth.token_cache import TokenCache
+
+USERS = [f"user{i}" for i in range(8)]
+
+
+class TokenCacheTest(unittest.TestCase):
+    def test_get_put(self):
+        cache = TokenCache(2)
+        exp = time.time() + 60
+        cache.put("a", {"user": "heman", "exp": exp})
+        cache.put("b", {"user": "heman", "exp": exp})
+        self.assertEqual(cache.get("a")["user"], "heman")
+        cache.put("c", {"user": "skeletor", "exp": exp})  # Evicts b, used least
+        self.assertIsNone(cache.get("b"))
+        cache.drop_user("heman")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_expired(self):
+        cache = TokenCache(2)
+        cache.put("a", {"user": "heman", "exp": time.time() - 1})
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_concurrent_access(self):
+        # A small cache, so puts keep evicting, and frequent thread switches
+        cache = TokenCache(16)
+        errors = []
+        stop = time.monotonic() + 2
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+        def run(worker: int):
+            i = 0
+            try:
+                while time.monotonic() < stop:
+                    i += 1
+                    user = USERS[(worker + i) % len(USERS)]
+                    token = f"{user}-{i % 32}"
+                    # Some entries expire, so gets delete them too
+                    exp = time.time() + (60 if i % 5 else -1)
+                    if worker % 4 == 0:
+                        cache.drop_user(user)
+                    elif worker % 4 == 1:
+                        cache.put(token, {"user": user, "exp": exp})
+                    elif worker % 4 == 2:
+                        payload = cache.get(token)
+                        if payload is not None:
+                            self.assertEqual(payload["user"], user)
+                    else:
+                        len(cache)
+                        cache.stats()
+                        if i % 1000 == 0:
+                            cache.clear()
+            except Exception as e:  # noqa: BLE001 - reported below
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(12)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(cache), cache.max_entries)
+        stats = cache.stats()
+        self.assertGreater(stats["hits"] + stats["misses"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()